@@ -0,0 +1,184 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+# 計測の既定設定（settings.PERFORMANCE_METRICSで上書き可能）
+DEFAULTS = {
+    # Server-Timingヘッダーを付与するか
+    'SERVER_TIMING': True,
+    # ルートごとの集計の最大数（これを超えたルートは 'other' にまとめる）
+    'MAX_ROUTES': 200,
+}
+
+# 処理中のリクエストの計測値（PerformanceMetricsMiddlewareが設定する）
+current_request = contextvars.ContextVar('request_metrics', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PERFORMANCE_METRICS', {})}
+
+
+class Histogram:
+    """対数スケールのバケットによる固定サイズのヒストグラム
+
+    値をすべて保持せずにパーセンタイルを求める（誤差はバケットの幅である約20%以内）。
+    """
+    MIN_VALUE = 0.01
+    GROWTH = 1.2
+    BUCKETS = 100
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value <= self.MIN_VALUE:
+            index = 0
+        else:
+            index = min(int(math.log(value / self.MIN_VALUE, self.GROWTH)) + 1, self.BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """パーセンタイルの近似値（該当するバケットの上限、最大値を超えない）"""
+        if not self.count:
+            return 0.0
+        threshold = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(self.MIN_VALUE * self.GROWTH ** index, self.max)
+        return self.max
+
+    def summary(self, digits=2):
+        return {
+            'p50': round(self.percentile(50), digits),
+            'p95': round(self.percentile(95), digits),
+            'p99': round(self.percentile(99), digits),
+            'max': round(self.max, digits),
+            'mean': round(self.total / self.count, digits) if self.count else 0.0,
+        }
+
+
+class RouteStats:
+    """1つのルートの集計値"""
+    __slots__ = ('duration', 'db_time', 'queries', 'serialize', 'render', 'bytes', 'errors')
+
+    def __init__(self):
+        self.duration = Histogram()
+        self.db_time = Histogram()
+        self.queries = Histogram()
+        self.serialize = Histogram()
+        self.render = Histogram()
+        self.bytes = 0
+        self.errors = 0
+
+
+class RequestMetrics:
+    """1リクエスト分の計測値"""
+    __slots__ = ('queries', 'db_time', 'phases')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = {}
+
+    def wrap_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapperに渡すクエリの計測"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """処理中のリクエストの区間（serialize、renderなど）の時間を計測"""
+    metrics = current_request.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_phase(name, time.perf_counter() - start)
+
+
+class MetricsRegistry:
+    """ルートごとの集計値をプロセス内に保持する（ワーカープロセスごとに独立）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self.started_at = time.time()
+
+    def record(self, route, duration, metrics, size, status_code):
+        """1リクエストの計測値を集計に加える（時間は秒で受け取り、ミリ秒で保持）"""
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                if len(self._routes) >= get_config()['MAX_ROUTES']:
+                    route = 'other'
+                    stats = self._routes.get(route)
+                if stats is None:
+                    stats = self._routes[route] = RouteStats()
+            stats.duration.add(duration * 1000)
+            stats.db_time.add(metrics.db_time * 1000)
+            stats.queries.add(metrics.queries)
+            stats.serialize.add(metrics.phases.get('serialize', 0.0) * 1000)
+            stats.render.add(metrics.phases.get('render', 0.0) * 1000)
+            stats.bytes += size
+            stats.errors += status_code >= 500
+
+    def snapshot(self):
+        """ルートごとの集計結果（時間はミリ秒）"""
+        with self._lock:
+            routes = {}
+            for route, stats in sorted(self._routes.items()):
+                count = stats.duration.count
+                routes[route] = {
+                    'count': count,
+                    'errors': stats.errors,
+                    'duration_ms': stats.duration.summary(),
+                    'db_time_ms': stats.db_time.summary(),
+                    'queries': stats.queries.summary(digits=1),
+                    'serialize_ms': stats.serialize.summary(),
+                    'render_ms': stats.render.summary(),
+                    'bytes_mean': round(stats.bytes / count) if count else 0,
+                }
+            return {'since': self.started_at, 'routes': routes}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self.started_at = time.time()
+
+
+registry = MetricsRegistry()
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONへの変換時間をrenderとして計測するレンダラー（出力はJSONRendererと同じ）"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with phase('render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,138 @@
+import re
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import RequestMetrics, current_request, get_config, registry
+
+try:
+    import brotli
+except ImportError:  # brotliは任意の依存パッケージ
+    brotli = None
+
+accepts_brotli_re = re.compile(r'\bbr\b')
+
+
+class BrotliMiddleware(MiddlewareMixin):
+    """Accept-Encodingにbrを含むクライアントへのレスポンスをbrotliで圧縮する
+
+    brotliがインストールされていない場合は無効になる。GZipMiddlewareより下（内側）に置くと、
+    brotliを受け付けるクライアントにはbrotli、それ以外にはgzipで圧縮される。
+    ストリーミングレスポンスはGZipMiddlewareに任せる。
+    """
+    # これより小さいレスポンスは圧縮しない
+    min_length = 200
+    # 圧縮率と速度のバランスを取った品質（0-11）
+    quality = 5
+
+    def __init__(self, get_response):
+        if brotli is None:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding') or len(response.content) < self.min_length:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if not accepts_brotli_re.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+
+        compressed = brotli.compress(response.content, quality=self.quality)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # 圧縮後の内容は元の内容とバイト単位では一致しないため、GZipMiddlewareと同様に弱いETagにする
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+class PerformanceMetricsMiddleware:
+    """リクエストごとの処理時間・クエリ数とクエリ時間・シリアライズ時間・レスポンスサイズを計測する
+
+    計測値はServer-Timingヘッダーとして返し、ルート（ビュー名とメソッド）ごとのヒストグラムに集計する
+    （/api/_metrics で参照）。クエリの計測はconnection.execute_wrapperで行うため、
+    本番環境で常時有効にしても1クエリあたりの負荷はわずかである。
+    MIDDLEWAREの先頭に置くと、圧縮を含めた全体の時間と送信サイズを計測できる。
+
+    ASGIでは非同期ミドルウェアとして動作し、リクエストごとにスレッドへ切り替えない。非同期ビューのクエリは
+    リクエストごとのスレッド（sync_to_async）で実行され、DB接続もスレッドごとに異なるため、
+    クエリの計測はそのスレッドの接続に設定する。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack, metrics)
+                response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, time.perf_counter() - start, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        start = time.perf_counter()
+        stack = ExitStack()
+        try:
+            await sync_to_async(self.wrap_connections)(stack, metrics)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, time.perf_counter() - start, metrics)
+
+    @staticmethod
+    def wrap_connections(stack, metrics):
+        """現在のスレッドのDB接続にクエリの計測を設定（stackを閉じると解除される）"""
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics.wrap_query))
+
+    def finish(self, request, response, duration, metrics):
+        """計測値を集計に加え、Server-Timingヘッダーを付与する"""
+        # ストリーミングレスポンスは本文の送信前に計測を終えるため、サイズは数えない
+        size = 0 if response.streaming else len(response.content)
+        registry.record(self.route_name(request), duration, metrics, size, response.status_code)
+        if get_config()['SERVER_TIMING']:
+            response['Server-Timing'] = self.server_timing(duration, metrics)
+        return response
+
+    @staticmethod
+    def route_name(request):
+        """集計に使うルート名（URLのパラメータを含めないようにビュー名を使用）"""
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return f'{request.method} unmatched'
+        return f'{request.method} {match.view_name}'
+
+    @staticmethod
+    def server_timing(duration, metrics):
+        entries = [
+            f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries"',
+        ]
+        for name, seconds in metrics.phases.items():
+            entries.append(f'{name};dur={seconds * 1000:.2f}')
+        entries.append(f'total;dur={duration * 1000:.2f}')
+        return ', '.join(entries)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,7 +44,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # リクエストごとの処理時間・クエリ数の計測（先頭に置き、圧縮を含めた全体を計測する）
+    'backend.middleware.PerformanceMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # JSONレスポンスの圧縮（brotliがインストールされていればbrotliを優先）
+    'django.middleware.gzip.GZipMiddleware',
+    'backend.middleware.BrotliMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,9 +86,64 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DJANGO_SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        # テストDBをファイルにして、複数スレッドからの同時書き込みを検証できるようにする
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# SQLiteの本番用プロファイル（DJANGO_DB_PROFILE=production で有効化）
+# 複数のGunicornワーカーからの同時書き込みで "database is locked" にならないよう、
+# WALモード・ビジータイムアウトを有効にし、接続を使い回す。
+# SQLITE_PRAGMASは接続作成時に cart/db.py で適用される
+SQLITE_PRAGMAS = {}
+if os.environ.get('DJANGO_DB_PROFILE') == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # ロック解除を待つ時間（秒）
+        'OPTIONS': {'timeout': 20},
+    })
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 20000,
+        'mmap_size': 268435456,
+        'cache_size': -32000,
+        'temp_store': 'MEMORY',
     }
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# 複数のGunicornワーカーでキャッシュ（キャッシュセッションなど）を共有する場合は、
+# 環境変数でファイルベースなどの共有バックエンドを指定する
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/4.2/topics/http/sessions/#configuring-the-session-engine
+# 匿名カートはセッション内のカートキーで識別するため、どのエンジンでも動作する
+#   db             : django_sessionテーブル（既定）
+#   cached_db      : キャッシュ + DB（読み込みはキャッシュ、書き込みはDBにも反映）
+#   cache          : キャッシュのみ（DBアクセスなし、共有キャッシュが必要）
+#   signed_cookies : 署名付きCookie（サーバー側の保存なし）
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
 }
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get('DJANGO_SESSION_BACKEND', 'db')]
 
 
 # Password validation
@@ -137,6 +198,54 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # JSONへの変換時間を計測するレンダラー（出力はJSONRendererと同じ）
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
+
+# 年別ランキングページのキャッシュ設定（cart/cache.py）
+# SHARED_ALIASにCACHESのエイリアスを指定すると、ワーカー間で共有されるキャッシュ層が有効になる
+NOVEL_RANKING_CACHE = {
+    'MAX_ENTRIES': 256,
+    'LOCAL_TIMEOUT': 60,
+    'SHARED_ALIAS': None,
+    'SHARED_TIMEOUT': 300,
+}
+
+# 匿名カートの保持戦略：Falseはセッション終了後にカートの内容を保持しないことを意味する
+CART_PERSIST_AFTER_SESSION = False
+# 匿名カートを期限切れとみなす非アクティブ時間（秒）。sweep_cartsコマンドが削除する
+CART_INACTIVITY_TIMEOUT = 1800
+
+# 年別ランキングのスナップショット（cart/snapshots.py）を書き出すディレクトリ
+RANKING_SNAPSHOT_DIR = os.environ.get('DJANGO_RANKING_SNAPSHOT_DIR', BASE_DIR / 'ranking_snapshots')
+
+# ランキング画像の変換設定（cart/images.py、manage.py build_images）
+NOVEL_IMAGES = {
+    'SOURCE_DIR': BASE_DIR / 'public' / 'image',
+    'SOURCE_URL': '/image/',
+    'OUTPUT_DIR': BASE_DIR / 'public' / 'image' / 'build',
+    'OUTPUT_URL': '/image/build/',
+    'WIDTHS': (160, 320, 640),
+    'FORMATS': {'avif': 50, 'webp': 75},
+}
+
+# ログイン・登録時のパスワードのハッシュ計算の同時実行数（cart/hashing.py）
+# 上限に達している場合は MAX_WAIT 秒だけ待ち、それでも空かなければ503を返す
+PASSWORD_HASHING = {
+    'MAX_WAIT': 0.5,
+    # ワーカープロセス間で共有するスロットのロックファイル（0700で作成）
+    'LOCK_DIR': os.environ.get('DJANGO_PASSWORD_HASHING_LOCK_DIR', BASE_DIR / 'password_hashing_locks'),
+}
+if os.environ.get('DJANGO_PASSWORD_HASHING_CONCURRENCY'):
+    PASSWORD_HASHING['MAX_CONCURRENT'] = int(os.environ['DJANGO_PASSWORD_HASHING_CONCURRENCY'])
+
+# リクエストの計測（backend/middleware.py PerformanceMetricsMiddleware、/api/_metrics）
+PERFORMANCE_METRICS = {
+    'SERVER_TIMING': True,
+    'MAX_ROUTES': 200,
+}
@@ -0,0 +1,49 @@
+"""ベンチマーク用のDjango初期化処理
+
+本番のdb.sqlite3には触れず、テスト用データベースを作成してその上で計測する。
+"""
+import contextlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup():
+    """Djangoを初期化する"""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database():
+    """テスト用データベースを作成し、終了時に削除する"""
+    setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def create_novels(count, years=(2025,)):
+    """計測用の小説をまとめて作成する"""
+    from decimal import Decimal
+    from cart.models import Novel
+
+    novels = []
+    for i in range(count):
+        year = years[i % len(years)]
+        novels.append(Novel(
+            name=f'小説{i}', author=f'作者{i % 500}', publisher='出版社',
+            rank=i // len(years) + 1, price=Decimal('680.00'), year=year,
+        ))
+    return Novel.objects.bulk_create(novels, batch_size=5000)
@@ -0,0 +1,170 @@
+"""同期版（Gunicornの同期ワーカー）と非同期版（uvicorn、ASGI）のAPIのスループット比較
+
+同じSQLiteファイルを使うサーバーを2つ起動し、同時接続数ごとに一定時間リクエストを送り続けて、
+1秒あたりのリクエスト数とレイテンシ（p50・p99）を比較する。
+ランキングキャッシュの効果を除くため、小説リストはページをランダムに変えて取得する。
+
+    python benchmarks/bench_asgi.py [ワーカー数] [計測秒数] [同時接続数...]
+
+Gunicornとuvicornが必要（pip install gunicorn uvicorn）。
+"""
+import asyncio
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import _django
+
+HOST = '127.0.0.1'
+CONCURRENCY = (50, 100, 250, 500)
+NOVELS = 2000
+# 1ページ10件で取得するページ数
+PAGES = NOVELS // 10
+
+SERVERS = {
+    'gunicorn (sync)': (
+        'gunicorn', '--workers', '{workers}', '--bind', f'{HOST}:{{port}}', '--backlog', '2048',
+        '--log-level', 'warning', 'backend.wsgi:application',
+    ),
+    'uvicorn (asgi)': (
+        'uvicorn', '--workers', '{workers}', '--host', HOST, '--port', '{port}', '--backlog', '2048',
+        '--log-level', 'warning', '--no-access-log', 'backend.asgi:application',
+    ),
+}
+
+# サーバー名 -> 計測するパスの一覧（novel_idは計測用の小説IDに置き換える）
+ENDPOINTS = {
+    'gunicorn (sync)': ('/api/novels/?count=false&page={page}', '/api/novels/{novel_id}/'),
+    'uvicorn (asgi)': ('/api/async/novels/?count=false&page={page}', '/api/async/novels/{novel_id}/'),
+}
+
+
+def prepare_database(db_path):
+    """マイグレーションを適用し、計測用の小説を作成してIDの一覧を返す"""
+    env = {**os.environ, 'DJANGO_SQLITE_PATH': db_path}
+    subprocess.run([sys.executable, os.path.join(_django.ROOT, 'manage.py'), 'migrate', '-v', '0'], env=env, check=True)
+    script = (
+        'import sys; sys.path.insert(0, %r); import _django; _django.setup(); '
+        'print(",".join(str(n.pk) for n in _django.create_novels(%d)))'
+    ) % (os.path.dirname(os.path.abspath(__file__)), NOVELS)
+    output = subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True, text=True)
+    return [int(pk) for pk in output.stdout.strip().split(',')]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(name, workers, db_path, env=None):
+    port = free_port()
+    command = [part.format(workers=workers, port=port) for part in SERVERS[name]]
+    env = {**os.environ, 'DJANGO_SQLITE_PATH': db_path, 'DJANGO_DB_PROFILE': 'production', **(env or {})}
+    process = subprocess.Popen(command, cwd=_django.ROOT, env=env, start_new_session=True)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'{name} が起動しませんでした')
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout=30)
+
+
+async def request(port, path, connection, body=None):
+    """HTTP/1.1のリクエストを1回送り、(ステータス, 接続) を返す（サーバーが接続を閉じた場合は再接続する）
+
+    bodyを指定した場合はJSONの本文としてPOSTする。
+    """
+    if connection is None:
+        connection = await asyncio.open_connection(HOST, port)
+    reader, writer = connection
+    if body is None:
+        head = f'GET {path} HTTP/1.1\r\n'
+    else:
+        head = f'POST {path} HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+    writer.write(f'{head}Host: localhost\r\nConnection: keep-alive\r\n\r\n'.encode('ascii') + (body or b''))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+    headers = {key.lower(): value for key, value in headers.items()}
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    if headers.get('connection', '').lower() == 'close':
+        writer.close()
+        connection = None
+    return status, connection
+
+
+async def client(port, paths, novel_ids, deadline, latencies, errors):
+    """1つの接続から計測終了までリクエストを送り続ける"""
+    connection = None
+    while time.perf_counter() < deadline:
+        path = random.choice(paths).format(page=random.randint(1, PAGES), novel_id=random.choice(novel_ids))
+        start = time.perf_counter()
+        try:
+            status, connection = await request(port, path, connection)
+        except (OSError, asyncio.IncompleteReadError):
+            errors.append(1)
+            connection = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(status)
+    if connection is not None:
+        connection[1].close()
+
+
+async def load(port, paths, novel_ids, concurrency, seconds):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*(
+        client(port, paths, novel_ids, deadline, latencies, errors) for _ in range(concurrency)
+    ))
+    return latencies, errors
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0.0
+
+
+def main(argv):
+    workers = int(argv[0]) if len(argv) > 0 else 4
+    seconds = float(argv[1]) if len(argv) > 1 else 10
+    levels = [int(value) for value in argv[2:]] or CONCURRENCY
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.sqlite3')
+        novel_ids = prepare_database(db_path)
+        print(f'{workers} workers, {seconds:g}s per level, {len(novel_ids)} novels')
+        print(f'{"server":<16} {"conns":>6} {"req/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for name in SERVERS:
+            process, port = start_server(name, workers, db_path)
+            try:
+                asyncio.run(load(port, ENDPOINTS[name], novel_ids, 10, 1))  # ウォームアップ
+                for concurrency in levels:
+                    latencies, errors = asyncio.run(load(port, ENDPOINTS[name], novel_ids, concurrency, seconds))
+                    print(
+                        f'{name:<16} {concurrency:>6} {len(latencies) / seconds:>9.1f} '
+                        f'{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f} '
+                        f'{len(errors):>7}'
+                    )
+            finally:
+                stop_server(process)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
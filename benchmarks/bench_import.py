@@ -0,0 +1,66 @@
+"""ランキングデータ取り込みのベンチマーク（loaddataとimport_novelsの比較）
+
+N件の小説をdumpdata形式のJSONフィクスチャとCSVに書き出し、
+loaddata（1件ずつsave）とimport_novels（一括upsert）の所要時間を比較する。
+import_novelsは同じデータの再取り込み（すべて既存行の更新）も計測する。
+
+    python benchmarks/bench_import.py [件数]
+"""
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+from io import StringIO
+
+import _django
+
+FIELDS = ('name', 'author', 'publisher', 'rank', 'price', 'year')
+
+
+def write_inputs(tmp, size):
+    """フィクスチャとCSVを作成し、それぞれのパスを返す"""
+    rows = [(f'小説{i}', f'作者{i % 500}', '出版社', i + 1, '680.00', 2025) for i in range(size)]
+    fixture = os.path.join(tmp, 'novels.json')
+    with open(fixture, 'w', encoding='utf-8') as f:
+        json.dump([
+            {'model': 'cart.novel', 'fields': dict(zip(FIELDS, row), created_at='2025-01-01T00:00:00Z',
+                                                   updated_at='2025-01-01T00:00:00Z')}
+            for row in rows
+        ], f, ensure_ascii=False)
+    path = os.path.join(tmp, 'novels.csv')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        writer.writerows(rows)
+    return fixture, path
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    size = int(argv[0]) if argv else 20_000
+    with _django.test_database(), tempfile.TemporaryDirectory() as tmp:
+        from django.core.management import call_command
+        from cart.models import Novel
+
+        fixture, path = write_inputs(tmp, size)
+        out = StringIO()
+        results = [('loaddata', timed(lambda: call_command('loaddata', fixture, stdout=out)))]
+        Novel.objects.all().delete()
+        results.append(('import_novels (insert)', timed(lambda: call_command('import_novels', path, stdout=out))))
+        results.append(('import_novels (update)', timed(lambda: call_command('import_novels', path, stdout=out))))
+
+    print(f'{size} novels')
+    print(f'{"method":<24} {"seconds":>8} {"rows/s":>10}')
+    for name, elapsed in results:
+        print(f'{name:<24} {elapsed:>8.2f} {size / elapsed:>10,.0f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+"""ログインの集中（ログインストーム）中のランキングAPIのレイテンシ比較
+
+Gunicornの同期ワーカーで、パスワードのハッシュ計算の同時実行数を制限しない場合と
+制限した場合（cart/hashing.py）のそれぞれについて、ランキングAPIだけを呼ぶ場合と
+同時にログインを送り続ける場合のレイテンシ（p50・p99）と、ログインの成功数・503の数を比較する。
+
+    python benchmarks/bench_login_storm.py [ワーカー数] [計測秒数] [ログインの同時接続数]
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import _django
+from bench_asgi import ENDPOINTS, load, percentile, prepare_database, request, start_server, stop_server
+
+SERVER = 'gunicorn (sync)'
+CATALOG_CONNECTIONS = 8
+USERNAME = 'storm'
+PASSWORD = 'storm-password'
+# ハッシュ計算の同時実行数の上限（unboundedはワーカー数より大きく、実質的に制限なし）
+LIMITS = {'unbounded': 1000, 'bounded': 1}
+
+
+def create_user(db_path):
+    env = {**os.environ, 'DJANGO_SQLITE_PATH': db_path}
+    script = (
+        'import sys; sys.path.insert(0, %r); import _django; _django.setup(); '
+        'from django.contrib.auth.models import User; User.objects.create_user(%r, password=%r)'
+    ) % (os.path.dirname(os.path.abspath(__file__)), USERNAME, PASSWORD)
+    subprocess.run([sys.executable, '-c', script], env=env, check=True)
+
+
+async def login_client(port, deadline, statuses):
+    """計測終了までログインを送り続ける"""
+    body = json.dumps({'username': USERNAME, 'password': PASSWORD}).encode('utf-8')
+    connection = None
+    while time.perf_counter() < deadline:
+        try:
+            status, connection = await request(port, '/api/auth/login/', connection, body=body)
+        except (OSError, asyncio.IncompleteReadError):
+            statuses.append(0)
+            connection = None
+            continue
+        statuses.append(status)
+    if connection is not None:
+        connection[1].close()
+
+
+async def storm(port, novel_ids, logins, seconds):
+    statuses = []
+    deadline = time.perf_counter() + seconds
+    catalog, _ = await asyncio.gather(
+        load(port, ENDPOINTS[SERVER], novel_ids, CATALOG_CONNECTIONS, seconds),
+        asyncio.gather(*(login_client(port, deadline, statuses) for _ in range(logins))),
+    )
+    return catalog, statuses
+
+
+def main(argv):
+    workers = int(argv[0]) if len(argv) > 0 else 4
+    seconds = float(argv[1]) if len(argv) > 1 else 10
+    logins = int(argv[2]) if len(argv) > 2 else 16
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.sqlite3')
+        novel_ids = prepare_database(db_path)
+        create_user(db_path)
+        print(f'{workers} workers, {seconds:g}s, {CATALOG_CONNECTIONS} catalog connections, {logins} login connections')
+        print(f'{"hashing":<10} {"load":<8} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"login ok":>9} {"503":>6}')
+        for name, limit in LIMITS.items():
+            # ロックファイルを計測用の一時ディレクトリに作成する
+            env = {
+                'DJANGO_PASSWORD_HASHING_CONCURRENCY': str(limit),
+                'DJANGO_PASSWORD_HASHING_LOCK_DIR': os.path.join(tmp, 'locks'),
+            }
+            process, port = start_server(SERVER, workers, db_path, env=env)
+            try:
+                asyncio.run(load(port, ENDPOINTS[SERVER], novel_ids, 4, 1))  # ウォームアップ
+                latencies, _ = asyncio.run(load(port, ENDPOINTS[SERVER], novel_ids, CATALOG_CONNECTIONS, seconds))
+                rows = [('catalog', latencies, [])]
+                (latencies, _), statuses = asyncio.run(storm(port, novel_ids, logins, seconds))
+                rows.append(('storm', latencies, statuses))
+                for label, latencies, statuses in rows:
+                    print(
+                        f'{name:<10} {label:<8} {len(latencies) / seconds:>8.1f} '
+                        f'{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f} '
+                        f'{statuses.count(200):>9} {statuses.count(503):>6}'
+                    )
+            finally:
+                stop_server(process)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,45 @@
+"""計測ミドルウェアのオーバーヘッドのベンチマーク
+
+PerformanceMetricsMiddlewareの有無で、小説詳細（1クエリ）とカート一覧の1リクエストあたりの時間を比較する。
+
+    python benchmarks/bench_metrics.py [リクエスト数]
+"""
+import sys
+import time
+
+import _django
+
+
+def measure(client, path, requests):
+    """1リクエストの平均時間（ミリ秒）を返す"""
+    client.get(path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - start) / requests * 1000
+
+
+def main(argv):
+    requests = int(argv[0]) if argv else 2000
+    with _django.test_database():
+        from django.conf import settings
+        from django.test import Client, override_settings
+
+        novel = _django.create_novels(20)[0]
+        client = Client()
+        for novel_pk in range(novel.pk, novel.pk + 10):
+            client.post('/api/cart/add_item/', {'novel_id': novel_pk}, content_type='application/json')
+        paths = [f'/api/novels/{novel.pk}/', '/api/cart/']
+        without = [m for m in settings.MIDDLEWARE if m != 'backend.middleware.PerformanceMetricsMiddleware']
+
+        print(f'{requests} requests per case')
+        print(f'{"path":<20} {"without (ms)":>13} {"with (ms)":>10} {"overhead":>9}')
+        for path in paths:
+            with override_settings(MIDDLEWARE=without):
+                base_ms = measure(client, path, requests)
+            metrics_ms = measure(client, path, requests)
+            print(f'{path:<20} {base_ms:>13.3f} {metrics_ms:>10.3f} {(metrics_ms / base_ms - 1) * 100:>8.1f}%')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
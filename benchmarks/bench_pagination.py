@@ -0,0 +1,58 @@
+"""小説一覧のページネーションのベンチマーク（OFFSETとキーセットの比較）
+
+全件をページ順にたどる場合（分析ジョブ相当）について、ページ番号方式（COUNT + OFFSET）と
+カーソル方式（(year, rank, id) のキーセット）で、浅いページと深いページの取得時間を比較する。
+
+    python benchmarks/bench_pagination.py [小説の件数]
+"""
+import sys
+import time
+
+import _django
+
+YEARS = tuple(range(1990, 2026))
+PAGE_SIZE = 100
+REPEAT = 20
+
+
+def measure(client, path, params):
+    """1ページ取得の平均時間（ミリ秒）を返す"""
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        response = client.get(path, params)
+        assert response.status_code == 200, response.status_code
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main(argv):
+    size = int(argv[0]) if argv else 200_000
+    with _django.test_database():
+        from django.test import Client, override_settings
+        from cart.models import Novel
+        from cart.pagination import NovelKeysetPagination
+
+        _django.create_novels(size, years=YEARS)
+        client = Client()
+        # ページキャッシュの影響を除くため、毎回クエリを発行させる
+        override_settings(NOVEL_RANKING_CACHE={'MAX_ENTRIES': 0}).enable()
+        keyset = NovelKeysetPagination()
+
+        print(f'{size} novels, page_size={PAGE_SIZE}')
+        print(f'{"page":>8} {"offset (ms)":>12} {"no count (ms)":>14} {"cursor (ms)":>12}')
+        last_page = size // PAGE_SIZE
+        for page in (1, last_page // 10, last_page // 2, last_page):
+            page = max(page, 1)
+            # ページの直前の行のキーからカーソルを作成
+            offset = (page - 1) * PAGE_SIZE
+            params = {'page_size': PAGE_SIZE, 'pagination': 'cursor'}
+            if offset:
+                position = Novel.objects.order_by(*keyset.ordering).values_list(*keyset.ordering)[offset - 1]
+                params['cursor'] = keyset.encode_cursor(position)
+            offset_ms = measure(client, '/api/novels/', {'page_size': PAGE_SIZE, 'page': page})
+            uncounted_ms = measure(client, '/api/novels/', {'page_size': PAGE_SIZE, 'page': page, 'count': 'false'})
+            cursor_ms = measure(client, '/api/novels/', params)
+            print(f'{page:>8} {offset_ms:>12.3f} {uncounted_ms:>14.3f} {cursor_ms:>12.3f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
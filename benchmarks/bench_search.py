@@ -0,0 +1,44 @@
+"""小説検索のベンチマーク（LIKE '%…%' と全文検索インデックスの比較）
+
+N件の小説に対して、管理画面の従来の検索（name/author/publisherのicontains）と
+FTS5（trigram）インデックスによる検索の1回あたりの時間を比較する。
+
+    python benchmarks/bench_search.py [件数 ...]
+"""
+import sys
+import time
+
+import _django
+
+REPEAT = 20
+QUERIES = ('小説12345', '作者42', '出版社')
+
+
+def measure(func):
+    """funcの1回あたりの平均時間（ミリ秒）を返す"""
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        func()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [10_000, 100_000]
+    print(f'{"novels":>8} {"query":<12} {"LIKE (ms)":>10} {"FTS5 (ms)":>10}')
+    for size in sizes:
+        with _django.test_database():
+            from cart import search
+            from cart.models import Novel
+
+            _django.create_novels(size, years=tuple(range(1990, 2026)))
+            for query in QUERIES:
+                terms = search.split_terms(query)
+                like_ms = measure(lambda: list(
+                    Novel.objects.filter(search.like_filter(terms)).order_by('rank').values_list('id')[:10]
+                ))
+                fts_ms = measure(lambda: search.ranked_ids(terms, limit=10))
+                print(f'{size:>8} {query:<12} {like_ms:>10.3f} {fts_ms:>10.3f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
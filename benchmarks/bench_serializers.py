@@ -0,0 +1,63 @@
+"""シリアライザのベンチマーク（ModelSerializerと読み取り専用の高速シリアライザの比較）
+
+10 / 1k / 10k 行について、クエリからJSONのバイト列を得るまでの時間を比較する。
+
+    python benchmarks/bench_serializers.py [行数 ...]
+"""
+import sys
+import time
+
+import _django
+
+REPEAT_BUDGET = 2.0  # 1ケースあたりの計測時間の目安（秒）
+
+
+def timeit(func):
+    """funcを繰り返し実行し、1回あたりの平均時間（ミリ秒）を返す"""
+    func()
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > REPEAT_BUDGET or runs >= 1000:
+            return elapsed / runs * 1000
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [10, 1_000, 10_000]
+    with _django.test_database():
+        from django.db.models import Prefetch
+        from rest_framework.renderers import JSONRenderer
+        from cart.models import Cart, CartItem, Novel
+        from cart.serializers import CartReadSerializer, CartSerializer, NovelRowSerializer, NovelSerializer
+
+        renderer = JSONRenderer()
+        novel_rows = NovelRowSerializer()
+        cart_reader = CartReadSerializer()
+        _django.create_novels(max(sizes))
+
+        print(f'{"case":<8} {"rows":>6} {"ModelSerializer (ms)":>21} {"fast (ms)":>10} {"speedup":>8}')
+        for size in sizes:
+            queryset = Novel.objects.order_by('id')[:size]
+            slow = timeit(lambda: renderer.render(NovelSerializer(queryset, many=True).data))
+            fast = timeit(lambda: renderer.render(novel_rows.serialize(queryset)))
+            print(f'{"novels":<8} {size:>6} {slow:>21.3f} {fast:>10.3f} {slow / fast:>7.1f}x')
+
+        for size in sizes:
+            cart = Cart.objects.create(session_key=f'bench{size}')
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, novel_id=novel_id, quantity=1)
+                for novel_id in Novel.objects.order_by('id').values_list('id', flat=True)[:size]
+            ])
+            items = Prefetch('items', queryset=CartItem.objects.select_related('novel').order_by('id'))
+            slow = timeit(lambda: renderer.render(
+                CartSerializer(Cart.objects.prefetch_related(items).get(pk=cart.pk)).data
+            ))
+            fast = timeit(lambda: renderer.render(cart_reader.to_representation(cart)))
+            print(f'{"cart":<8} {size:>6} {slow:>21.3f} {fast:>10.3f} {slow / fast:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
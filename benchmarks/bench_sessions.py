@@ -0,0 +1,57 @@
+"""セッションエンジンごとのカートAPIのベンチマーク
+
+/api/cart/ の読み込みと /api/cart/add_item/ の追加について、
+1リクエストあたりのDBクエリ数と平均レイテンシをセッションエンジンごとに比較する。
+
+    python benchmarks/bench_sessions.py [リクエスト数]
+"""
+import sys
+import time
+
+import _django
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+
+def measure(connection, requests, call):
+    """callをrequests回実行し、1回あたりのクエリ数と平均時間（ミリ秒）を返す"""
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = call()
+            assert response.status_code < 400, response.content
+        elapsed = time.perf_counter() - start
+    return len(ctx.captured_queries) / requests, elapsed / requests * 1000
+
+
+def main(argv):
+    requests = int(argv[0]) if argv else 200
+    with _django.test_database() as connection:
+        from django.test.utils import override_settings
+        from rest_framework.test import APIClient
+
+        novels = _django.create_novels(20)
+        print(f'{"engine":<16} {"GET q/req":>10} {"GET ms":>8} {"ADD q/req":>10} {"ADD ms":>8}')
+        for name, engine in ENGINES.items():
+            with override_settings(SESSION_ENGINE=engine):
+                client = APIClient()
+                # カートを作成してから計測する
+                for novel in novels[:5]:
+                    client.post('/api/cart/add_item/', {'novel_id': novel.pk}, format='json')
+                get_q, get_ms = measure(connection, requests, lambda: client.get('/api/cart/'))
+                add_q, add_ms = measure(
+                    connection, requests,
+                    lambda: client.post('/api/cart/add_item/', {'novel_id': novels[0].pk}, format='json'),
+                )
+            print(f'{name:<16} {get_q:>10.2f} {get_ms:>8.3f} {add_q:>10.2f} {add_ms:>8.3f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,90 @@
+"""SQLiteプロファイルごとの同時書き込みベンチマーク
+
+複数のプロセス（Gunicornワーカー相当）から同じSQLiteファイルへカートの追加・数量変更を
+同時に行い、既定の設定と本番用プロファイル（DJANGO_DB_PROFILE=production）の
+スループットと "database is locked" による失敗数を比較する。
+
+    python benchmarks/bench_sqlite_contention.py [プロセス数] [1プロセスあたりのリクエスト数]
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import _django
+
+PROFILES = ('default', 'production')
+
+
+def worker(args):
+    """1つのワーカープロセスとしてカートAPIに書き込みを行い、(成功数, 失敗数) を返す"""
+    db_path, profile, requests, novel_ids, barrier = args
+    os.environ['DJANGO_SQLITE_PATH'] = db_path
+    os.environ['DJANGO_DB_PROFILE'] = profile
+    _django.setup()
+    from django.test.utils import setup_test_environment
+    from rest_framework.test import APIClient
+
+    setup_test_environment()
+    client = APIClient()
+    ok = failed = 0
+    barrier.wait()
+    for i in range(requests):
+        novel_id = novel_ids[i % len(novel_ids)]
+        response = client.post('/api/cart/add_item/', {'novel_id': novel_id}, format='json')
+        if response.status_code < 400:
+            ok += 1
+            item_id = response.json()['items'][0]['id']
+            response = client.put('/api/cart/update_item/', {'item_id': item_id, 'quantity': 1}, format='json')
+            ok += response.status_code < 400
+            failed += response.status_code >= 400
+        else:
+            failed += 1
+    return ok, failed
+
+
+def prepare_database(db_path, profile):
+    """マイグレーションを適用し、計測用の小説を作成する"""
+    env = {**os.environ, 'DJANGO_SQLITE_PATH': db_path, 'DJANGO_DB_PROFILE': profile}
+    manage = os.path.join(_django.ROOT, 'manage.py')
+    subprocess.run([sys.executable, manage, 'migrate', '-v', '0'], env=env, check=True)
+    script = (
+        'import sys; sys.path.insert(0, %r); import _django; _django.setup(); '
+        'print(",".join(str(n.pk) for n in _django.create_novels(20)))'
+    ) % os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True, text=True)
+    return [int(pk) for pk in output.stdout.strip().split(',')]
+
+
+def run(profile, processes, requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.sqlite3')
+        novel_ids = prepare_database(db_path, profile)
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Manager() as manager:
+            barrier = manager.Barrier(processes + 1)
+            with ctx.Pool(processes) as pool:
+                result = pool.map_async(worker, [(db_path, profile, requests, novel_ids, barrier)] * processes)
+                barrier.wait()
+                start = time.perf_counter()
+                counts = result.get()
+                elapsed = time.perf_counter() - start
+    ok = sum(count[0] for count in counts)
+    failed = sum(count[1] for count in counts)
+    return ok, failed, elapsed
+
+
+def main(argv):
+    processes = int(argv[0]) if len(argv) > 0 else 4
+    requests = int(argv[1]) if len(argv) > 1 else 200
+    print(f'{processes} processes x {requests} add+update requests')
+    print(f'{"profile":<12} {"ok":>7} {"failed":>7} {"seconds":>8} {"writes/s":>9}')
+    for profile in PROFILES:
+        ok, failed, elapsed = run(profile, processes, requests)
+        print(f'{profile:<12} {ok:>7} {failed:>7} {elapsed:>8.2f} {ok / elapsed:>9.1f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
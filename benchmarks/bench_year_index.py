@@ -0,0 +1,117 @@
+"""年別ランキング取得のベンチマーク（インデックス追加前後の比較）
+
+NovelViewSetが `?year=YYYY` で発行するクエリ（COUNT + ORDER BY rank LIMIT 10）を、
+マイグレーション0003の前後のスキーマで計測する。
+
+    python benchmarks/bench_year_index.py              # 10k / 100k / 1M 件
+    python benchmarks/bench_year_index.py 10000 50000  # 件数を指定
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+YEARS = list(range(1990, 2026))
+REPEAT = 50
+
+# マイグレーション0003適用前：年は文字列でインデックスなし
+BEFORE_SCHEMA = """
+CREATE TABLE cart_novel (
+    id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    name varchar(200) NOT NULL,
+    author varchar(100) NOT NULL,
+    publisher varchar(100) NOT NULL,
+    rank integer NOT NULL,
+    price decimal NOT NULL,
+    created_at datetime NOT NULL,
+    updated_at datetime NOT NULL,
+    year varchar(4) NOT NULL
+);
+"""
+
+# マイグレーション0003適用後：年は整数で (year, rank) の複合インデックスあり
+AFTER_SCHEMA = """
+CREATE TABLE cart_novel (
+    id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    name varchar(200) NOT NULL,
+    author varchar(100) NOT NULL,
+    publisher varchar(100) NOT NULL,
+    rank integer NOT NULL,
+    price decimal NOT NULL,
+    created_at datetime NOT NULL,
+    updated_at datetime NOT NULL,
+    year smallint unsigned NOT NULL CHECK (year >= 0)
+);
+CREATE INDEX novel_year_rank_idx ON cart_novel (year, rank);
+"""
+
+PAGE_SQL = (
+    'SELECT id, name, author, publisher, rank, price, year FROM cart_novel '
+    'WHERE year = ? ORDER BY rank ASC LIMIT 10'
+)
+COUNT_SQL = 'SELECT COUNT(*) FROM cart_novel WHERE year = ?'
+
+
+def build_database(path, schema, size, year_type):
+    """指定したスキーマでN件の小説を持つデータベースを作成"""
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    rng = random.Random(size)
+    ranks = {year: 0 for year in YEARS}
+    rows = []
+    for i in range(size):
+        year = rng.choice(YEARS)
+        ranks[year] += 1
+        rows.append((
+            f'小説{i}', f'作者{i % 5000}', '出版社', ranks[year], '680.00',
+            '2025-01-01 00:00:00', '2025-01-01 00:00:00', year_type(year),
+        ))
+        if len(rows) >= 50000:
+            insert_rows(conn, rows)
+            rows = []
+    insert_rows(conn, rows)
+    conn.commit()
+    conn.execute('ANALYZE')
+    return conn
+
+
+def insert_rows(conn, rows):
+    conn.executemany(
+        'INSERT INTO cart_novel (name, author, publisher, rank, price, created_at, updated_at, year) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        rows,
+    )
+
+
+def measure(conn, year_param):
+    """1リクエスト分（COUNT + 1ページ目）のクエリの平均時間をミリ秒で返す"""
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        conn.execute(COUNT_SQL, (year_param,)).fetchone()
+        conn.execute(PAGE_SQL, (year_param,)).fetchall()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def run(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        before = build_database(os.path.join(tmp, 'before.sqlite3'), BEFORE_SCHEMA, size, str)
+        before_ms = measure(before, '2025')
+        before.close()
+        after = build_database(os.path.join(tmp, 'after.sqlite3'), AFTER_SCHEMA, size, int)
+        after_ms = measure(after, 2025)
+        after.close()
+    return before_ms, after_ms
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [10_000, 100_000, 1_000_000]
+    print(f'{"novels":>10} {"before (ms)":>12} {"after (ms)":>12} {"speedup":>8}')
+    for size in sizes:
+        before_ms, after_ms = run(size)
+        print(f'{size:>10} {before_ms:>12.3f} {after_ms:>12.3f} {before_ms / after_ms:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,5 +1,7 @@
 from django.contrib import admin
+from django.db.models import F
 from .models import Novel, Cart, CartItem
+from . import search
 
 class NovelAdmin(admin.ModelAdmin):
     """小説モデルの管理インターフェース設定"""
@@ -20,6 +22,90 @@ class NovelAdmin(admin.ModelAdmin):
     )
     
     readonly_fields = ('created_at', 'updated_at')
+    
+    def get_search_results(self, request, queryset, search_term):
+        """APIの検索と同じ全文検索インデックスを使用（使用できない場合は通常のLIKE検索）"""
+        terms = search.split_terms(search_term)
+        if not search.can_use_index(terms):
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(id__in=search.matching_ids(terms)), False
+
+class InputFilter(admin.SimpleListFilter):
+    """選択肢を列挙せず、入力した値で絞り込むフィルター
+    
+    外部キーの標準のフィルターは関連するすべての行を選択肢として表示するため、
+    カートや小説が増えると変更リストの表示ごとに全件を読み込むことになる。
+    """
+    template = 'admin/cart/input_filter.html'
+    placeholder = ''
+    
+    def lookups(self, request, model_admin):
+        return ()
+    
+    def has_output(self):
+        return True
+    
+    def choices(self, changelist):
+        # 入力欄のフォームで他の絞り込み・検索・並び順を引き継ぐ
+        yield {
+            'value': self.value() or '',
+            'placeholder': self.placeholder,
+            'hidden_params': [
+                (name, value) for name, value in changelist.params.items()
+                if name != self.parameter_name
+            ],
+            'clear_query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+class CartIdFilter(InputFilter):
+    """カートIDによる絞り込み"""
+    title = 'カート'
+    parameter_name = 'cart_id'
+    placeholder = 'カートID'
+    
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        # isdigit()では '²' のようなint()で変換できない値も通るため、int()と64ビット整数の範囲で判定する
+        try:
+            cart_id = int(value)
+        except ValueError:
+            return queryset.none()
+        if not 0 < cart_id < 2 ** 63:
+            return queryset.none()
+        return queryset.filter(cart_id=cart_id)
+
+class NovelNameFilter(InputFilter):
+    """小説名による絞り込み（全文検索インデックスを使用）"""
+    title = '小説'
+    parameter_name = 'novel'
+    placeholder = '小説名'
+    
+    def queryset(self, request, queryset):
+        terms = search.split_terms(self.value() or '')
+        if not terms:
+            return queryset
+        if search.can_use_index(terms):
+            return queryset.filter(novel_id__in=search.matching_ids(terms))
+        for term in terms:
+            queryset = queryset.filter(novel__name__icontains=term)
+        return queryset
+
+class CartOwnerFilter(admin.SimpleListFilter):
+    """ログインユーザーのカートか匿名カートかによる絞り込み"""
+    title = '所有者'
+    parameter_name = 'owner'
+    
+    def lookups(self, request, model_admin):
+        return (('user', 'ユーザー'), ('anonymous', '匿名'))
+    
+    def queryset(self, request, queryset):
+        if self.value() == 'user':
+            return queryset.filter(user__isnull=False)
+        if self.value() == 'anonymous':
+            return queryset.filter(user__isnull=True)
+        return queryset
 
 class CartItemInline(admin.TabularInline):
     """カートアイテムのインライン表示"""
@@ -28,6 +114,12 @@ class CartItemInline(admin.TabularInline):
     fields = ('novel', 'quantity', 'subtotal')
     readonly_fields = ('subtotal',)
     ordering = ('novel__name',)
+    # 小説の選択欄に全件を列挙しない
+    autocomplete_fields = ('novel',)
+    
+    def get_queryset(self, request):
+        # 小計の表示で行ごとに小説を読み込まないようにする
+        return super().get_queryset(request).select_related('novel')
     
     def subtotal(self, obj):
         """商品小計を表示"""
@@ -37,14 +129,18 @@ class CartItemInline(admin.TabularInline):
 class CartAdmin(admin.ModelAdmin):
     """カートモデルの管理インターフェース設定"""
     list_display = ('__str__', 'user', 'session_key', 'total_items', 'total_amount', 'created_at', 'updated_at')
-    list_filter = ('created_at', 'updated_at')
-    search_fields = ('user__username', 'session_key')
+    list_filter = (CartOwnerFilter, 'created_at', 'updated_at')
+    list_select_related = ('user',)
+    search_fields = ('user__username', '=session_key')
     ordering = ('-updated_at',)
     inlines = [CartItemInline]
+    autocomplete_fields = ('user',)
+    # 全件数のCOUNTを省略（絞り込み後の件数のみ表示）
+    show_full_result_count = False
     
     fieldsets = (
         ('カート情報', {
-            'fields': ('user', 'session_key')
+            'fields': ('user', 'session_key', 'total_items', 'total_amount')
         }),
         ('時間情報', {
             'fields': ('created_at', 'updated_at'),
@@ -52,25 +148,23 @@ class CartAdmin(admin.ModelAdmin):
         }),
     )
     
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('total_items', 'total_amount', 'created_at', 'updated_at')
     
-    def total_items(self, obj):
-        """カート内の商品総数を表示"""
-        return sum(item.quantity for item in obj.items.all())
-    total_items.short_description = '商品総数'
-    
-    def total_amount(self, obj):
-        """カート内の総金額を表示"""
-        return sum(item.subtotal for item in obj.items.all())
-    total_amount.short_description = '総金額'
-    total_amount.admin_order_field = 'total_amount'
+    def save_related(self, request, form, formsets, change):
+        """インラインで変更したアイテムを保存した後、カートの合計を再計算"""
+        super().save_related(request, form, formsets, change)
+        Cart.objects.filter(pk=form.instance.pk).recalculate_totals()
 
 class CartItemAdmin(admin.ModelAdmin):
     """カートアイテムモデルの管理インターフェース設定"""
     list_display = ('novel', 'cart', 'quantity', 'subtotal', 'created_at')
-    list_filter = ('cart', 'novel', 'created_at')
+    list_filter = (CartIdFilter, NovelNameFilter, 'created_at')
+    list_select_related = ('novel', 'cart__user')
     search_fields = ('novel__name', 'cart__user__username')
-    ordering = ('cart', 'novel__name')
+    # (cart, novel) の一意制約のインデックスの順に並べる
+    ordering = ('cart_id', 'novel_id')
+    autocomplete_fields = ('cart', 'novel')
+    show_full_result_count = False
     
     fieldsets = (
         ('カートアイテム情報', {
@@ -88,6 +182,23 @@ class CartItemAdmin(admin.ModelAdmin):
         """商品小計を表示"""
         return obj.subtotal
     subtotal.short_description = '小計'
+    subtotal.admin_order_field = F('quantity') * F('novel__price')
+    
+    def save_model(self, request, obj, form, change):
+        """アイテムを保存した後、変更前後のカートの合計を再計算"""
+        super().save_model(request, obj, form, change)
+        cart_ids = {obj.cart_id, form.initial.get('cart')} - {None}
+        Cart.objects.filter(id__in=cart_ids).recalculate_totals()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Cart.objects.filter(pk=obj.cart_id).recalculate_totals()
+    
+    def delete_queryset(self, request, queryset):
+        """一括削除したアイテムを含んでいたカートの合計を再計算"""
+        cart_ids = set(queryset.values_list('cart_id', flat=True))
+        super().delete_queryset(request, queryset)
+        Cart.objects.filter(id__in=cart_ids).recalculate_totals()
 
 # モデルを管理サイトに登録
 admin.site.register(Novel, NovelAdmin)
@@ -0,0 +1,359 @@
+"""小説・カートAPIの非同期版（ASGI、/api/async/ 以下）
+
+同期版のDRFビューセットと同じ形式のレスポンスを返す。読み取りはDjangoの非同期ORM
+（afirst・aaggregate・非同期イテレーション）で行い、トランザクションを伴うカートの変更は
+モデルのメソッドをsync_to_asyncで実行する。DRF 3.14は非同期ビューに対応していないため、
+Djangoの関数ビューとして実装している。
+
+カートは同期版（CartViewSetは認証を行わない）と同じく、セッションのカートキーで識別する。
+"""
+import functools
+import json
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from backend.metrics import TimedJSONRenderer, phase
+from .cache import ranking_cache
+from .conditional import make_etag, not_modified_response, set_validators
+from .images import image_manifest
+from .models import Cart, CartItem, Novel
+from .pagination import NovelPageNumberPagination
+from .views import CartViewSet, NovelViewSet, cart_read_serializer, novel_row_serializer
+
+# 同期版と同じJSONを出力するレンダラー（変換時間はrenderとして計測される）
+json_renderer = TimedJSONRenderer()
+# セッションのカートキーの扱い・一括操作の検証・空のカートの形式は同期版と共通
+cart_view = CartViewSet()
+# 小説リストの絞り込み・キャッシュキー・ETagは同期版と共通
+novel_view = NovelViewSet()
+
+
+def json_response(data, status=200):
+    return HttpResponse(json_renderer.render(data), content_type='application/json', status=status)
+
+
+def async_view(*methods, csrf_exempt=False):
+    """許可するHTTPメソッドを確認する非同期ビューのデコレーター
+
+    Django 4.2のrequire_http_methods・csrf_exemptは非同期ビューを同期ビューに変えてしまうため使わない。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = csrf_exempt
+        return wrapper
+    return decorator
+
+
+def request_data(request):
+    """リクエストの本文（JSONまたはフォーム）を辞書として取得（不正なJSONはValueError）"""
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError('JSONの本文はオブジェクトでなければなりません')
+        return data
+    return request.POST
+
+
+def page_link(request, page_number):
+    url = request.build_absolute_uri()
+    if page_number == 1:
+        return remove_query_param(url, 'page')
+    return replace_query_param(url, 'page', page_number)
+
+
+@async_view('GET')
+async def novel_list(request):
+    """小説リスト（/api/novels/ の非同期版、年による絞り込みとページ番号に対応）
+
+    絞り込み・ランキングキャッシュ・ETagは同期版（NovelViewSet）のメソッドを共有する。
+    `?count=false` の場合はCOUNT(*)を発行せず、1件多く取得して次ページの有無を判定する。
+    カーソル方式のページネーションには対応しないため、`?pagination=cursor` は400を返す。
+    """
+    params = request.GET
+    if params.get('pagination') in NovelViewSet.pagination_classes:
+        return json_response(
+            {'error': 'カーソル方式のページネーションは /api/novels/ を使用してください'}, status=400
+        )
+    page_size = NovelPageNumberPagination.page_size_from(params)
+    try:
+        page_number = NovelPageNumberPagination.page_number_from(params)
+    except NotFound as exc:
+        return json_response({'detail': str(exc.detail)}, status=404)
+    counts_rows = NovelPageNumberPagination.counts_rows(params)
+    queryset = novel_view.filter_by_year(Novel.objects.order_by('rank'), params)
+
+    cache_key, cached = await sync_to_async(novel_view.get_cached_page)(request)
+    stats = data = None
+    if cached is not None:
+        etag, last_modified, data = cached
+    elif counts_rows:
+        stats = await queryset.order_by().aaggregate(**novel_view.fingerprint_aggregates())
+        etag, last_modified = novel_view.make_fingerprint(stats)
+    else:
+        etag = last_modified = None
+    if etag is not None:
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+    if data is None:
+        offset = (page_number - 1) * page_size
+        limit = offset + page_size + (0 if counts_rows else 1)
+        rows = [row async for row in queryset.values_list(*novel_row_serializer.columns)[offset:limit]]
+        has_next = offset + page_size < stats['count'] if counts_rows else len(rows) > page_size
+        rows = rows[:page_size]
+        if not rows and page_number > 1:
+            return json_response({'detail': str(NovelPageNumberPagination.invalid_page_message)}, status=404)
+
+        with phase('serialize'):
+            results = [novel_row_serializer.to_representation(row) for row in rows]
+        data = {
+            'next': page_link(request, page_number + 1) if has_next else None,
+            'previous': page_link(request, page_number - 1) if page_number > 1 else None,
+            'results': results,
+        }
+        if counts_rows:
+            data = {'count': stats['count'], **data}
+        else:
+            etag = novel_view.make_page_etag(data)
+            not_modified = not_modified_response(request, etag)
+            if not_modified is not None:
+                return not_modified
+        await sync_to_async(ranking_cache.set)(cache_key, (etag, last_modified, data))
+    return set_validators(json_response(data), etag, last_modified)
+
+
+@async_view('GET')
+async def novel_detail(request, pk):
+    """小説の詳細（/api/novels/<id>/ の非同期版、ETagが一致する場合は304）"""
+    row = await Novel.objects.filter(pk=pk).values_list(*novel_row_serializer.columns, 'updated_at').afirst()
+    if row is None:
+        return json_response({'detail': str(NotFound.default_detail)}, status=404)
+    last_modified = image_manifest.last_modified(row[-1])
+    etag = make_etag('novel', pk, row[-1], image_manifest.generation)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    return set_validators(json_response(novel_row_serializer.to_representation(row)), etag, last_modified)
+
+
+async def get_cart(request, create=True):
+    """CartViewSet.get_cartの非同期版（create=Falseの場合はカートもセッションも作成しない）"""
+    # セッションの読み込みはDBなどへのアクセスを伴うため同期処理として実行する（以降はメモリ上で参照できる）
+    cart_key = await sync_to_async(cart_view.get_cart_key)(request)
+    cart = await Cart.objects.filter(session_key=cart_key).afirst() if cart_key else None
+    if cart is None:
+        if not create:
+            return None
+        cart = await Cart.objects.acreate(session_key=secrets.token_hex(16))
+
+    if create and request.session.get(CartViewSet.CART_KEY_SESSION_FIELD) != cart.session_key:
+        request.session[CartViewSet.CART_KEY_SESSION_FIELD] = cart.session_key
+
+    # 変更を伴うリクエストの場合のみ、一定間隔で最終アクティビティ時間を更新
+    now = timezone.now()
+    if create and (now - cart.updated_at).total_seconds() >= CartViewSet.ACTIVITY_TOUCH_INTERVAL:
+        await Cart.objects.filter(pk=cart.pk).aupdate(updated_at=now)
+        cart.updated_at = now
+    return cart
+
+
+async def serialize_cart(cart):
+    """変更後のカートを読み直してシリアライズ"""
+    await cart.arefresh_from_db(fields=['version', 'updated_at', 'total_items', 'total_amount'])
+    with phase('serialize'):
+        return await cart_read_serializer.ato_representation(cart)
+
+
+async def delta_response(cart, item=None, removed_item_id=None, cleared=False, status=200):
+    """変更されたアイテムと新しい合計・バージョンのみを返す（?response=delta）"""
+    data = {
+        'item': item,
+        'removed_item_id': removed_item_id,
+        'cleared': cleared,
+    }
+    data.update(await cart.asummary())
+    return json_response(data, status=status)
+
+
+def wants_delta(request):
+    return request.GET.get('response') == 'delta'
+
+
+@async_view('GET')
+async def cart_detail(request):
+    """カートの内容（/api/cart/ の非同期版、ETagが一致する場合は304）"""
+    cart = await get_cart(request, create=False)
+    if cart is None:
+        etag, last_modified = make_etag('cart', None), None
+    else:
+        etag, last_modified = await cart.afingerprint()
+    not_modified = not_modified_response(request, etag, last_modified, private=True)
+    if not_modified is not None:
+        return not_modified
+    if cart is None:
+        data = cart_view.empty_cart_data()
+    else:
+        with phase('serialize'):
+            data = await cart_read_serializer.ato_representation(cart)
+    return set_validators(json_response(data), etag, last_modified, private=True)
+
+
+@async_view('GET')
+async def cart_summary(request):
+    """商品総数と総金額のみ（/api/cart/summary/ の非同期版）"""
+    cart = await get_cart(request, create=False)
+    data = cart.loaded_summary() if cart is not None else dict(Cart.EMPTY_SUMMARY)
+    etag = make_etag('cart-summary', cart.pk if cart is not None else None, *data.values())
+    not_modified = not_modified_response(request, etag, private=True)
+    if not_modified is not None:
+        return not_modified
+    return set_validators(json_response(data), etag, private=True)
+
+
+@async_view('POST', csrf_exempt=True)
+async def cart_add_item(request):
+    """商品をカートに追加"""
+    try:
+        try:
+            data = request_data(request)
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=400)
+        novel_id = data.get('novel_id')
+        quantity = data.get('quantity', 1)
+
+        if not novel_id:
+            return json_response({'error': '小説IDは必須です'}, status=400)
+
+        try:
+            quantity = int(quantity)
+            if quantity <= 0:
+                return json_response({'error': '数量は0より大きくなければなりません'}, status=400)
+        except (TypeError, ValueError):
+            return json_response({'error': '数量は整数でなければなりません'}, status=400)
+
+        cart = await get_cart(request)
+        try:
+            novel = await Novel.objects.aget(id=novel_id)
+        except (Novel.DoesNotExist, ValueError):
+            return json_response({'error': '小説が存在しません'}, status=404)
+
+        # 加算はトランザクション内で行うため同期処理として実行
+        await sync_to_async(cart.add_novel)(novel, quantity)
+
+        if wants_delta(request):
+            items = await cart_read_serializer.aitems(CartItem.objects.filter(cart=cart, novel=novel))
+            return await delta_response(cart, item=items[0] if items else None, status=201)
+        return json_response(await serialize_cart(cart), status=201)
+
+    except Exception as e:
+        return json_response({'error': str(e)}, status=500)
+
+
+@async_view('PUT', csrf_exempt=True)
+async def cart_update_item(request):
+    """カート内の商品の数量を増減（0以下になった場合は削除）"""
+    try:
+        try:
+            data = request_data(request)
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=400)
+        item_id = data.get('item_id')
+        quantity = data.get('quantity')
+
+        if not item_id or not quantity:
+            return json_response({'error': '商品IDと数量は必須です'}, status=400)
+
+        try:
+            quantity = int(quantity)
+            if quantity == 0:
+                return json_response({'error': '数量は0にすることができません'}, status=400)
+        except (TypeError, ValueError):
+            return json_response({'error': '数量は整数でなければなりません'}, status=400)
+
+        cart = await get_cart(request)
+        if not await sync_to_async(cart.change_item_quantity)(item_id, quantity):
+            return json_response({'error': 'カートアイテムが存在しません'}, status=404)
+
+        if wants_delta(request):
+            items = await cart_read_serializer.aitems(CartItem.objects.filter(cart=cart, id=item_id))
+            item = items[0] if items else None
+            return await delta_response(cart, item=item, removed_item_id=None if item else int(item_id))
+        return json_response(await serialize_cart(cart))
+
+    except Exception as e:
+        return json_response({'error': str(e)}, status=500)
+
+
+@async_view('DELETE', csrf_exempt=True)
+async def cart_remove_item(request):
+    """カートから商品を削除"""
+    try:
+        item_id = request.GET.get('item_id')
+        if not item_id:
+            return json_response({'error': '商品IDは必須です'}, status=400)
+
+        cart = await get_cart(request)
+        if not await sync_to_async(cart.remove_item)(item_id):
+            return json_response({'error': 'カートアイテムが存在しません'}, status=404)
+
+        if wants_delta(request):
+            return await delta_response(cart, removed_item_id=int(item_id))
+        return json_response(await serialize_cart(cart))
+
+    except Exception as e:
+        return json_response({'error': str(e)}, status=500)
+
+
+@async_view('POST', csrf_exempt=True)
+async def cart_batch(request):
+    """複数の追加・数量変更・削除をまとめて1つのトランザクションで適用"""
+    try:
+        try:
+            operations = request_data(request).get('operations')
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=400)
+        if not isinstance(operations, list) or not operations:
+            return json_response({'error': 'operationsは空でないリストでなければなりません'}, status=400)
+        if len(operations) > CartViewSet.MAX_BATCH_OPERATIONS:
+            return json_response(
+                {'error': f'一度に送信できる操作は{CartViewSet.MAX_BATCH_OPERATIONS}件までです'}, status=400
+            )
+
+        try:
+            parsed = [cart_view.parse_operation(index, operation) for index, operation in enumerate(operations)]
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=400)
+
+        cart = await get_cart(request)
+        try:
+            await sync_to_async(cart.apply_operations)(parsed)
+        except (Novel.DoesNotExist, CartItem.DoesNotExist) as e:
+            return json_response({'error': str(e)}, status=404)
+        return json_response(await serialize_cart(cart))
+
+    except Exception as e:
+        return json_response({'error': str(e)}, status=500)
+
+
+@async_view('DELETE', csrf_exempt=True)
+async def cart_clear(request):
+    """カートを空にする"""
+    try:
+        cart = await get_cart(request)
+        await sync_to_async(cart.clear_items)()
+        if wants_delta(request):
+            return await delta_response(cart, cleared=True)
+        return json_response(await serialize_cart(cart))
+
+    except Exception as e:
+        return json_response({'error': str(e)}, status=500)
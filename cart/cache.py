@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+# ランキングキャッシュの既定設定（settings.NOVEL_RANKING_CACHEで上書き可能）
+DEFAULTS = {
+    # プロセス内LRUに保持する最大ページ数
+    'MAX_ENTRIES': 256,
+    # プロセス内エントリの有効期間（秒）。共有層がない場合、他ワーカーでの更新はこの時間内に反映される
+    'LOCAL_TIMEOUT': 60,
+    # 共有キャッシュ（settings.CACHESのエイリアス）。Noneの場合はプロセス内のみ
+    'SHARED_ALIAS': None,
+    # 共有キャッシュ上の有効期間（秒）
+    'SHARED_TIMEOUT': 300,
+}
+
+VERSION_KEY = 'novel-ranking:version'
+
+
+class RankingCache:
+    """年別ランキングのシリアライズ済みページをキャッシュする
+
+    プロセス内のLRU層と、任意の共有層（Djangoのキャッシュバックエンド）の2層構成。
+    キーにはバージョン番号が含まれ、小説の変更時にバージョンを進めることで
+    古いページをまとめて無効化する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 1
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def config(self):
+        return {**DEFAULTS, **getattr(settings, 'NOVEL_RANKING_CACHE', {})}
+
+    def _shared(self):
+        alias = self.config['SHARED_ALIAS']
+        return caches[alias] if alias else None
+
+    def get_version(self):
+        """現在のキャッシュバージョンを取得（共有層がある場合はそちらを優先）"""
+        shared = self._shared()
+        if shared is not None:
+            version = shared.get(VERSION_KEY)
+            if version is None:
+                shared.add(VERSION_KEY, self._version)
+                version = shared.get(VERSION_KEY, self._version)
+            return version
+        return self._version
+
+    def make_key(self, *parts):
+        """バージョン付きのキャッシュキーを作成"""
+        return ':'.join(['novel-ranking', str(self.get_version())] + [str(part) for part in parts])
+
+    def get(self, key):
+        """キャッシュからページを取得し、見つからない場合はNoneを返す"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        shared = self._shared()
+        value = shared.get(key) if shared is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._set_local(key, value)
+        return value
+
+    def set(self, key, value):
+        """ページをキャッシュに保存"""
+        self._set_local(key, value)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(key, value, self.config['SHARED_TIMEOUT'])
+
+    def _set_local(self, key, value):
+        config = self.config
+        expires_at = time.monotonic() + config['LOCAL_TIMEOUT']
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """バージョンを進めて、すべてのキャッシュ済みページを無効化"""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+        shared = self._shared()
+        if shared is not None:
+            try:
+                shared.incr(VERSION_KEY)
+            except ValueError:
+                shared.set(VERSION_KEY, self._version, None)
+
+    def clear(self):
+        """プロセス内のエントリと統計情報をリセット"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """ヒット数、ミス数、追い出し数などの統計情報を返す"""
+        version = self.get_version()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.config['MAX_ENTRIES'],
+                'version': version,
+                'shared': self.config['SHARED_ALIAS'],
+            }
+
+
+ranking_cache = RankingCache()
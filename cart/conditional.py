@@ -0,0 +1,40 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """フィンガープリントの要素から強いETagを作成"""
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+
+def timestamp_of(value):
+    """datetimeをLast-Modified用のUNIX時刻に変換（Noneはそのまま）"""
+    return int(value.timestamp()) if value is not None else None
+
+
+def not_modified_response(request, etag, last_modified=None, private=False):
+    """If-None-Match / If-Modified-Since が一致する場合は304レスポンスを返し、それ以外はNoneを返す
+
+    シリアライズ前に呼び出すことで、変更がない場合の処理を最小限にする。
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp_of(last_modified)
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified, private=private)
+    return response
+
+
+def set_validators(response, etag, last_modified=None, private=False):
+    """レスポンスにETagとLast-Modifiedを設定し、毎回の再検証を要求する"""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(timestamp_of(last_modified))
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,103 @@
+import csv
+import json
+
+from .models import CartItem, Novel
+from .serializers import NovelRowSerializer, NovelSerializer
+
+# iterator()で一度に取得する行数の既定値
+DEFAULT_CHUNK_SIZE = 2000
+# 何件ごとにまとめて出力するか（1行ずつ書き込むとレスポンスの書き込み回数が増えるため）
+LINES_PER_WRITE = 500
+
+novel_row_serializer = NovelRowSerializer()
+# 価格はAPIと同じ形式（小数点以下2桁の文字列）で出力する
+price_to_representation = NovelSerializer().fields['price'].to_representation
+
+CART_ITEM_COLUMNS = (
+    'id', 'cart_id', 'cart__user_id', 'novel_id', 'novel__name', 'novel__price', 'quantity',
+    'created_at', 'updated_at',
+)
+CART_ITEM_FIELDS = (
+    'id', 'cart_id', 'user_id', 'novel_id', 'novel_name', 'price', 'quantity', 'created_at', 'updated_at',
+)
+
+
+def novel_records(year=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """小説を (year, rank, id) の順に一定件数ずつ読み込み、APIと同じ形式の辞書を返す"""
+    queryset = Novel.objects.order_by('year', 'rank', 'id')
+    if year is not None:
+        queryset = queryset.filter(year=year)
+    to_representation = novel_row_serializer.to_representation
+    for row in queryset.values_list(*novel_row_serializer.columns).iterator(chunk_size=chunk_size):
+        yield to_representation(row)
+
+
+def cart_item_records(year=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """カートアイテムを小説名・価格・カートの所有者とともに一定件数ずつ読み込む（yearは無視する）"""
+    queryset = CartItem.objects.order_by('id').values_list(*CART_ITEM_COLUMNS)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        record = dict(zip(CART_ITEM_FIELDS, row))
+        record['price'] = price_to_representation(record['price'])
+        record['created_at'] = record['created_at'].isoformat()
+        record['updated_at'] = record['updated_at'].isoformat()
+        yield record
+
+
+# データセット名 -> (列名, レコードを返すジェネレータ関数, 管理者のみか)
+DATASETS = {
+    'novels': (NovelRowSerializer.fields, novel_records, False),
+    'cart_items': (CART_ITEM_FIELDS, cart_item_records, True),
+}
+
+
+def ndjson_lines(fields, records):
+    """1レコード1行のJSON（NDJSON）"""
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for record in records:
+        yield dumps(record) + '\n'
+
+
+class _Echo:
+    """csv.writerの出力をそのまま返すための擬似ファイル"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(fields, records):
+    """ヘッダー付きのCSV"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for record in records:
+        yield writer.writerow([record[field] for field in fields])
+
+
+# エクスポート形式 -> (Content-Type, 拡張子, 行を返すジェネレータ関数)
+FORMATS = {
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson', ndjson_lines),
+    'csv': ('text/csv; charset=utf-8', 'csv', csv_lines),
+}
+
+
+def batched(lines, size=LINES_PER_WRITE):
+    """行をsize件ごとに連結して返す"""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream(dataset, export_type, records=None, year=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """データセットを指定形式の文字列チャンクとして順に返す（全件をメモリに載せない）
+
+    recordsを渡した場合はそれを出力する（件数を数える場合などにラップしたジェネレータを渡す）。
+    """
+    fields, make_records, _ = DATASETS[dataset]
+    _, _, make_lines = FORMATS[export_type]
+    if records is None:
+        records = make_records(year=year, chunk_size=chunk_size)
+    return batched(make_lines(fields, records))
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windowsではプロセス内の上限のみ
+    fcntl = None
+
+# パスワードのハッシュ計算の既定設定（settings.PASSWORD_HASHINGで上書き可能）
+DEFAULTS = {
+    # 同時にハッシュを計算できる最大数（同じマシンの全ワーカープロセスの合計）
+    'MAX_CONCURRENT': max(1, (os.cpu_count() or 2) // 2),
+    # 空きを待つ最大秒数（これを超えた場合はHashingBusyを送出し、ビューは503を返す）
+    'MAX_WAIT': 0.5,
+    # 空きを確認する間隔（秒）
+    'POLL_INTERVAL': 0.01,
+    # ワーカープロセス間で共有するロックファイルのディレクトリ（Noneの場合はBASE_DIR/password_hashing_locks）
+    # 他のユーザーが先に作成して占有できないよう、共有の一時ディレクトリは使わない
+    'LOCK_DIR': None,
+}
+
+
+class HashingBusy(Exception):
+    """ハッシュ計算の空きがなく、待機時間内に実行できなかった"""
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING', {})}
+    if config['LOCK_DIR'] is None:
+        config['LOCK_DIR'] = os.path.join(settings.BASE_DIR, 'password_hashing_locks')
+    config['LOCK_DIR'] = str(config['LOCK_DIR'])
+    return config
+
+
+class HashingSlots:
+    """パスワードのハッシュ計算（PBKDF2）の同時実行数を制限する
+
+    GunicornのワーカーはそれぞれCPUを使い切るまでハッシュを計算するため、ログインが集中すると
+    すべてのワーカーが占有され、ランキングやカートのリクエストが待たされる。
+    MAX_CONCURRENT個のロックファイル（flock）をスロットとして全プロセスで共有し、
+    空きがない場合は短時間だけ待ってからHashingBusyを送出して、リクエストをすぐに返す。
+    """
+
+    def __init__(self):
+        self._local = threading.Lock()
+        self._local_active = 0
+
+    def _try_acquire(self, config):
+        """空いているスロットを1つ確保し、解放用のファイルを返す（空きがない場合はNone）"""
+        if fcntl is None:
+            with self._local:
+                if self._local_active >= config['MAX_CONCURRENT']:
+                    return None
+                self._local_active += 1
+                return True
+        # ロックファイルのディレクトリは実行ユーザーのみアクセスできるようにする
+        os.makedirs(config['LOCK_DIR'], mode=0o700, exist_ok=True)
+        for index in range(config['MAX_CONCURRENT']):
+            lock_file = open(os.path.join(config['LOCK_DIR'], f'slot-{index}.lock'), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            return lock_file
+        return None
+
+    def _release(self, slot):
+        if slot is True:
+            with self._local:
+                self._local_active -= 1
+            return
+        # ファイルを閉じるとロックも解放される（プロセスが異常終了した場合も同様）
+        slot.close()
+
+    @contextmanager
+    def slot(self):
+        """スロットを確保している間だけ処理を実行する（待機時間内に確保できない場合はHashingBusy）"""
+        config = get_config()
+        deadline = time.monotonic() + config['MAX_WAIT']
+        while True:
+            slot = self._try_acquire(config)
+            if slot is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise HashingBusy('パスワードの処理が混み合っています')
+            time.sleep(config['POLL_INTERVAL'])
+        try:
+            yield
+        finally:
+            self._release(slot)
+
+    def run(self, func, *args, **kwargs):
+        """スロットを確保してfuncを実行し、その結果を返す"""
+        with self.slot():
+            return func(*args, **kwargs)
+
+
+hashing_slots = HashingSlots()
@@ -0,0 +1,249 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillowは画像の作成（build_imagesコマンド）にのみ必要
+    Image = None
+
+# 画像パイプラインの既定設定（settings.NOVEL_IMAGESで上書き可能）
+DEFAULTS = {
+    # 元画像のディレクトリ（<年>/<順位>.<拡張子>）と公開URL
+    'SOURCE_DIR': None,
+    'SOURCE_URL': '/image/',
+    # 変換後の画像とマニフェストの出力先と公開URL
+    'OUTPUT_DIR': None,
+    'OUTPUT_URL': '/image/build/',
+    # 作成する幅（元画像より大きい幅は作成しない）
+    'WIDTHS': (160, 320, 640),
+    # 作成する形式と品質（優先順）
+    'FORMATS': {'avif': 50, 'webp': 75},
+}
+
+MANIFEST_NAME = 'manifest.json'
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# 実行中のプロセスがマニフェストの更新を確認する間隔（秒）
+RELOAD_INTERVAL = 5
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'NOVEL_IMAGES', {})}
+
+
+def find_sources(source_dir):
+    """元画像を探し、((年, 順位), パス) の一覧を返す"""
+    sources = []
+    for year in sorted(os.listdir(source_dir)):
+        year_dir = os.path.join(source_dir, year)
+        if not year.isdigit() or not os.path.isdir(year_dir):
+            continue
+        for name in sorted(os.listdir(year_dir)):
+            stem, ext = os.path.splitext(name)
+            if stem.isdigit() and ext.lower() in SOURCE_EXTENSIONS:
+                sources.append(((int(year), int(stem)), os.path.join(year_dir, name)))
+    return sources
+
+
+def available_formats(formats):
+    """Pillowが書き出せる形式だけを返す（AVIFはビルドによっては未対応）"""
+    return {fmt: quality for fmt, quality in formats.items() if features.check(fmt)}
+
+
+def encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    options = {'quality': quality}
+    if fmt == 'webp':
+        options['method'] = 6
+    image.save(buffer, fmt.upper(), **options)
+    return buffer.getvalue()
+
+
+def build_variants(key, path, config, formats, previous=None):
+    """1枚の元画像から各形式・各幅の画像を作成し、マニフェストのエントリを返す
+
+    元画像の内容と設定が前回と同じで、出力ファイルがすべて残っている場合は作成し直さない。
+    ファイル名には内容のハッシュを含めるため、長期間キャッシュさせても更新が反映される。
+    """
+    with open(path, 'rb') as f:
+        source = f.read()
+    source_hash = hashlib.sha256(source).hexdigest()[:16]
+    settings_hash = hashlib.sha256(
+        json.dumps([config['WIDTHS'], formats], sort_keys=True).encode('utf-8')
+    ).hexdigest()[:8]
+    if (previous and previous['source_hash'] == source_hash and previous.get('settings_hash') == settings_hash
+            and all(os.path.exists(os.path.join(config['OUTPUT_DIR'], file))
+                    for variants in previous['variants'].values() for _, file in variants)):
+        return previous, False
+
+    # snapshotsはシリアライザ経由でこのモジュールを読み込むため、ここで読み込む
+    from .snapshots import write_atomic
+    year, rank = key
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(source)))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    widths = sorted({min(width, image.width) for width in config['WIDTHS']})
+    os.makedirs(os.path.join(config['OUTPUT_DIR'], str(year)), exist_ok=True)
+
+    variants = {}
+    for fmt, quality in formats.items():
+        variants[fmt] = []
+        for width in widths:
+            height = round(image.height * width / image.width)
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            data = encode(resized, fmt, quality)
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            file = f'{year}/{rank}-{width}.{digest}.{fmt}'
+            write_atomic(os.path.join(config['OUTPUT_DIR'], file), data)
+            variants[fmt].append((width, file))
+    entry = {
+        'source': os.path.relpath(path, config['SOURCE_DIR']).replace(os.sep, '/'),
+        'source_hash': source_hash,
+        'settings_hash': settings_hash,
+        'width': image.width,
+        'height': image.height,
+        'variants': variants,
+    }
+    return entry, True
+
+
+def build_images(config=None):
+    """すべての元画像の変換後の画像とマニフェストを作成し、(作成数, 再利用数, 削除数) を返す"""
+    if Image is None:
+        raise RuntimeError('画像の変換にはPillowが必要です')
+    from .snapshots import write_atomic
+    config = config or get_config()
+    output_dir = str(config['OUTPUT_DIR'])
+    config = {**config, 'SOURCE_DIR': str(config['SOURCE_DIR']), 'OUTPUT_DIR': output_dir}
+    formats = available_formats(config['FORMATS'])
+    previous = load_manifest_file(os.path.join(output_dir, MANIFEST_NAME)).get('images', {})
+
+    images = {}
+    built = reused = 0
+    for (year, rank), path in find_sources(config['SOURCE_DIR']):
+        key = f'{year}/{rank}'
+        images[key], changed = build_variants((year, rank), path, config, formats, previous.get(key))
+        built += changed
+        reused += not changed
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {'generated_at': int(time.time()), 'formats': list(formats), 'images': images}
+    write_atomic(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+    return built, reused, remove_unused(output_dir, images, previous)
+
+
+def referenced_files(images):
+    return {file for entry in images.values() for variants in entry['variants'].values() for _, file in variants}
+
+
+def remove_unused(output_dir, images, previous=None):
+    """現在と直前のマニフェストのどちらからも参照されなくなった出力ファイルを削除
+
+    直前の世代のファイルは、まだ古いマニフェストを使っているワーカーや、キャッシュ済みの
+    ランキング・スナップショット・ブラウザやCDNのキャッシュから参照されるため残す
+    （スナップショットのpruneと同様）。
+    """
+    used = referenced_files(images) | referenced_files(previous or {})
+    removed = 0
+    for year in os.listdir(output_dir):
+        year_dir = os.path.join(output_dir, year)
+        if not year.isdigit() or not os.path.isdir(year_dir):
+            continue
+        for name in os.listdir(year_dir):
+            if f'{year}/{name}' not in used:
+                os.unlink(os.path.join(year_dir, name))
+                removed += 1
+    return removed
+
+
+def load_manifest_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class ImageManifest:
+    """APIのレスポンスに含める画像情報（マニフェスト）を保持する
+
+    マニフェストは一定間隔で更新日時を確認し、build_imagesコマンドで作り直された場合は読み込み直す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._mtime = None
+        self._checked_at = None
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < RELOAD_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            config = get_config()
+            if config['OUTPUT_DIR'] is None:
+                self._entries, self._mtime = {}, None
+                return
+            path = os.path.join(str(config['OUTPUT_DIR']), MANIFEST_NAME)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._entries, self._mtime = {}, None
+                return
+            if mtime != self._mtime:
+                self._entries = self.parse(load_manifest_file(path), config)
+                self._mtime = mtime
+
+    @staticmethod
+    def parse(manifest, config):
+        """マニフェストを (年, 順位) -> APIで返す画像情報 の辞書に変換"""
+        entries = {}
+        for key, entry in manifest.get('images', {}).items():
+            year, rank = (int(part) for part in key.split('/'))
+            image = {
+                'src': config['SOURCE_URL'] + entry['source'],
+                'width': entry['width'],
+                'height': entry['height'],
+            }
+            for fmt, variants in entry['variants'].items():
+                image[fmt] = ', '.join(f"{config['OUTPUT_URL']}{file} {width}w" for width, file in variants)
+            entries[(year, rank)] = image
+        return entries
+
+    def get(self, year, rank):
+        """年と順位に対応する画像情報を返す（画像がない場合はNone）"""
+        self._reload_if_changed()
+        return self._entries.get((int(year), rank))
+
+    @property
+    def generation(self):
+        """読み込んでいるマニフェストの更新日時（ナノ秒、マニフェストがない場合はNone）
+
+        レスポンスの画像情報はマニフェストから作成するため、ETagとキャッシュキーに含める。
+        """
+        self._reload_if_changed()
+        return self._mtime
+
+    def last_modified(self, value):
+        """valueとマニフェストの更新日時の新しい方を返す（Last-Modified用）"""
+        generation = self.generation
+        if generation is None:
+            return value
+        modified = datetime.fromtimestamp(generation / 1e9, tz=timezone.utc)
+        return modified if value is None or modified > value else value
+
+    def reset(self):
+        """次回の参照時にマニフェストを読み込み直す"""
+        with self._lock:
+            self._checked_at = None
+            self._mtime = None
+
+
+image_manifest = ImageManifest()
@@ -0,0 +1,189 @@
+import csv
+import json
+import os
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import snapshots
+from .cache import ranking_cache
+from .models import Cart, CartItem, Novel
+
+# 1回のINSERT ... ON CONFLICTで書き込む最大行数の既定値
+DEFAULT_BATCH_SIZE = 1000
+# 結果に含める検証エラーの最大件数
+MAX_REPORTED_ERRORS = 20
+# JSON配列を読み込む際に一度に読むバイト数
+JSON_READ_SIZE = 1 << 16
+
+# インポートする列と、既存の行（year, nameが一致）に上書きする列
+IMPORT_FIELDS = ('name', 'author', 'publisher', 'rank', 'price', 'year')
+UNIQUE_FIELDS = ('year', 'name')
+UPDATE_FIELDS = ('author', 'publisher', 'rank', 'price', 'updated_at')
+
+
+def read_json(f):
+    """JSON配列（dumpdata形式のフィクスチャを含む）を先頭から1要素ずつ読み込む"""
+    decoder = json.JSONDecoder()
+    buffer, eof, opened = '', False, False
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer and not eof:
+            chunk = f.read(JSON_READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        if not opened:
+            if not buffer.startswith('['):
+                raise ValueError('JSONファイルは配列である必要があります')
+            buffer, opened = buffer[1:], True
+            continue
+        if not buffer:
+            raise ValueError('JSON配列が閉じられていません')
+        if buffer[0] == ']':
+            return
+        if buffer[0] == ',':
+            buffer = buffer[1:]
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # 要素が読み込んだ範囲をまたいでいる場合は続きを読み込んで再試行
+            chunk = '' if eof else f.read(JSON_READ_SIZE)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield record
+        buffer = buffer[end:]
+
+
+def read_ndjson(f):
+    """1行1レコードのJSON（NDJSON）を読み込む（解析できない行はValidationErrorとして返す）"""
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ValidationError('JSONとして解析できません')
+
+
+def read_csv(f):
+    """ヘッダー付きのCSVを読み込む"""
+    yield from csv.DictReader(f)
+
+
+READERS = {
+    'json': read_json,
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+EXTENSIONS = {'.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv'}
+
+
+def detect_format(path):
+    """拡張子から入力形式を判定（判定できない場合はNone）"""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+# (列名, モデルのフィールド) の組（行ごとにget_field()を呼ばないように事前に取得）
+IMPORT_MODEL_FIELDS = tuple((name, Novel._meta.get_field(name)) for name in IMPORT_FIELDS)
+
+
+def build_novel(record, default_year=None):
+    """1レコードを検証してNovelインスタンスを作成（不正な場合はValidationError）"""
+    if isinstance(record, ValidationError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValidationError('レコードがオブジェクトではありません')
+    # dumpdata形式（{"model": ..., "fields": {...}}）にも対応
+    fields = record.get('fields', record)
+    values = {}
+    errors = []
+    for name, field in IMPORT_MODEL_FIELDS:
+        value = fields.get(name)
+        if value is None or value == '':
+            if name == 'year' and default_year is not None:
+                value = default_year
+            elif field.has_default():
+                value = field.get_default()
+        try:
+            values[name] = field.clean(value, None)
+        except ValidationError as e:
+            errors.extend(f'{name}: {message}' for message in e.messages)
+    if errors:
+        raise ValidationError(errors)
+    return Novel(**values)
+
+
+def import_novels(records, batch_size=DEFAULT_BATCH_SIZE, default_year=None, prune=False):
+    """レコードを検証し、(year, name) をキーとして一定件数ずつ一括でupsertする
+
+    すべての書き込みを1つのトランザクションで行うため、読み手が途中の状態のランキングを見ることはない。
+    prune=Trueの場合、インポートした年のうち今回のデータに含まれない小説を削除する
+    （その小説を含むカートアイテムも削除される）。
+    インポートした年の小説を含むカートの合計も同じトランザクションで再計算する。
+    コミット後にランキングキャッシュを無効化し、作成済みのスナップショットを更新する。
+    """
+    result = {'rows': 0, 'imported': 0, 'invalid': 0, 'pruned': 0, 'errors': [], 'years': set()}
+    batch = {}
+
+    def flush():
+        Novel.objects.bulk_create(
+            batch.values(),
+            update_conflicts=True,
+            unique_fields=UNIQUE_FIELDS,
+            update_fields=UPDATE_FIELDS,
+        )
+        result['imported'] += len(batch)
+        batch.clear()
+
+    with transaction.atomic():
+        # 今回書き込む行のupdated_atはすべてこの時刻以降になる（pruneの判定に使用）
+        started = timezone.now()
+        for row_number, record in enumerate(records, start=1):
+            result['rows'] += 1
+            try:
+                novel = build_novel(record, default_year)
+            except ValidationError as e:
+                result['invalid'] += 1
+                if len(result['errors']) < MAX_REPORTED_ERRORS:
+                    result['errors'].append((row_number, '; '.join(e.messages)))
+                continue
+            result['years'].add(novel.year)
+            # 同じバッチ内で同じキーが複数回現れた場合は後の行を優先（同じ行を2回更新できないため）
+            batch[(novel.year, novel.name)] = novel
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+        pruned_cart_ids = []
+        if prune and result['years']:
+            result['pruned'], pruned_cart_ids = prune_novels(result['years'], started)
+
+        if result['years']:
+            # 一括upsertではシグナルが送られないため、価格の変更をカートの合計にまとめて反映する
+            Cart.objects.filter(
+                Q(items__novel__year__in=result['years']) | Q(id__in=pruned_cart_ids)
+            ).recalculate_totals()
+            transaction.on_commit(ranking_cache.invalidate)
+            snapshots.schedule_rebuild(*result['years'])
+    return result
+
+
+def prune_novels(years, started):
+    """今回のインポートで書き込まれなかった小説を削除し、(削除数, 影響を受けたカートのID) を返す
+
+    QuerySet.delete()は削除する行を1件ずつ読み込んでシグナルを送るため、小説ごとにカートの
+    再計算やキャッシュの無効化が行われる。シグナルを送らずに一括で削除し、カートの合計・
+    キャッシュ・スナップショットの更新は呼び出し元でまとめて1回だけ行う。
+    """
+    stale = Novel.objects.filter(year__in=years, updated_at__lt=started)
+    cart_ids = list(Cart.objects.filter(items__novel__in=stale).values_list('id', flat=True).distinct())
+    items = CartItem.objects.filter(novel__in=stale)
+    items._raw_delete(items.db)
+    return stale._raw_delete(stale.db), cart_ids
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cart import images, snapshots
+from cart.cache import ranking_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'ランキング画像（public/image/<年>/<順位>.*）から複数の幅のWebP/AVIF画像と、'
+        'APIが参照するマニフェストを作成します。内容が変わっていない画像は作成し直しません。'
+    )
+
+    def handle(self, *args, **options):
+        try:
+            built, reused, removed = images.build_images()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        # 画像情報はランキングのレスポンスに含まれるため、キャッシュとスナップショットを更新
+        images.image_manifest.reset()
+        ranking_cache.invalidate()
+        for year in snapshots.snapshot_years():
+            snapshots.build(year)
+        self.stdout.write(f'作成 {built} 枚, 再利用 {reused} 枚, 削除 {removed} ファイル')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cart import snapshots
+from cart.models import Novel
+
+
+class Command(BaseCommand):
+    help = (
+        '年別ランキングのスナップショット（JSONと事前圧縮版）を作成します。'
+        '年を指定しない場合は、小説が存在する年と作成済みの年をすべて対象にします。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('years', nargs='*', type=int, help='対象の年')
+        parser.add_argument('--stale-only', action='store_true', help='作成済みで古くなったスナップショットのみ再作成する')
+
+    def handle(self, *args, **options):
+        years = options['years'] or sorted(
+            set(Novel.objects.order_by().values_list('year', flat=True).distinct()) | set(snapshots.snapshot_years())
+        )
+        for year in years:
+            if options['stale_only']:
+                manifest = snapshots.rebuild_if_stale(year)
+            else:
+                manifest = snapshots.build(year)
+            if manifest is None:
+                self.stdout.write(f'{year}: 変更なし')
+            else:
+                self.stdout.write(f"{year}: 世代 {manifest['generation']} ({manifest['size']} バイト)")
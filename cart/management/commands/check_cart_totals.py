@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cart.models import Cart
+
+# 一覧に表示する不一致の最大件数
+MAX_REPORTED = 20
+# 1回のUPDATEで再計算するカート数（SQLiteのパラメータ数の上限を超えないように分割）
+FIX_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'カートの合計列（total_items・total_amount）がアイテムから計算した値と一致するか確認します。'
+        '不一致がある場合は終了コード1で終了し、--fixを指定した場合は再計算します。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='一致しないカートの合計を再計算する')
+
+    def handle(self, *args, **options):
+        rows = list(Cart.objects.inconsistent().order_by('id').values_list(
+            'id', 'total_items', 'total_amount', 'computed_items', 'computed_amount'
+        ))
+        for cart_id, total_items, total_amount, computed_items, computed_amount in rows[:MAX_REPORTED]:
+            self.stdout.write(
+                f'カート {cart_id}: 商品総数 {total_items} -> {computed_items}, 総金額 {total_amount} -> {computed_amount}'
+            )
+        if len(rows) > MAX_REPORTED:
+            self.stdout.write(f'...他 {len(rows) - MAX_REPORTED} 件')
+
+        if not rows:
+            self.stdout.write('すべてのカートの合計が一致しています')
+            return
+        if not options['fix']:
+            raise CommandError(f'合計が一致しないカートが {len(rows)} 件あります（--fixで再計算できます）')
+
+        cart_ids = [row[0] for row in rows]
+        fixed = 0
+        for start in range(0, len(cart_ids), FIX_BATCH_SIZE):
+            with transaction.atomic():
+                fixed += Cart.objects.filter(id__in=cart_ids[start:start + FIX_BATCH_SIZE]).recalculate_totals()
+        self.stdout.write(f'{fixed} 件のカートの合計を再計算しました')
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart import export
+
+
+class Command(BaseCommand):
+    help = (
+        '小説のカタログ（またはカートの内容）をNDJSONまたはCSVで出力します。'
+        '一定件数ずつ読み込んで書き出すため、件数が多くてもメモリ使用量は一定です。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=sorted(export.FORMATS), default='ndjson', help='出力形式')
+        parser.add_argument('--dataset', choices=sorted(export.DATASETS), default='novels', help='出力するデータ')
+        parser.add_argument('--year', type=int, default=None, help='指定した年の小説のみ出力する')
+        parser.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE, help='1回に読み込む行数')
+        parser.add_argument('-o', '--output', default='-', help='出力先のファイル（既定は標準出力）')
+
+    def handle(self, *args, **options):
+        _, make_records, _ = export.DATASETS[options['dataset']]
+        records = make_records(year=options['year'], chunk_size=options['chunk_size'])
+        count = 0
+
+        def counted(records):
+            nonlocal count
+            for record in records:
+                count += 1
+                yield record
+
+        chunks = export.stream(options['dataset'], options['type'], records=counted(records))
+        start = time.perf_counter()
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            self.stdout.flush()
+        else:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        elapsed = time.perf_counter() - start
+        summary = f'{count} 件を出力しました ({elapsed:.2f} 秒)'
+        if options['output'] == '-':
+            # 標準出力はデータに使うため、結果は標準エラー出力に表示
+            self.stderr.write(summary, style_func=lambda message: message)
+        else:
+            self.stdout.write(summary)
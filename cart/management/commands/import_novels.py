@@ -0,0 +1,54 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cart import importer
+
+
+class Command(BaseCommand):
+    help = (
+        'JSON・NDJSON・CSVのランキングデータを読み込み、(年, 小説名) をキーとして一括でupsertします。'
+        '不正な行はスキップして報告します。ファイルに "-" を指定すると標準入力から読み込みます。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='入力ファイル（- は標準入力）')
+        parser.add_argument('--format', dest='input_format', choices=sorted(importer.READERS), default=None,
+                            help='入力形式（省略時は拡張子から判定）')
+        parser.add_argument('--batch-size', type=int, default=importer.DEFAULT_BATCH_SIZE, help='1回の書き込みの最大行数')
+        parser.add_argument('--year', type=int, default=None, help='年が指定されていない行に使用する年')
+        parser.add_argument('--prune', action='store_true',
+                            help='インポートした年のうち、ファイルに含まれない小説を削除する（カートからも削除されます）')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['input_format'] or importer.detect_format(path)
+        if input_format is None:
+            raise CommandError('入力形式を判定できません。--format を指定してください')
+
+        start = time.perf_counter()
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        try:
+            result = importer.import_novels(
+                importer.READERS[input_format](f),
+                batch_size=options['batch_size'],
+                default_year=options['year'],
+                prune=options['prune'],
+            )
+        except ValueError as e:
+            raise CommandError(f'入力ファイルを読み込めません: {e}')
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        elapsed = time.perf_counter() - start
+
+        for row_number, message in result['errors']:
+            self.stderr.write(f'{row_number} 行目: {message}')
+        if result['invalid'] > len(result['errors']):
+            self.stderr.write(f"... ほか {result['invalid'] - len(result['errors'])} 件のエラー")
+        rate = result['rows'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"読み込み {result['rows']} 行, 書き込み {result['imported']} 件, 不正 {result['invalid']} 件, "
+            f"削除 {result['pruned']} 件 ({elapsed:.2f} 秒, {rate:,.0f} 行/秒)"
+        )
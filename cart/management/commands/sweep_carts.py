@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.sweeper import DEFAULT_BATCH_SIZE, sweep
+
+
+class Command(BaseCommand):
+    help = (
+        '期限切れの匿名カート・カートアイテム・django_sessionの行を一定件数ずつ削除します。'
+        'cronなどで定期的に実行するか、--intervalを指定して常駐させてください。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='1回のトランザクションで削除する最大件数')
+        parser.add_argument('--max-batches', type=int, default=None, help='1回の掃除で処理する最大バッチ数')
+        parser.add_argument('--interval', type=int, default=None, help='指定した秒数ごとに掃除を繰り返す')
+        parser.add_argument('--dry-run', action='store_true', help='削除せずに対象件数のみ表示する')
+
+    def handle(self, *args, **options):
+        while True:
+            result = sweep(
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+                dry_run=options['dry_run'],
+            )
+            verb = '削除対象' if options['dry_run'] else '削除しました'
+            self.stdout.write(
+                f"{verb}: カート {result['carts']} 件, アイテム {result['items']} 件, セッション {result['sessions']} 件"
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
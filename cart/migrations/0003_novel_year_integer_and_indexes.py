@@ -0,0 +1,57 @@
+# Generated by Django 4.2.24 on 2026-10-17 20:57
+
+from django.db import migrations, models
+
+
+def normalize_years(apps, schema_editor):
+    """整数型へ変換する前に、年の値を前後の空白を除いた数字に揃え、数字でない値は既定値に置き換える
+
+    小説ごとではなく異なる値ごとに1回のUPDATEで処理する（値の種類は年の数程度）。
+    """
+    Novel = apps.get_model('cart', 'Novel')
+    for year in Novel.objects.order_by().values_list('year', flat=True).distinct():
+        # strip()はタブ・改行・全角スペースも取り除き、int()は全角数字も半角に変換する
+        cleaned = (year or '').strip()
+        try:
+            cleaned = str(int(cleaned)) if cleaned.isdigit() else '2025'
+        except ValueError:  # '²' のようにint()で変換できない数字
+            cleaned = '2025'
+        if cleaned != year:
+            Novel.objects.filter(year=year).update(year=cleaned)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_novel_year'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_years, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='cart',
+            options={'verbose_name': 'カート', 'verbose_name_plural': 'カートリスト'},
+        ),
+        migrations.AlterModelOptions(
+            name='cartitem',
+            options={'verbose_name': 'カートアイテム', 'verbose_name_plural': 'カートアイテムリスト'},
+        ),
+        migrations.AlterModelOptions(
+            name='novel',
+            options={'ordering': ['rank'], 'verbose_name': '小説', 'verbose_name_plural': '小説リスト'},
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='session_key',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True, verbose_name='セッションキー'),
+        ),
+        migrations.AlterField(
+            model_name='novel',
+            name='year',
+            field=models.PositiveSmallIntegerField(default=2025, verbose_name='年'),
+        ),
+        migrations.AddIndex(
+            model_name='novel',
+            index=models.Index(fields=['year', 'rank'], name='novel_year_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_cart_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='バージョン'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.24 on 2026-10-17 21:15
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicates(apps, schema_editor):
+    """一意制約を追加する前に、同じ年・同じ名前の小説（2件目以降）の名前にIDを付けて区別する"""
+    Novel = apps.get_model('cart', 'Novel')
+    duplicates = (
+        Novel.objects.order_by().values('year', 'name').annotate(count=Count('id')).filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        novel_ids = list(Novel.objects.filter(
+            year=duplicate['year'], name=duplicate['name']
+        ).order_by('id').values_list('id', flat=True)[1:])
+        for novel_id in novel_ids:
+            name = f"{duplicate['name']} ({novel_id})"
+            Novel.objects.filter(id=novel_id).update(name=name[:200])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0005_cart_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='novel',
+            constraint=models.UniqueConstraint(fields=('year', 'name'), name='novel_year_name_uniq'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.24 on 2026-10-17 21:30
+
+from django.db import migrations
+
+# 小説名・作者・出版社の全文検索インデックス（SQLite FTS5、trigramトークナイザで日本語にも対応）
+# cart_novelを外部コンテンツとし、トリガーで同期するため、bulk_createやupdate()による変更も反映される。
+# 注意：SQLiteでcart_novelを作り直すマイグレーション（列の変更など）を追加した場合、トリガーも作り直すこと。
+CREATE_STATEMENTS = [
+    """
+    CREATE VIRTUAL TABLE cart_novel_fts USING fts5(
+        name, author, publisher,
+        content='cart_novel', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER cart_novel_fts_insert AFTER INSERT ON cart_novel BEGIN
+        INSERT INTO cart_novel_fts(rowid, name, author, publisher)
+        VALUES (new.id, new.name, new.author, new.publisher);
+    END
+    """,
+    """
+    CREATE TRIGGER cart_novel_fts_delete AFTER DELETE ON cart_novel BEGIN
+        INSERT INTO cart_novel_fts(cart_novel_fts, rowid, name, author, publisher)
+        VALUES ('delete', old.id, old.name, old.author, old.publisher);
+    END
+    """,
+    """
+    CREATE TRIGGER cart_novel_fts_update AFTER UPDATE OF name, author, publisher ON cart_novel BEGIN
+        INSERT INTO cart_novel_fts(cart_novel_fts, rowid, name, author, publisher)
+        VALUES ('delete', old.id, old.name, old.author, old.publisher);
+        INSERT INTO cart_novel_fts(rowid, name, author, publisher)
+        VALUES (new.id, new.name, new.author, new.publisher);
+    END
+    """,
+    # 既存の小説をインデックスに登録
+    "INSERT INTO cart_novel_fts(cart_novel_fts) VALUES ('rebuild')",
+]
+
+DROP_STATEMENTS = [
+    'DROP TRIGGER IF EXISTS cart_novel_fts_update',
+    'DROP TRIGGER IF EXISTS cart_novel_fts_delete',
+    'DROP TRIGGER IF EXISTS cart_novel_fts_insert',
+    'DROP TABLE IF EXISTS cart_novel_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    """SQLiteの場合のみ全文検索インデックスを作成（他のデータベースではLIKE検索を使用）"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_STATEMENTS:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_STATEMENTS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0006_novel_year_name_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
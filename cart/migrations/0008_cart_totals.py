@@ -0,0 +1,44 @@
+# Generated by Django 4.2.24 on 2026-10-17 21:28
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    """既存のカートの合計列をアイテムから計算して設定する"""
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    amount_field = Cart._meta.get_field('total_amount')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        total_items=Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), 0),
+        total_amount=Coalesce(
+            Subquery(items.annotate(
+                total=Sum(F('quantity') * F('novel__price'), output_field=amount_field)
+            ).values('total')),
+            Value(0),
+            output_field=amount_field,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0007_novel_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, verbose_name='商品総数'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='総金額'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.24 on 2026-10-17 22:05
+
+from django.db import migrations, models
+
+# 登録時のメールアドレスの重複を一意制約で検出する（重複の事前確認のSELECTを行わない）
+# メールアドレスが空のユーザー（管理コマンドで作成した場合など）は対象外にする部分インデックス
+CREATE_INDEX = "CREATE UNIQUE INDEX auth_user_email_uniq ON auth_user (email) WHERE email <> ''"
+DROP_INDEX = 'DROP INDEX IF EXISTS auth_user_email_uniq'
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """既に重複しているメールアドレスがあればインデックスを作成する前に中止する"""
+    User = apps.get_model('auth', 'User')
+    duplicates = list(
+        User.objects.exclude(email='').order_by().values('email')
+        .annotate(count=models.Count('id')).filter(count__gt=1).values_list('email', flat=True)[:10]
+    )
+    if duplicates:
+        raise RuntimeError('重複しているメールアドレスを解消してから再実行してください: ' + ', '.join(duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('cart', '0008_cart_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
@@ -1,7 +1,11 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.utils import timezone
 
+from .conditional import make_etag
+
 # モデルを作成
 
 class Novel(models.Model):
@@ -11,7 +15,7 @@ class Novel(models.Model):
     publisher = models.CharField(max_length=100, verbose_name='出版社')
     rank = models.IntegerField(default=0, verbose_name='ランキング')
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='価格')
-    year = models.CharField(max_length=4, default='2025', verbose_name='年')
+    year = models.PositiveSmallIntegerField(default=2025, verbose_name='年')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日時')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新日時')
     
@@ -22,6 +26,46 @@ class Novel(models.Model):
         verbose_name = '小説'
         verbose_name_plural = '小説リスト'
         ordering = ['rank']
+        indexes = [
+            # 年別ランキング（WHERE year = ? ORDER BY rank）をインデックスだけで処理する
+            models.Index(fields=['year', 'rank'], name='novel_year_rank_idx'),
+        ]
+        constraints = [
+            # 一括インポート（import_novels）で同じ年の同じ作品を上書きするための自然キー
+            models.UniqueConstraint(fields=['year', 'name'], name='novel_year_name_uniq'),
+        ]
+
+class CartQuerySet(models.QuerySet):
+    """カートの合計（total_items・total_amount列）の再計算と検証"""
+    
+    @staticmethod
+    def computed_totals():
+        """アイテムから計算した商品総数・総金額の相関サブクエリ（update()やannotate()で使用）"""
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        amount_field = Cart._meta.get_field('total_amount')
+        total_items = items.annotate(total=Sum('quantity')).values('total')
+        total_amount = items.annotate(
+            total=Sum(F('quantity') * F('novel__price'), output_field=amount_field)
+        ).values('total')
+        return {
+            'total_items': Coalesce(Subquery(total_items), 0),
+            'total_amount': Coalesce(Subquery(total_amount), Value(0), output_field=amount_field),
+        }
+    
+    def recalculate_totals(self):
+        """対象のカートの合計列を1回のUPDATEで再計算し、更新した件数を返す"""
+        return self.update(**self.computed_totals())
+    
+    def with_computed_totals(self):
+        """アイテムから計算した合計を computed_items・computed_amount として付与"""
+        totals = self.computed_totals()
+        return self.annotate(computed_items=totals['total_items'], computed_amount=totals['total_amount'])
+    
+    def inconsistent(self):
+        """合計列がアイテムから計算した値と一致しないカート"""
+        return self.with_computed_totals().exclude(
+            total_items=F('computed_items'), total_amount=F('computed_amount')
+        )
 
 class Cart(models.Model):
     """カートモデル"""
@@ -32,15 +76,211 @@ class Cart(models.Model):
         related_name='cart',
         verbose_name='ユーザー'
     )
-    session_key = models.CharField(max_length=40, null=True, blank=True, verbose_name='セッションキー')
+    session_key = models.CharField(max_length=40, null=True, blank=True, db_index=True, verbose_name='セッションキー')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日時')
-    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新日時')
+    # 期限切れカートの掃除（cart/sweeper.py）で範囲検索するためインデックスを付与
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='更新日時')
+    # カートが変更されるたびに増えるバージョン番号（クライアントが古い状態を検出するために使用）
+    version = models.PositiveIntegerField(default=0, verbose_name='バージョン')
+    # アイテムの変更と同じトランザクションで更新する合計（表示のたびにアイテムを集計しない）
+    total_items = models.PositiveIntegerField(default=0, verbose_name='商品総数')
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='総金額')
+    
+    objects = CartQuerySet.as_manager()
     
     def __str__(self):
         if self.user:
             return f"{self.user.username}のカート"
         return f"匿名カート (セッション: {self.session_key})"
     
+    def add_novel(self, novel, quantity):
+        """商品をカートに追加する（既存の場合は数量を加算）
+
+        読み込み→加算→保存ではなくF式による1回のUPDATEで加算するため、
+        同じセッションから同時にリクエストされても更新が失われない。
+        """
+        with transaction.atomic():
+            self._bump_version()
+            if self._increment_item(novel, quantity):
+                self._update_totals()
+                return
+            try:
+                with transaction.atomic():
+                    CartItem.objects.create(cart=self, novel=novel, quantity=quantity)
+            except IntegrityError:
+                # 他のリクエストが先に作成した場合は、そのアイテムに加算する
+                self._increment_item(novel, quantity)
+            self._update_totals()
+    
+    def _increment_item(self, novel, quantity):
+        return CartItem.objects.filter(cart=self, novel=novel).update(
+            quantity=F('quantity') + quantity, updated_at=timezone.now()
+        )
+    
+    def change_item_quantity(self, item_id, delta):
+        """アイテムの数量をdeltaだけ増減し、0以下になった場合は削除する
+
+        アイテムが存在しない場合はFalseを返す。
+        """
+        with transaction.atomic():
+            updated = self.items.filter(id=item_id).update(
+                quantity=F('quantity') + delta, updated_at=timezone.now()
+            )
+            if not updated:
+                return False
+            # 数量の判定もDB上で行い、同時更新の結果を正しく反映する
+            self.items.filter(id=item_id, quantity__lte=0).delete()
+            self._bump_version(**Cart.objects.computed_totals())
+        return True
+    
+    def remove_item(self, item_id):
+        """アイテムを削除する。アイテムが存在しない場合はFalseを返す"""
+        with transaction.atomic():
+            deleted, _ = self.items.filter(id=item_id).delete()
+            if not deleted:
+                return False
+            self._bump_version(**Cart.objects.computed_totals())
+        return True
+    
+    def clear_items(self):
+        """カート内のすべてのアイテムを削除する"""
+        with transaction.atomic():
+            self.items.all().delete()
+            self._bump_version(total_items=0, total_amount=0)
+    
+    def merge_from(self, other):
+        """他のカート（ログイン前の匿名カート）のアイテムをこのカートに統合し、統合元のカートを削除する
+
+        同じ小説のアイテムは数量を合算する。両方のカートの数量をDB上で1回の集計で求め、
+        (cart, novel) の一意制約に対する1回のbulk_create（競合時は数量を更新）で書き込むため、
+        アイテム数によらずクエリの回数は一定になる。
+        """
+        with transaction.atomic():
+            # 最初にカート行を更新して書き込みロックを取得し、同じカートへの変更を直列化する
+            self._bump_version()
+            quantities = (
+                CartItem.objects
+                .filter(cart__in=(self.pk, other.pk), novel__in=other.items.values('novel'))
+                .order_by()
+                .values_list('novel_id')
+                .annotate(total=Sum('quantity'))
+            )
+            CartItem.objects.bulk_create(
+                [CartItem(cart=self, novel_id=novel_id, quantity=total) for novel_id, total in quantities],
+                update_conflicts=True,
+                unique_fields=['cart', 'novel'],
+                update_fields=['quantity', 'updated_at'],
+            )
+            Cart.objects.filter(pk=other.pk).delete()
+            self._update_totals()
+    
+    def _bump_version(self, **fields):
+        """バージョン番号を1つ進め、更新日時を記録する（fieldsは同じUPDATEで更新する列）"""
+        now = timezone.now()
+        Cart.objects.filter(pk=self.pk).update(version=F('version') + 1, updated_at=now, **fields)
+        self.updated_at = now
+    
+    def _update_totals(self):
+        """アイテムの変更後に合計列を再計算する（変更と同じトランザクション内で呼び出す）"""
+        Cart.objects.filter(pk=self.pk).recalculate_totals()
+    
+    def apply_operations(self, operations):
+        """追加・数量変更・削除の操作リストを1つのトランザクションでまとめて適用する
+
+        operationsは (操作, 対象ID, 数量) のタプルのリスト。操作は 'add'（対象は小説ID）、
+        'update'・'remove'（対象はカートアイテムID）のいずれか。現在のアイテムを1回で読み込み、
+        メモリ上で最終的な数量を計算してから bulk_create / bulk_update / 一括削除で書き込む。
+        存在しない小説やアイテムを指定した場合は何も変更せずに DoesNotExist を送出する。
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # 最初にカート行を更新して書き込みロックを取得し、同じカートへの一括操作を直列化する
+            self._bump_version()
+            items = {item.novel_id: item for item in self.items.select_for_update()}
+            item_novels = {item.id: item.novel_id for item in items.values()}
+            
+            novel_ids = {target for op, target, _ in operations if op == 'add'}
+            found = set(Novel.objects.filter(id__in=novel_ids).values_list('id', flat=True))
+            if novel_ids - found:
+                raise Novel.DoesNotExist(f'小説が存在しません: {sorted(novel_ids - found)}')
+            
+            # 小説IDごとの最終的な数量を計算（0以下は削除）
+            quantities = {novel_id: item.quantity for novel_id, item in items.items()}
+            for op, target, quantity in operations:
+                if op == 'add':
+                    quantities[target] = max(quantities.get(target) or 0, 0) + quantity
+                    continue
+                novel_id = item_novels.get(target)
+                if novel_id is None or quantities.get(novel_id) is None:
+                    raise CartItem.DoesNotExist(f'カートアイテムが存在しません: {target}')
+                if op == 'update':
+                    quantities[novel_id] += quantity
+                if op == 'remove' or quantities[novel_id] <= 0:
+                    quantities[novel_id] = None
+            
+            to_create, to_update, to_delete = [], [], []
+            for novel_id, quantity in quantities.items():
+                item = items.get(novel_id)
+                if item is None:
+                    if quantity is not None:
+                        to_create.append(CartItem(cart=self, novel_id=novel_id, quantity=quantity))
+                elif quantity is None:
+                    to_delete.append(item.id)
+                elif quantity != item.quantity:
+                    item.quantity = quantity
+                    item.updated_at = now
+                    to_update.append(item)
+            
+            if to_delete:
+                CartItem.objects.filter(id__in=to_delete).delete()
+            if to_update:
+                CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+            if to_create:
+                CartItem.objects.bulk_create(to_create)
+            self._update_totals()
+    
+    SUMMARY_FIELDS = ('total_items', 'total_amount', 'version')
+    EMPTY_SUMMARY = {'total_items': 0, 'total_amount': 0, 'version': 0}
+    
+    def loaded_summary(self):
+        """読み込み済みのカート行の商品総数・総金額とバージョン（クエリを発行しない）"""
+        return {field: getattr(self, field) for field in self.SUMMARY_FIELDS}
+    
+    def summary(self):
+        """カート内の商品総数・総金額と現在のバージョンをカート行から読み込み直す（変更後のレスポンス用）"""
+        totals = Cart.objects.filter(pk=self.pk).values(*self.SUMMARY_FIELDS).first()
+        return totals or dict(self.EMPTY_SUMMARY)
+    
+    async def asummary(self):
+        """summary()の非同期版"""
+        totals = await Cart.objects.filter(pk=self.pk).values(*self.SUMMARY_FIELDS).afirst()
+        return totals or dict(self.EMPTY_SUMMARY)
+    
+    @staticmethod
+    def fingerprint_aggregates():
+        return {
+            'count': models.Count('id'),
+            'quantity': models.Sum('quantity'),
+            'items_modified': models.Max('updated_at'),
+            'novels_modified': models.Max('novel__updated_at'),
+        }
+    
+    def fingerprint(self):
+        """カートの内容を表すETagとLast-Modifiedを1回の集計クエリで計算"""
+        return self.make_fingerprint(self.items.aggregate(**self.fingerprint_aggregates()))
+    
+    async def afingerprint(self):
+        """fingerprint()の非同期版"""
+        return self.make_fingerprint(await self.items.aaggregate(**self.fingerprint_aggregates()))
+    
+    def make_fingerprint(self, stats):
+        etag = make_etag('cart', self.pk, self.updated_at, *stats.values())
+        last_modified = max(
+            value for value in (self.updated_at, stats['items_modified'], stats['novels_modified'])
+            if value is not None
+        )
+        return etag, last_modified
+    
     class Meta:
         verbose_name = 'カート'
         verbose_name_plural = 'カートリスト'
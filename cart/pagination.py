@@ -0,0 +1,185 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# クライアントが指定できる1ページあたりの最大件数
+MAX_PAGE_SIZE = 100
+
+
+def parse_positive_int(value, cutoff=None):
+    """正の整数に変換（不正な値はValueError）、cutoffを超える場合はcutoffに丸める"""
+    number = int(value)
+    if number <= 0:
+        raise ValueError(value)
+    return min(number, cutoff) if cutoff else number
+
+
+# Novel.year（PositiveSmallIntegerField）として扱える年の範囲
+YEAR_RANGE = (0, 32767)
+
+
+def parse_year(value):
+    """年のクエリパラメータを整数に変換（整数でない値や範囲外の値はValueError）
+
+    str.isdigit()は '²' のような int() で変換できない数字も受け付けるため、int() で直接変換する。
+    """
+    year = int(value)
+    if not YEAR_RANGE[0] <= year <= YEAR_RANGE[1]:
+        raise ValueError(value)
+    return year
+
+
+class NovelPageNumberPagination(PageNumberPagination):
+    """ページ番号によるページネーション（page_sizeの指定と件数の省略に対応）
+
+    `?count=false` を指定するとCOUNT(*)を発行せず、1件多く取得して次ページの有無だけを判定する。
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+    count_query_param = 'count'
+
+    # 以下のクラスメソッドはクエリパラメータ（QueryDict）を受け取り、非同期版の小説リストでも使用する
+    @classmethod
+    def counts_rows(cls, params):
+        return params.get(cls.count_query_param, '').lower() not in ('false', '0', 'no')
+
+    @classmethod
+    def page_size_from(cls, params):
+        """1ページの件数（不正な値は既定値、max_page_sizeを超える値は丸める）"""
+        try:
+            return parse_positive_int(params[cls.page_size_query_param], cls.max_page_size)
+        except (KeyError, ValueError):
+            return cls.page_size
+
+    @classmethod
+    def page_number_from(cls, params):
+        """ページ番号（不正な値はNotFound）"""
+        try:
+            return parse_positive_int(params.get(cls.page_query_param, 1))
+        except (TypeError, ValueError):
+            raise NotFound(cls.invalid_page_message)
+
+    def wants_count(self, request):
+        return self.counts_rows(request.query_params)
+
+    def get_page_size(self, request):
+        return self.page_size_from(request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.wants_count(request):
+            self.has_next = None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.page_number = self.page_number_from(request.query_params)
+        offset = (self.page_number - 1) * self.page_size
+        rows = list(queryset[offset:offset + self.page_size + 1])
+        if not rows and self.page_number > 1:
+            raise NotFound(self.invalid_page_message)
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_paginated_response(self, data):
+        if self.has_next is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_uncounted_link(self.page_number + 1) if self.has_next else None),
+            ('previous', self.get_uncounted_link(self.page_number - 1) if self.page_number > 1 else None),
+            ('results', data),
+        ]))
+
+    def get_uncounted_link(self, page_number):
+        url = self.request.build_absolute_uri()
+        if page_number == 1:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, page_number)
+
+
+class NovelKeysetPagination(BasePagination):
+    """(year, rank, id) の順序によるキーセット（カーソル）ページネーション
+
+    前ページ最後の行のキーより後ろの行をインデックスで直接取得するため、
+    OFFSETやCOUNT(*)を使わず、どの深さのページでも同じコストで取得できる。
+    前方向（next）のみに対応する。
+    """
+    ordering = ('year', 'rank', 'id')
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = '無効なカーソルです'
+
+    def get_page_size(self, request):
+        try:
+            return parse_positive_int(request.query_params[self.page_size_query_param], self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def encode_cursor(self, position):
+        return base64.urlsafe_b64encode(json.dumps(list(position)).encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """カーソルを (year, rank, id) に復元（指定なしはNone）"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (UnicodeEncodeError, binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list) or len(position) != len(self.ordering)
+                or not all(type(value) is int for value in position)):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def filter_after(self, queryset, position):
+        """(year, rank, id) > position の行に絞り込む（行値比較を展開した条件）
+
+        ORで展開した条件だけではSQLiteがインデックスの範囲検索を使えないため、
+        先頭列の下限（year >= position[0]）を冗長に追加して走査の開始位置を決める。
+        """
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            equal = {name: value for name, value in zip(self.ordering[:i], position)}
+            condition |= Q(**equal, **{f'{field}__gt': position[i]})
+        return queryset.filter(Q(**{f'{self.ordering[0]}__gte': position[0]}), condition)
+
+    def get_position(self, item, view=None):
+        """行のキーを取得（values_list()の行はビューのget_cursor_positionで変換）"""
+        if view is not None and hasattr(view, 'get_cursor_position'):
+            return view.get_cursor_position(item)
+        return tuple(getattr(item, field) for field in self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = self.filter_after(queryset, position)
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = self.get_position(rows[-1], view) if self.has_next else None
+        return rows
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
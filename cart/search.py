@@ -0,0 +1,84 @@
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Novel
+
+# 全文検索インデックス（マイグレーション0007で作成するFTS5仮想テーブル）
+FTS_TABLE = 'cart_novel_fts'
+# trigramトークナイザは3文字未満の語を検索できないため、それより短い語はLIKE検索にフォールバックする
+MIN_INDEXED_TERM_LENGTH = 3
+# 1回の検索で使用する語の最大数
+MAX_TERMS = 8
+# bm25()の列ごとの重み（小説名, 作者, 出版社）
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+SEARCH_FIELDS = ('name', 'author', 'publisher')
+
+
+def split_terms(query):
+    """検索文字列を空白で区切って語の一覧にする（全角スペースも区切りとして扱う）"""
+    return query.split()[:MAX_TERMS]
+
+
+def can_use_index(terms):
+    """全文検索インデックスで検索できるか（SQLiteで、すべての語が3文字以上）"""
+    return (
+        bool(terms)
+        and connection.vendor == 'sqlite'
+        and all(len(term) >= MIN_INDEXED_TERM_LENGTH for term in terms)
+    )
+
+
+def match_expression(terms):
+    """FTS5のMATCH式を作成（各語を引用符で囲み、演算子として解釈されないようにする）"""
+    return ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+def matching_ids(terms):
+    """検索語にすべて一致する小説のIDを返すサブクエリ（id__in=で使用）"""
+    return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match_expression(terms)])
+
+
+def like_filter(terms):
+    """インデックスを使わない検索条件（いずれかの列に各語を含む）"""
+    condition = Q()
+    for term in terms:
+        term_condition = Q()
+        for field in SEARCH_FIELDS:
+            term_condition |= Q(**{f'{field}__icontains': term})
+        condition &= term_condition
+    return condition
+
+
+def ranked_ids(terms, year=None, limit=10):
+    """関連度（bm25）の高い順に小説のIDを返す。同じ関連度ではランキング順"""
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    sql = (
+        f'SELECT n.id FROM {FTS_TABLE} f JOIN {Novel._meta.db_table} n ON n.id = f.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s'
+    )
+    params = [match_expression(terms)]
+    if year is not None:
+        sql += ' AND n.year = %s'
+        params.append(year)
+    sql += f' ORDER BY bm25({FTS_TABLE}, {weights}), n.rank, n.id LIMIT %s'
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_rows(query, columns, year=None, limit=10):
+    """小説を検索し、指定した列のvalues_list()の行を関連度順に返す"""
+    terms = split_terms(query)
+    if not terms:
+        return []
+    if can_use_index(terms):
+        ids = ranked_ids(terms, year=year, limit=limit)
+        rows = Novel.objects.filter(id__in=ids).values_list('id', *columns)
+        by_id = {row[0]: row[1:] for row in rows}
+        return [by_id[novel_id] for novel_id in ids if novel_id in by_id]
+    queryset = Novel.objects.filter(like_filter(terms))
+    if year is not None:
+        queryset = queryset.filter(year=year)
+    return list(queryset.order_by('-year', 'rank', 'id').values_list(*columns)[:limit])
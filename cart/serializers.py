@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Novel, Cart, CartItem
+from .images import image_manifest
 from django.conf import settings
 from django.contrib.auth import get_user_model
 
@@ -7,9 +8,17 @@ User = get_user_model()
 
 class NovelSerializer(serializers.ModelSerializer):
     """小说序列化器"""
+    # 年在数据库中以整数存储，但API仍以字符串输出（前端按字符串比较）
+    year = serializers.CharField(read_only=True)
+    # build_images 命令生成的缩略图（WebP/AVIF）信息，没有图片时为 None
+    images = serializers.SerializerMethodField()
+    
     class Meta:
         model = Novel
-        fields = ['id', 'name', 'author', 'publisher', 'rank', 'price', 'year']
+        fields = ['id', 'name', 'author', 'publisher', 'rank', 'price', 'year', 'images']
+    
+    def get_images(self, obj):
+        return image_manifest.get(obj.year, obj.rank)
 
 class CartItemSerializer(serializers.ModelSerializer):
     """购物车项目序列化器"""
@@ -30,17 +39,121 @@ class CartSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total_items', 'total_amount', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'user', 'items', 'total_items', 'total_amount', 'created_at', 'updated_at']
+        fields = ['id', 'user', 'items', 'total_items', 'total_amount', 'created_at', 'updated_at', 'version']
+        read_only_fields = ['id', 'user', 'items', 'total_items', 'total_amount', 'created_at', 'updated_at', 'version']
     
     def to_representation(self, instance):
-        """自定义序列化输出，计算总数和总金额"""
+        """自定义序列化输出，总数和总金额直接读取购物车行上的列"""
         representation = super().to_representation(instance)
-        # 计算购物车中的商品总数
-        items = instance.items.all()
-        total_items = sum(item.quantity for item in items)
-        total_amount = sum(item.subtotal for item in items)
-        
-        representation['total_items'] = total_items
-        representation['total_amount'] = total_amount
-        return representation
\ No newline at end of file
+        # 合计列在购物车项目变更的同一事务中更新，无需遍历项目重新计算
+        representation['total_items'] = instance.total_items
+        representation['total_amount'] = instance.total_amount
+        return representation
+
+
+class NovelRowSerializer:
+    """小说只读快速序列化器
+
+    直接从 values_list() 的元组生成输出，跳过 ModelSerializer 的字段解析和逐字段处理。
+    只对需要转换的字段（价格、年）复用 NovelSerializer 的字段实例，输出与 NovelSerializer 完全一致。
+    """
+    fields = ('id', 'name', 'author', 'publisher', 'rank', 'price', 'year')
+    # 价格格式化结果的缓存上限（价格的种类很少，缓存后可省去每行的量化处理）
+    PRICE_CACHE_SIZE = 4096
+    
+    def __init__(self, prefix=''):
+        declared = NovelSerializer().fields
+        # 查询时使用的列名（通过关联查询时加上前缀，例如 'novel__'）
+        self.columns = tuple(prefix + name for name in self.fields)
+        self._price_to_representation = declared['price'].to_representation
+        self._year = declared['year'].to_representation
+        self._price_cache = {}
+    
+    def _price(self, value):
+        """与 DecimalField 相同的价格格式化（数值相等的 Decimal 输出相同，因此可以缓存）"""
+        try:
+            return self._price_cache[value]
+        except KeyError:
+            pass
+        if len(self._price_cache) >= self.PRICE_CACHE_SIZE:
+            self._price_cache.clear()
+        result = self._price_cache[value] = self._price_to_representation(value)
+        return result
+    
+    def to_representation(self, row):
+        """将 (id, name, author, publisher, rank, price, year) 元组转换为字典"""
+        return {
+            'id': row[0],
+            'name': row[1],
+            'author': row[2],
+            'publisher': row[3],
+            'rank': row[4],
+            'price': self._price(row[5]),
+            'year': self._year(row[6]),
+            'images': image_manifest.get(row[6], row[4]),
+        }
+    
+    def serialize(self, queryset):
+        """一次查询取出所有行并序列化"""
+        to_representation = self.to_representation
+        return [to_representation(row) for row in queryset.values_list(*self.columns)]
+
+
+class CartReadSerializer:
+    """购物车只读快速序列化器
+
+    用一次查询取出购物车项目及其小说的值，输出与 CartSerializer 完全一致。
+    """
+    
+    def __init__(self):
+        self.novel = NovelRowSerializer(prefix='novel__')
+        self.columns = ('id', 'quantity') + self.novel.columns
+        self._subtotal = CartItemSerializer().fields['subtotal'].to_representation
+        self._datetime = CartSerializer().fields['created_at'].to_representation
+    
+    def rows(self, queryset):
+        """购物车项目及其小说的值的查询"""
+        return queryset.order_by('id').values_list(*self.columns)
+    
+    def item_from_row(self, row):
+        """将一行查询结果转换为购物车项目的字典"""
+        quantity = row[1]
+        return {
+            'id': row[0],
+            'novel': self.novel.to_representation(row[2:]),
+            'quantity': quantity,
+            'subtotal': self._subtotal(row[7] * quantity),
+        }
+    
+    def items(self, queryset):
+        """购物车项目列表的序列化"""
+        return [self.item_from_row(row) for row in self.rows(queryset)]
+    
+    async def aitems(self, queryset):
+        """购物车项目列表的序列化（异步视图用，通过异步迭代执行查询）"""
+        return [self.item_from_row(row) async for row in self.rows(queryset)]
+    
+    def item(self, queryset):
+        """单个购物车项目的序列化（不存在时返回 None）"""
+        items = self.items(queryset)
+        return items[0] if items else None
+    
+    def to_representation(self, cart, items=None):
+        """购物车整体的序列化（项目只查询一次，合计直接读取购物车行上的列）"""
+        if items is None:
+            items = self.items(CartItem.objects.filter(cart=cart))
+        # 键的顺序与 CartSerializer 相同
+        return {
+            'id': cart.pk,
+            'user': cart.user_id,
+            'items': items,
+            'total_items': cart.total_items,
+            'total_amount': cart.total_amount,
+            'created_at': self._datetime(cart.created_at),
+            'updated_at': self._datetime(cart.updated_at),
+            'version': cart.version,
+        }
+    
+    async def ato_representation(self, cart):
+        """购物车整体的序列化（异步视图用）"""
+        return self.to_representation(cart, items=await self.aitems(CartItem.objects.filter(cart=cart)))
@@ -0,0 +1,67 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import snapshots
+from .cache import ranking_cache
+from .models import Cart, CartItem, Novel
+
+
+@receiver(post_save, sender=Novel)
+@receiver(post_delete, sender=Novel)
+def invalidate_ranking_cache(sender, **kwargs):
+    """小説が変更・削除されたらランキングキャッシュを無効化（管理画面のlist_editableによる保存も含む）
+
+    コミット前に無効化すると、同時に読み込んだリクエストが変更前の行を新しいバージョンで
+    キャッシュしてしまうため、コミット後に無効化する。
+    """
+    transaction.on_commit(ranking_cache.invalidate)
+
+
+@receiver(pre_save, sender=Novel)
+def remember_previous_values(sender, instance, raw=False, **kwargs):
+    """保存前の年と価格を記録
+
+    年が変更された場合は元の年のスナップショットも更新し、価格が変更された場合はカートの合計を再計算する。
+    """
+    previous = None
+    if not raw and instance.pk is not None:
+        previous = Novel.objects.filter(pk=instance.pk).values_list('year', 'price').first()
+    instance._snapshot_previous_year, instance._previous_price = previous or (None, None)
+
+
+@receiver(post_save, sender=Novel)
+def refresh_ranking_snapshots_on_save(sender, instance, raw=False, **kwargs):
+    """コミット後に変更された年（と変更前の年）のランキングスナップショットを更新"""
+    if raw:
+        return
+    snapshots.schedule_rebuild(instance.year, getattr(instance, '_snapshot_previous_year', None))
+
+
+@receiver(post_delete, sender=Novel)
+def refresh_ranking_snapshots_on_delete(sender, instance, **kwargs):
+    """コミット後に削除された小説の年のランキングスナップショットを更新"""
+    snapshots.schedule_rebuild(instance.year)
+
+
+@receiver(post_save, sender=Novel)
+def reconcile_cart_totals_on_price_change(sender, instance, raw=False, **kwargs):
+    """価格が変更された場合、その小説を含むカートの合計を同じトランザクションで再計算"""
+    previous_price = getattr(instance, '_previous_price', None)
+    if raw or previous_price is None or previous_price == instance.price:
+        return
+    Cart.objects.filter(items__novel=instance).recalculate_totals()
+
+
+@receiver(pre_delete, sender=Novel)
+def remember_carts_containing_novel(sender, instance, **kwargs):
+    """削除でカートアイテムも削除されるため、合計を再計算するカートを削除前に記録"""
+    instance._cart_ids = list(CartItem.objects.filter(novel=instance).values_list('cart_id', flat=True))
+
+
+@receiver(post_delete, sender=Novel)
+def reconcile_cart_totals_on_delete(sender, instance, **kwargs):
+    """削除された小説を含んでいたカートの合計を再計算"""
+    cart_ids = getattr(instance, '_cart_ids', None)
+    if cart_ids:
+        Cart.objects.filter(id__in=cart_ids).recalculate_totals()
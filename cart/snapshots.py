@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+from contextlib import suppress
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .conditional import make_etag
+from .models import Novel
+from .serializers import NovelRowSerializer
+
+try:
+    import brotli
+except ImportError:  # brotliは任意の依存パッケージ
+    brotli = None
+
+# 事前圧縮するエンコーディングと拡張子（優先順）。brotliが無い環境ではgzipのみ
+ENCODINGS = [('br', '.json.br'), ('gzip', '.json.gz')] if brotli is not None else [('gzip', '.json.gz')]
+
+MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_FILE_RE = re.compile(r'^(\d+)\.json(\.gz|\.br)?$')
+
+# 読み込み中にスナップショットが差し替えられた場合の再試行回数
+OPEN_RETRIES = 3
+
+novel_row_serializer = NovelRowSerializer()
+renderer = JSONRenderer()
+
+
+def snapshot_root():
+    return str(settings.RANKING_SNAPSHOT_DIR)
+
+
+def year_dir(year):
+    return os.path.join(snapshot_root(), str(int(year)))
+
+
+def snapshot_path(year, generation, suffix='.json'):
+    return os.path.join(year_dir(year), f'{generation}{suffix}')
+
+
+def write_atomic(path, data):
+    """一時ファイルに書き込んでからos.replaceで置き換える（読み手が書きかけのファイルを見ることはない）"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstempは所有者のみ読み取り可能なファイルを作成するため、Webサーバーから読めるようにする
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+
+def load_manifest(year):
+    """年のマニフェスト（世代番号・フィンガープリントなど）を読み込み、存在しない場合はNoneを返す"""
+    try:
+        with open(os.path.join(year_dir(year), MANIFEST_NAME), 'rb') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def fingerprint(year):
+    """年のランキングの件数と最終更新日時からフィンガープリントを計算"""
+    stats = Novel.objects.filter(year=year).aggregate(count=Count('id'), last_modified=Max('updated_at'))
+    return make_etag('ranking-snapshot', year, stats['count'], stats['last_modified'])
+
+
+def render(year):
+    """年のランキング全体をコンパクトなJSONに変換"""
+    results = novel_row_serializer.serialize(Novel.objects.filter(year=year).order_by('rank', 'id'))
+    return renderer.render({'year': str(year), 'count': len(results), 'results': results})
+
+
+def build(year):
+    """年のスナップショットを新しい世代として書き出し、マニフェストを差し替える
+
+    JSON本体と事前圧縮版をすべて書き終えてからマニフェストを置き換えるため、
+    読み手は常にいずれかの世代の完全なファイル一式を参照する。
+    """
+    year = int(year)
+    os.makedirs(year_dir(year), exist_ok=True)
+    current = load_manifest(year)
+    generation = (current['generation'] if current else 0) + 1
+    fp = fingerprint(year)
+    data = render(year)
+
+    write_atomic(snapshot_path(year, generation), data)
+    write_atomic(snapshot_path(year, generation, '.json.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(snapshot_path(year, generation, '.json.br'), brotli.compress(data))
+
+    manifest = {
+        'year': year,
+        'generation': generation,
+        'fingerprint': fp,
+        'size': len(data),
+        'built_at': timezone.now().isoformat(),
+    }
+    write_atomic(os.path.join(year_dir(year), MANIFEST_NAME), json.dumps(manifest).encode('utf-8'))
+    prune(year, generation)
+    return manifest
+
+
+def prune(year, generation):
+    """直前の世代を残して古いスナップショットを削除（読み込み中のリクエストを考慮）"""
+    for name in os.listdir(year_dir(year)):
+        match = SNAPSHOT_FILE_RE.match(name)
+        if match and int(match.group(1)) < generation - 1:
+            with suppress(FileNotFoundError):
+                os.unlink(os.path.join(year_dir(year), name))
+
+
+def rebuild_if_stale(year):
+    """既に作成済みのスナップショットが古くなっていれば再作成する
+
+    未作成の年は最初のリクエストかbuild_ranking_snapshotsコマンドで作成されるため、ここでは作成しない。
+    同じトランザクション内で何件変更されても、フィンガープリントが一致すれば再作成は1回で済む。
+    """
+    manifest = load_manifest(year)
+    if manifest is None or manifest['fingerprint'] == fingerprint(year):
+        return None
+    return build(year)
+
+
+def schedule_rebuild(*years):
+    """トランザクションのコミット後に対象年のスナップショットを更新"""
+    for year in {int(year) for year in years if year is not None}:
+        transaction.on_commit(lambda year=year: rebuild_if_stale(year))
+
+
+def snapshot_years():
+    """スナップショットが作成済みの年の一覧"""
+    try:
+        names = os.listdir(snapshot_root())
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def choose_encoding(accept_encoding):
+    """Accept-Encodingから使用する事前圧縮ファイルを選ぶ（該当なしは非圧縮）"""
+    accepted = set()
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted or '*' in accepted:
+            return encoding, suffix
+    return None, '.json'
+
+
+def open_snapshot(year, accept_encoding=''):
+    """年のスナップショットを開き (ファイル, エンコーディング, マニフェスト) を返す
+
+    スナップショットが未作成の場合はその場で作成する。
+    """
+    encoding, suffix = choose_encoding(accept_encoding)
+    for _ in range(OPEN_RETRIES):
+        manifest = load_manifest(year) or build(year)
+        try:
+            return open(snapshot_path(year, manifest['generation'], suffix), 'rb'), encoding, manifest
+        except FileNotFoundError:
+            # マニフェストを読んだ後に世代が2つ以上進んだ場合は、最新のマニフェストで再試行
+            continue
+    manifest = build(year)
+    return open(snapshot_path(year, manifest['generation'], suffix), 'rb'), encoding, manifest
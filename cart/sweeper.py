@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+# 1回のトランザクションで削除する最大件数の既定値
+DEFAULT_BATCH_SIZE = 500
+
+# DBに行を持つセッションエンジン（これ以外のエンジンではdjango_sessionを掃除しない）
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+def sweep_expired_carts(timeout=None, batch_size=DEFAULT_BATCH_SIZE, max_batches=None, dry_run=False):
+    """非アクティブな匿名カートとそのアイテムを一定件数ずつ削除する
+
+    updated_atが timeout 秒より古い匿名カート（ユーザーに紐づかないカート）が対象。
+    削除したカート数とアイテム数を返す。
+    """
+    if timeout is None:
+        timeout = settings.CART_INACTIVITY_TIMEOUT
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    expired = Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff).order_by('updated_at')
+
+    result = {'carts': 0, 'items': 0}
+    if dry_run:
+        result['carts'] = expired.count()
+        result['items'] = CartItem.objects.filter(cart__in=expired).count()
+        return result
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            # updated_atのインデックスを使って古い順に一定件数だけ取得し、削除まで行をロックする
+            cart_ids = list(expired.select_for_update().values_list('id', flat=True)[:batch_size])
+            if not cart_ids:
+                break
+            # 取得後にアイテムが追加された・ユーザーに紐づけられたカートは削除しない
+            still_expired = expired.filter(id__in=cart_ids)
+            result['items'] += CartItem.objects.filter(cart__in=still_expired).delete()[0]
+            result['carts'] += still_expired.order_by().delete()[1].get(Cart._meta.label, 0)
+        batches += 1
+    return result
+
+
+def sweep_expired_sessions(batch_size=DEFAULT_BATCH_SIZE, max_batches=None, dry_run=False):
+    """期限切れのdjango_session行を一定件数ずつ削除し、削除件数を返す
+
+    DBに保存しないセッションエンジンを使用している場合は何もしない。
+    """
+    if settings.SESSION_ENGINE not in DB_SESSION_ENGINES:
+        return 0
+    from django.contrib.sessions.models import Session
+
+    expired = Session.objects.filter(expire_date__lt=timezone.now())
+    if dry_run:
+        return expired.count()
+
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        session_keys = list(expired.values_list('session_key', flat=True)[:batch_size])
+        if not session_keys:
+            break
+        deleted += Session.objects.filter(session_key__in=session_keys).delete()[0]
+        batches += 1
+    return deleted
+
+
+def sweep(batch_size=DEFAULT_BATCH_SIZE, max_batches=None, dry_run=False):
+    """期限切れの匿名カートとセッションをまとめて掃除し、削除件数を返す"""
+    result = {'carts': 0, 'items': 0}
+    if not settings.CART_PERSIST_AFTER_SESSION:
+        result = sweep_expired_carts(batch_size=batch_size, max_batches=max_batches, dry_run=dry_run)
+    result['sessions'] = sweep_expired_sessions(batch_size=batch_size, max_batches=max_batches, dry_run=dry_run)
+    return result
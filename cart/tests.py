@@ -1,3 +1,1391 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import images, snapshots
+from .cache import ranking_cache
+from .models import Novel, Cart, CartItem
+from .serializers import CartReadSerializer, CartSerializer, NovelRowSerializer, NovelSerializer
+
+
+def create_novels(count, year='2025'):
+    """テスト用の小説をまとめて作成"""
+    return Novel.objects.bulk_create([
+        Novel(
+            name=f'小説{i}',
+            author=f'作者{i}',
+            publisher='出版社',
+            rank=i,
+            price=Decimal('10.50'),
+            year=year,
+        )
+        for i in range(1, count + 1)
+    ])
+
+
+class CartQueryCountTests(TestCase):
+    """カートの読み込みクエリ数がアイテム数に依存しないことを確認"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.novels = create_novels(20)
+
+    def fill_cart(self, count):
+        """現在のセッションのカートにアイテムを追加"""
+        self.client.delete('/api/cart/clear/')
+        cart = Cart.objects.get()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, novel=novel, quantity=2)
+            for novel in self.novels[:count]
+        ])
+        Cart.objects.filter(pk=cart.pk).recalculate_totals()
+        cart.refresh_from_db()
+        return cart
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_list_reads_items_in_single_query(self):
+        self.fill_cart(20)
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/cart/').json()
+        self.assertEqual(len(data['items']), 20)
+        self.assertEqual(data['total_items'], 40)
+        self.assertEqual(Decimal(str(data['total_amount'])), Decimal('420.00'))
+        # アイテムのクエリはETag用の集計と、小説をJOINした読み込みの2回のみ
+        self.assertEqual(len([q for q in ctx.captured_queries if 'cart_cartitem' in q['sql']]), 2)
+
+    def test_list_query_budget_is_constant(self):
+        self.fill_cart(1)
+        small_count, small = self.count_list_queries()
+        CartItem.objects.all().delete()
+        self.fill_cart(20)
+        large_count, large = self.count_list_queries()
+        self.assertEqual(len(small['items']), 1)
+        self.assertEqual(len(large['items']), 20)
+        self.assertEqual(small_count, large_count)
+        self.assertLessEqual(large_count, 4)
+
+
+class RankingCacheTests(TestCase):
+    """年別ランキングキャッシュの動作を確認"""
+
+    def setUp(self):
+        ranking_cache.clear()
+        create_novels(15)
+
+    def test_repeated_year_page_is_served_from_cache(self):
+        first = self.client.get('/api/novels/', {'year': '2025'})
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/novels/', {'year': '2025'})
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(ranking_cache.stats()['hits'], 1)
+
+    def test_novel_save_invalidates_cached_pages(self):
+        self.client.get('/api/novels/', {'year': '2025'})
+        novel = Novel.objects.get(rank=1)
+        novel.price = Decimal('99.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            novel.save()
+        response = self.client.get('/api/novels/', {'year': '2025'})
+        self.assertEqual(response.json()['results'][0]['price'], '99.00')
+
+    def test_invalidation_waits_for_commit(self):
+        self.client.get('/api/novels/', {'year': '2025'})
+        version = ranking_cache.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                novel = Novel.objects.get(rank=1)
+                novel.price = Decimal('99.00')
+                novel.save()
+                # コミット前はバージョンを進めない（同時に読み込んだ変更前のページを新しいバージョンで保存しない）
+                self.client.get('/api/novels/', {'year': '2025'})
+                self.assertEqual(ranking_cache.get_version(), version)
+        self.assertNotEqual(ranking_cache.get_version(), version)
+        response = self.client.get('/api/novels/', {'year': '2025'})
+        self.assertEqual(response.json()['results'][0]['price'], '99.00')
+
+    @override_settings(NOVEL_RANKING_CACHE={'MAX_ENTRIES': 1})
+    def test_lru_evicts_oldest_page(self):
+        self.client.get('/api/novels/', {'year': '2025', 'page': '1'})
+        self.client.get('/api/novels/', {'year': '2025', 'page': '2'})
+        stats = ranking_cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+
+class ConditionalRequestTests(TestCase):
+    """ETag / Last-Modified による条件付きリクエストを確認"""
+
+    def setUp(self):
+        ranking_cache.clear()
+        self.novels = create_novels(3)
+
+    def test_novel_list_returns_304_when_unchanged(self):
+        response = self.client.get('/api/novels/', {'year': '2025'})
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        ranking_cache.clear()
+        with self.assertNumQueries(1):
+            cached = self.client.get('/api/novels/', {'year': '2025'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_novel_list_etag_changes_after_edit(self):
+        etag = self.client.get('/api/novels/', {'year': '2025'})['ETag']
+        novel = self.novels[0]
+        novel.price = Decimal('1.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            novel.save()
+        response = self.client.get('/api/novels/', {'year': '2025'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_novel_detail_returns_304_when_unchanged(self):
+        url = f'/api/novels/{self.novels[0].pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/novels/999/').status_code, 404)
+
+    def test_cart_reads_do_not_write(self):
+        client = APIClient()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(client.get('/api/cart/').json()['items'], [])
+        client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk}, format='json')
+        with CaptureQueriesContext(connection) as read_ctx:
+            client.get('/api/cart/')
+            client.get('/api/cart/')
+        writes = [
+            query['sql'] for query in ctx.captured_queries + read_ctx.captured_queries
+            if query['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+        self.assertEqual(writes, [])
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_cart_etag_tracks_item_changes(self):
+        client = APIClient()
+        etag = client.get('/api/cart/')['ETag']
+        self.assertEqual(client.get('/api/cart/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk}, format='json')
+        response = client.get('/api/cart/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_items'], 1)
+
+
+class NovelYearFilterTests(TestCase):
+    """整数型の年フィールドによるフィルタリングを確認"""
+
+    def setUp(self):
+        ranking_cache.clear()
+        create_novels(2, year=2024)
+        create_novels(3, year=2025)
+
+    def test_year_is_filtered_and_rendered_as_string(self):
+        results = self.client.get('/api/novels/', {'year': '2024'}).json()['results']
+        self.assertEqual(len(results), 2)
+        self.assertEqual({novel['year'] for novel in results}, {'2024'})
+
+    def test_non_numeric_year_returns_empty_page(self):
+        response = self.client.get('/api/novels/', {'year': 'abcd'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_unparseable_or_out_of_range_year_is_rejected(self):
+        # '²'.isdigit() はTrueだがint()では変換できない、桁数の多い値はSQLiteの整数の範囲を超える
+        for year in ('²', '9' * 30, '32768'):
+            with self.subTest(year=year):
+                for path in ('/api/novels/', '/api/async/novels/'):
+                    response = self.client.get(path, {'year': year})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.json()['count'], 0)
+                for path, params in (
+                    ('/api/novels/ranking/', {}),
+                    ('/api/novels/search/', {'q': '小説'}),
+                    ('/api/novels/export/', {}),
+                ):
+                    self.assertEqual(self.client.get(path, {'year': year, **params}).status_code, 400)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """同じカートへの同時更新で数量が失われないことを確認"""
+
+    THREADS = 8
+    ROUNDS = 25
+
+    def setUp(self):
+        self.novels = create_novels(2)
+        self.cart = Cart.objects.create(session_key='stress')
+
+    def hammer(self, work):
+        """複数スレッドから同時にworkを実行"""
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def run():
+            try:
+                barrier.wait()
+                for _ in range(self.ROUNDS):
+                    work()
+            except Exception as e:  # pragma: no cover - 失敗時の診断用
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_adds_are_not_lost(self):
+        first, second = self.novels
+        cart = Cart.objects.get(pk=self.cart.pk)
+
+        def work():
+            cart.add_novel(first, 1)
+            cart.add_novel(second, 2)
+
+        self.hammer(work)
+        quantities = dict(CartItem.objects.values_list('novel_id', 'quantity'))
+        total = self.THREADS * self.ROUNDS
+        self.assertEqual(quantities, {first.pk: total, second.pk: total * 2})
+
+    def test_concurrent_updates_are_not_lost(self):
+        novel = self.novels[0]
+        item = CartItem.objects.create(cart=self.cart, novel=novel, quantity=1)
+        cart = Cart.objects.get(pk=self.cart.pk)
+
+        def work():
+            cart.change_item_quantity(item.pk, 3)
+            cart.change_item_quantity(item.pk, -1)
+
+        self.hammer(work)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 1 + self.THREADS * self.ROUNDS * 2)
+
+
+class CartBatchTests(TestCase):
+    """カートの一括操作エンドポイントを確認"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.novels = create_novels(3)
+
+    def batch(self, operations):
+        return self.client.post('/api/cart/batch/', {'operations': operations}, format='json')
+
+    def test_operations_are_applied_in_one_request(self):
+        first, second, third = self.novels
+        self.client.post('/api/cart/add_item/', {'novel_id': first.pk, 'quantity': 2}, format='json')
+        self.client.post('/api/cart/add_item/', {'novel_id': second.pk}, format='json')
+        items = {item.novel_id: item.pk for item in CartItem.objects.all()}
+        response = self.batch([
+            {'op': 'update', 'item_id': items[first.pk], 'quantity': 3},
+            {'op': 'update', 'item_id': items[first.pk], 'quantity': -1},
+            {'op': 'remove', 'item_id': items[second.pk]},
+            {'op': 'add', 'novel_id': third.pk, 'quantity': 2},
+            {'op': 'add', 'novel_id': third.pk},
+        ])
+        self.assertEqual(response.status_code, 200)
+        quantities = dict(CartItem.objects.values_list('novel_id', 'quantity'))
+        self.assertEqual(quantities, {first.pk: 4, third.pk: 3})
+        self.assertEqual(response.json()['total_items'], 7)
+
+    def test_invalid_batch_changes_nothing(self):
+        first = self.novels[0]
+        self.client.post('/api/cart/add_item/', {'novel_id': first.pk}, format='json')
+        response = self.batch([
+            {'op': 'add', 'novel_id': first.pk},
+            {'op': 'remove', 'item_id': 9999},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+        self.assertEqual(self.batch([{'op': 'explode'}]).status_code, 400)
+        self.assertEqual(self.batch([]).status_code, 400)
+
+    def test_non_object_body_is_rejected(self):
+        for body in ([{'op': 'add', 'novel_id': self.novels[0].pk}], 'operations', 3):
+            with self.subTest(body=body):
+                response = self.client.post('/api/cart/batch/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'operationsは空でないリストでなければなりません'})
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CartSweeperTests(TestCase):
+    """期限切れ匿名カートの掃除コマンドを確認"""
+
+    def setUp(self):
+        novel = create_novels(1)[0]
+        old = timezone.now() - timedelta(hours=2)
+        self.expired = [Cart.objects.create(session_key=f'old{i}') for i in range(3)]
+        self.active = Cart.objects.create(session_key='active')
+        self.user_cart = Cart.objects.create(user=User.objects.create_user('reader', password='secret123'))
+        for cart in self.expired + [self.active, self.user_cart]:
+            CartItem.objects.create(cart=cart, novel=novel, quantity=1)
+        Cart.objects.filter(id__in=[c.id for c in self.expired] + [self.user_cart.id]).update(updated_at=old)
+
+    def test_sweep_removes_only_expired_anonymous_carts_in_batches(self):
+        out = StringIO()
+        call_command('sweep_carts', '--batch-size', '2', stdout=out)
+        self.assertIn('カート 3 件, アイテム 3 件', out.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {self.active.id, self.user_cart.id})
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_cart_used_after_selection_is_kept(self):
+        revived = self.expired[0]
+        touched = []
+
+        def touch_after_select(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not touched and sql.startswith('SELECT') and 'LIMIT' in sql:
+                # 削除対象の取得と削除の間に、他のリクエストがカートを使用した場合
+                touched.append(True)
+                Cart.objects.filter(pk=revived.pk).update(updated_at=timezone.now())
+            return result
+
+        with connection.execute_wrapper(touch_after_select):
+            call_command('sweep_carts', stdout=StringIO())
+        self.assertTrue(touched)
+        self.assertEqual(
+            set(Cart.objects.values_list('id', flat=True)), {revived.id, self.active.id, self.user_cart.id}
+        )
+        self.assertTrue(revived.items.exists())
+
+    def test_dry_run_deletes_nothing(self):
+        out = StringIO()
+        call_command('sweep_carts', '--dry-run', stdout=out)
+        self.assertIn('削除対象: カート 3 件', out.getvalue())
+        self.assertEqual(Cart.objects.count(), 5)
+
+
+class CartSessionEngineTests(TestCase):
+    """セッションエンジンを切り替えても匿名カートが維持されることを確認"""
+
+    ENGINES = [
+        'django.contrib.sessions.backends.db',
+        'django.contrib.sessions.backends.cached_db',
+        'django.contrib.sessions.backends.cache',
+        'django.contrib.sessions.backends.signed_cookies',
+    ]
+
+    def setUp(self):
+        self.novels = create_novels(2)
+
+    def test_cart_survives_across_requests_for_each_engine(self):
+        for engine in self.ENGINES:
+            with self.subTest(engine=engine), override_settings(SESSION_ENGINE=engine):
+                client = APIClient()
+                client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk}, format='json')
+                client.post('/api/cart/add_item/', {'novel_id': self.novels[1].pk, 'quantity': 2}, format='json')
+                data = client.get('/api/cart/').json()
+                self.assertEqual(data['total_items'], 3)
+
+    def test_legacy_cart_keyed_by_session_key_is_migrated(self):
+        client = APIClient()
+        session = client.session
+        session.save()
+        legacy = Cart.objects.create(session_key=session.session_key)
+        CartItem.objects.create(cart=legacy, novel=self.novels[0], quantity=4)
+        Cart.objects.recalculate_totals()
+        self.assertEqual(client.get('/api/cart/').json()['total_items'], 4)
+        client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk}, format='json')
+        self.assertEqual(client.session['cart_key'], legacy.session_key)
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+
+class CartSummaryTests(TestCase):
+    """ヘッダー用のカート集計エンドポイントを確認"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.novels = create_novels(5)
+
+    def test_summary_reads_cart_row(self):
+        for novel in self.novels:
+            self.client.post('/api/cart/add_item/', {'novel_id': novel.pk, 'quantity': 2}, format='json')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/cart/summary/')
+        self.assertEqual(response.json(), {'total_items': 10, 'total_amount': 105.0, 'version': 5})
+        # 合計は取得したカート行の列を使い、アイテムの集計もカート行の再読み込みもしない
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'cart_cartitem' in q['sql']])
+        self.assertEqual(len([q for q in ctx.captured_queries if '"cart_cart"' in q['sql']]), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/async/cart/summary/').json(), response.json())
+        self.assertEqual(len([q for q in ctx.captured_queries if '"cart_cart"' in q['sql']]), 1)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/cart/summary/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_summary_without_cart(self):
+        self.assertEqual(
+            self.client.get('/api/cart/summary/').json(),
+            {'total_items': 0, 'total_amount': 0, 'version': 0},
+        )
+        self.assertEqual(Cart.objects.count(), 0)
+
+
+class CartDeltaResponseTests(TestCase):
+    """変更系APIの差分レスポンス（?response=delta）を確認"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.novels = create_novels(10)
+        for novel in self.novels:
+            self.client.post('/api/cart/add_item/', {'novel_id': novel.pk}, format='json')
+
+    def test_mutations_return_only_the_changed_item(self):
+        novel = self.novels[0]
+        added = self.client.post(
+            '/api/cart/add_item/?response=delta', {'novel_id': novel.pk, 'quantity': 2}, format='json'
+        ).json()
+        self.assertNotIn('items', added)
+        self.assertEqual(added['item']['novel']['id'], novel.pk)
+        self.assertEqual(added['item']['quantity'], 3)
+        self.assertEqual(added['item']['subtotal'], '31.50')
+        self.assertEqual(added['total_items'], 12)
+        self.assertEqual(added['version'], 11)
+
+        item_id = added['item']['id']
+        updated = self.client.put(
+            '/api/cart/update_item/?response=delta', {'item_id': item_id, 'quantity': -3}, format='json'
+        ).json()
+        self.assertIsNone(updated['item'])
+        self.assertEqual(updated['removed_item_id'], item_id)
+        self.assertEqual(updated['total_items'], 9)
+
+        other_id = CartItem.objects.first().pk
+        removed = self.client.delete(f'/api/cart/remove_item/?item_id={other_id}&response=delta').json()
+        self.assertEqual(removed['removed_item_id'], other_id)
+        self.assertEqual(removed['version'], 13)
+
+        cleared = self.client.delete('/api/cart/clear/?response=delta').json()
+        self.assertTrue(cleared['cleared'])
+        self.assertEqual(cleared['total_items'], 0)
+
+    def test_full_response_is_default_and_carries_version(self):
+        data = self.client.delete('/api/cart/clear/').json()
+        self.assertEqual(data['items'], [])
+        self.assertEqual(data['version'], 11)
+
+
+class FastSerializerTests(TestCase):
+    """読み取り専用の高速シリアライザが既存のシリアライザと同じJSONを出力することを確認"""
+
+    def setUp(self):
+        self.novels = create_novels(12)
+        Novel.objects.filter(pk=self.novels[0].pk).update(price=Decimal('1234.5'))
+        self.cart = Cart.objects.create(session_key='fast')
+        for i, novel in enumerate(self.novels[:6], start=1):
+            CartItem.objects.create(cart=self.cart, novel=novel, quantity=i)
+        Cart.objects.recalculate_totals()
+        self.renderer = JSONRenderer()
+
+    def test_novel_rows_match_novel_serializer(self):
+        queryset = Novel.objects.order_by('rank')
+        expected = self.renderer.render(NovelSerializer(queryset, many=True).data)
+        self.assertEqual(self.renderer.render(NovelRowSerializer().serialize(queryset)), expected)
+
+    def test_cart_matches_cart_serializer(self):
+        cart = Cart.objects.prefetch_related(
+            Prefetch('items', queryset=CartItem.objects.select_related('novel').order_by('id'))
+        ).get(pk=self.cart.pk)
+        expected = self.renderer.render(CartSerializer(cart).data)
+        with self.assertNumQueries(1):
+            actual = self.renderer.render(CartReadSerializer().to_representation(cart))
+        self.assertEqual(actual, expected)
+
+
+class RankingSnapshotTests(TestCase):
+    """年別ランキングのスナップショットの作成・配信・更新を確認"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(RANKING_SNAPSHOT_DIR=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.novels = create_novels(3, year=2025)
+
+    def get_ranking(self, **extra):
+        response = self.client.get('/api/novels/ranking/', {'year': '2025'}, **extra)
+        body = b''.join(response.streaming_content) if response.status_code == 200 else b''
+        return response, body
+
+    def test_snapshot_is_built_on_first_request_and_served(self):
+        response, body = self.get_ranking()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        expected = JSONRenderer().render(NovelSerializer(Novel.objects.order_by('rank'), many=True).data)
+        self.assertEqual(body, b'{"year":"2025","count":3,"results":' + expected + b'}')
+
+        response, _ = self.get_ranking(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_gzip_snapshot_is_served_when_accepted(self):
+        _, plain = self.get_ranking()
+        response, body = self.get_ranking(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(body), plain)
+
+    def test_novel_change_swaps_generation_after_commit(self):
+        first, _ = self.get_ranking()
+        novel = self.novels[0]
+        novel.name = '改題'
+        with self.captureOnCommitCallbacks(execute=True):
+            novel.save()
+        response, body = self.get_ranking()
+        self.assertEqual(int(response['X-Snapshot-Generation']), int(first['X-Snapshot-Generation']) + 1)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertIn('改題'.encode('utf-8'), body)
+
+    def test_year_change_refreshes_previous_year(self):
+        self.get_ranking()
+        novel = self.novels[0]
+        novel.year = 2024
+        with self.captureOnCommitCallbacks(execute=True):
+            novel.save()
+        _, body = self.get_ranking()
+        self.assertIn(b'"count":2', body)
+
+    def test_invalid_or_unknown_year(self):
+        self.assertEqual(self.client.get('/api/novels/ranking/', {'year': 'abcd'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/novels/ranking/', {'year': '1999'}).status_code, 404)
+
+    def test_command_builds_all_years(self):
+        create_novels(1, year=2024)
+        out = StringIO()
+        call_command('build_ranking_snapshots', stdout=out)
+        self.assertEqual(snapshots.snapshot_years(), [2024, 2025])
+        call_command('build_ranking_snapshots', '--stale-only', stdout=out)
+        self.assertIn('2025: 変更なし', out.getvalue())
+
+
+class NovelPaginationTests(TestCase):
+    """小説一覧のページサイズ指定・件数省略・カーソルページネーションを確認"""
+
+    def setUp(self):
+        ranking_cache.clear()
+        create_novels(5, year=2024)
+        create_novels(5, year=2025)
+
+    def test_page_size_is_bounded(self):
+        self.assertEqual(len(self.client.get('/api/novels/', {'page_size': '3'}).json()['results']), 3)
+        create_novels(100, year=2026)
+        self.assertEqual(len(self.client.get('/api/novels/', {'page_size': '1000'}).json()['results']), 100)
+
+    def test_count_can_be_skipped(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/novels/', {'page_size': '4', 'count': 'false'})
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 4)
+        self.assertIn('page=2', data['next'])
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('COUNT(', ctx.captured_queries[0]['sql'].upper())
+
+        cached = self.client.get('/api/novels/', {'page_size': '4', 'count': 'false'},
+                                 HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        last = self.client.get('/api/novels/', {'page_size': '4', 'count': 'false', 'page': '3'}).json()
+        self.assertEqual(len(last['results']), 2)
+        self.assertIsNone(last['next'])
+
+    def test_cursor_walks_catalog_in_year_rank_order(self):
+        ranking_cache.clear()
+        seen = []
+        url, params = '/api/novels/', {'pagination': 'cursor', 'page_size': '3'}
+        while url:
+            data = self.client.get(url, params).json()
+            self.assertNotIn('count', data)
+            seen.extend((novel['year'], novel['rank']) for novel in data['results'])
+            url, params = data['next'], None
+        expected = [(year, rank) for year in ('2024', '2025') for rank in range(1, 6)]
+        self.assertEqual(seen, expected)
+        # カーソル方式のページはランキングキャッシュに保存しない
+        self.assertEqual(ranking_cache.stats()['entries'], 0)
+
+    def test_cursor_page_uses_single_keyset_query(self):
+        first = self.client.get('/api/novels/', {'pagination': 'cursor', 'page_size': '4', 'year': '2025'}).json()
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(first['next']).json()
+        self.assertEqual([novel['rank'] for novel in second['results']], [5])
+        self.assertIsNone(second['next'])
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('OFFSET', ctx.captured_queries[0]['sql'])
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get('/api/novels/', {'pagination': 'cursor', 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogExportTests(TestCase):
+    """カタログのストリーミング出力とエクスポートコマンドを確認"""
+
+    def setUp(self):
+        create_novels(3, year=2024)
+        self.novels = create_novels(2, year=2025)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_matches_api_representation(self):
+        response = self.client.get('/api/novels/export/', {'year': '2025'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        records = [json.loads(line) for line in self.read(response).splitlines()]
+        expected = NovelSerializer(Novel.objects.filter(year=2025).order_by('rank'), many=True).data
+        self.assertEqual(records, [dict(novel) for novel in expected])
+
+    def test_csv_export_walks_catalog_in_order(self):
+        response = self.client.get('/api/novels/export/', {'type': 'csv'})
+        self.assertIn('novels.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(self.read(response).splitlines()))
+        self.assertEqual([(row['year'], row['rank']) for row in rows],
+                         [('2024', '1'), ('2024', '2'), ('2024', '3'), ('2025', '1'), ('2025', '2')])
+        self.assertEqual(rows[0]['price'], '10.50')
+
+    def test_invalid_parameters_and_cart_items_require_admin(self):
+        self.assertEqual(self.client.get('/api/novels/export/', {'type': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/novels/export/', {'year': 'abcd'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/novels/export/', {'dataset': 'cart_items'}).status_code, 403)
+
+        cart = Cart.objects.create(session_key='export')
+        CartItem.objects.create(cart=cart, novel=self.novels[0], quantity=2)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get('/api/novels/export/', {'dataset': 'cart_items'})
+        record = json.loads(self.read(response))
+        self.assertEqual((record['cart_id'], record['novel_id'], record['quantity']), (cart.pk, self.novels[0].pk, 2))
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'novels.csv')
+            out = StringIO()
+            call_command('export_novels', '--type', 'csv', '--chunk-size', '2', '-o', path, stdout=out)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(len(list(csv.DictReader(f))), 5)
+        self.assertIn('5 件を出力しました', out.getvalue())
+
+
+class NovelImportTests(TestCase):
+    """import_novelsコマンドによる一括upsertを確認"""
+
+    def setUp(self):
+        ranking_cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_novels', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_upserts_by_year_and_name(self):
+        Novel.objects.create(name='既存', author='旧作者', publisher='出版社', rank=9, price=Decimal('1.00'), year=2025)
+        path = self.write('novels.csv', (
+            'name,author,publisher,rank,price,year\n'
+            '既存,新作者,出版社,1,680,2025\n'
+            '新作,作者,出版社,2,700.5,2025\n'
+            '新作,作者,出版社,3,700.5,2024\n'
+        ))
+        with self.assertNumQueries(4):  # SAVEPOINT + INSERT ... ON CONFLICT + カート合計の再計算 + RELEASE
+            out, _ = self.run_import(path, '--batch-size', '10')
+        self.assertIn('書き込み 3 件', out)
+        self.assertIn('行/秒', out)
+        existing = Novel.objects.get(name='既存')
+        self.assertEqual((existing.author, existing.rank, existing.price), ('新作者', 1, Decimal('680.00')))
+        self.assertEqual(Novel.objects.filter(name='新作').count(), 2)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        path = self.write('novels.ndjson', '\n'.join([
+            json.dumps({'name': '正常', 'author': 'a', 'publisher': 'p', 'rank': 1, 'price': '1.00', 'year': 2025}),
+            json.dumps({'name': '', 'author': 'a', 'publisher': 'p', 'rank': 'x', 'price': '1.00'}),
+            '{not json',
+        ]))
+        out, err = self.run_import(path)
+        self.assertIn('不正 2 件', out)
+        self.assertIn('2 行目: name:', err)
+        self.assertIn('rank:', err)
+        self.assertIn('3 行目: JSONとして解析できません', err)
+        self.assertEqual(list(Novel.objects.values_list('name', flat=True)), ['正常'])
+
+    def test_json_fixture_is_streamed_with_default_year(self):
+        out, _ = self.run_import('cart/fixtures/novels.json', '--year', '2023')
+        self.assertIn('書き込み 5 件', out)
+        self.assertEqual(set(Novel.objects.values_list('year', flat=True)), {2023})
+        # 再実行しても重複しない
+        self.run_import('cart/fixtures/novels.json', '--year', '2023')
+        self.assertEqual(Novel.objects.count(), 5)
+
+    def test_json_reader_handles_elements_across_read_boundaries(self):
+        from . import importer
+        records = [{'name': f'小説{i}', 'rank': i} for i in range(50)]
+        path = self.write('small.json', json.dumps(records, ensure_ascii=False, indent=1))
+        with mock.patch.object(importer, 'JSON_READ_SIZE', 7), open(path, encoding='utf-8') as f:
+            self.assertEqual(list(importer.read_json(f)), records)
+
+    def test_prune_removes_titles_missing_from_import_and_invalidates_cache(self):
+        create_novels(3, year=2025)
+        create_novels(1, year=2024)
+        self.client.get('/api/novels/', {'year': '2025'})
+        path = self.write('novels.csv', 'name,author,publisher,rank,price,year\n小説2,作者,出版社,1,10.50,2025\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            out, _ = self.run_import(path, '--prune')
+        self.assertIn('削除 2 件', out)
+        self.assertEqual(list(Novel.objects.filter(year=2025).values_list('name', flat=True)), ['小説2'])
+        self.assertEqual(Novel.objects.filter(year=2024).count(), 1)
+        self.assertEqual(self.client.get('/api/novels/', {'year': '2025'}).json()['count'], 1)
+
+    def test_prune_uses_constant_queries(self):
+        novels = create_novels(60, year=2025)
+        carts = [Cart.objects.create(session_key=f'prune{i}') for i in range(3)]
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, novel=novel, quantity=1) for cart in carts for novel in novels[:20]
+        ])
+        Cart.objects.recalculate_totals()
+        path = self.write('novels.csv', 'name,author,publisher,rank,price,year\n小説1,作者,出版社,1,10.50,2025\n')
+        # SAVEPOINT + INSERT ... ON CONFLICT + カートIDの取得 + アイテムの削除 + 小説の削除 + 合計の再計算 + RELEASE
+        with self.assertNumQueries(7), self.captureOnCommitCallbacks() as callbacks:
+            out, _ = self.run_import(path, '--prune')
+        self.assertIn('削除 59 件', out)
+        # キャッシュの無効化とスナップショットの更新は1回ずつ
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(CartItem.objects.count(), 3)
+        self.assertEqual(set(Cart.objects.values_list('total_items', flat=True)), {1})
+        self.assertFalse(Cart.objects.inconsistent().exists())
+
+
+class NovelSearchTests(TestCase):
+    """全文検索インデックスによる小説の検索を確認"""
+
+    def setUp(self):
+        Novel.objects.bulk_create([
+            Novel(name='七つの魔剣が支配する', author='宇野朴人', publisher='電撃文庫', rank=1, price=Decimal('759.00'), year=2020),
+            Novel(name='魔剣の少女', author='作者', publisher='魔剣が支配する社', rank=2, price=Decimal('600.00'), year=2021),
+            Novel(name='りゅうおうのおしごと!', author='白鳥士郎', publisher='GA文庫', rank=3, price=Decimal('671.00'), year=2020),
+        ])
+
+    def search(self, **params):
+        response = self.client.get('/api/novels/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [novel['name'] for novel in response.json()['results']]
+
+    def test_japanese_substring_is_ranked_by_relevance(self):
+        # 小説名での一致は出版社での一致より上位
+        self.assertEqual(self.search(q='魔剣が支配'), ['七つの魔剣が支配する', '魔剣の少女'])
+        self.assertEqual(self.search(q='魔剣が支配', year='2021'), ['魔剣の少女'])
+        self.assertEqual(self.search(q='白鳥士郎 GA文庫'), ['りゅうおうのおしごと!'])
+
+    def test_index_follows_updates_and_deletes(self):
+        Novel.objects.filter(rank=3).update(name='新しい題名です')
+        self.assertEqual(self.search(q='おしごと'), [])
+        self.assertEqual(self.search(q='題名です'), ['新しい題名です'])
+        Novel.objects.filter(rank=3).delete()
+        self.assertEqual(self.search(q='題名です'), [])
+
+    def test_short_terms_fall_back_to_like(self):
+        self.assertEqual(self.search(q='魔剣'), ['魔剣の少女', '七つの魔剣が支配する'])
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search(q='"魔剣 OR NEAR('), [])
+        self.assertEqual(self.client.get('/api/novels/search/').status_code, 400)
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/cart/novel/', {'q': '魔剣が支配'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertTrue(any('cart_novel_fts MATCH' in query['sql'] for query in ctx.captured_queries))
+
+
+@skipIf(images.Image is None, 'Pillowがインストールされていません')
+class ImagePipelineTests(TestCase):
+    """build_imagesコマンドによる縮小画像とマニフェストの作成を確認"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source_dir = os.path.join(tmp.name, 'image')
+        self.output_dir = os.path.join(self.source_dir, 'build')
+        os.makedirs(os.path.join(self.source_dir, '2025'))
+        images.Image.new('RGB', (400, 600), (200, 30, 30)).save(os.path.join(self.source_dir, '2025', '1.jpg'))
+        override = override_settings(
+            NOVEL_IMAGES={'SOURCE_DIR': self.source_dir, 'OUTPUT_DIR': self.output_dir,
+                          'WIDTHS': (160, 320, 640), 'FORMATS': {'webp': 75}},
+            RANKING_SNAPSHOT_DIR=os.path.join(tmp.name, 'snapshots'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(images.image_manifest.reset)
+        ranking_cache.clear()
+        create_novels(2, year=2025)
+
+    def build(self):
+        out = StringIO()
+        call_command('build_images', stdout=out)
+        return out.getvalue()
+
+    def test_variants_are_hashed_and_returned_per_novel(self):
+        self.assertIn('作成 1 枚', self.build())
+        novels = self.client.get('/api/novels/', {'year': '2025'}).json()['results']
+        first, second = novels
+        self.assertIsNone(second['images'])
+        self.assertEqual(first['images']['src'], '/image/2025/1.jpg')
+        self.assertEqual((first['images']['width'], first['images']['height']), (400, 600))
+        srcset = first['images']['webp'].split(', ')
+        # 元画像より大きい幅（640）は作成しない
+        self.assertEqual([entry.rsplit(' ', 1)[1] for entry in srcset], ['160w', '320w', '400w'])
+        url = srcset[0].split(' ')[0]
+        self.assertRegex(url, r'^/image/build/2025/1-160\.[0-9a-f]{10}\.webp$')
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, url[len('/image/build/'):])))
+
+    def test_unchanged_sources_are_reused_and_stale_files_removed(self):
+        self.build()
+        self.assertIn('再利用 1 枚', self.build())
+        images.Image.new('RGB', (400, 600), (30, 30, 200)).save(os.path.join(self.source_dir, '2025', '1.jpg'))
+        self.assertIn('作成 1 枚, 再利用 0 枚, 削除 0 ファイル', self.build())
+        # 直前の世代のファイルは次の作成まで残す
+        self.assertIn('作成 0 枚, 再利用 1 枚, 削除 3 ファイル', self.build())
+
+    def test_rebuild_keeps_previous_generation_files(self):
+        self.build()
+        old_url = self.client.get('/api/novels/', {'year': '2025'}).json()['results'][0]['images']['webp'].split(' ')[0]
+        old_path = os.path.join(self.output_dir, old_url[len('/image/build/'):])
+        images.Image.new('RGB', (400, 600), (30, 30, 200)).save(os.path.join(self.source_dir, '2025', '1.jpg'))
+        self.build()
+        new_url = self.client.get('/api/novels/', {'year': '2025'}).json()['results'][0]['images']['webp'].split(' ')[0]
+        self.assertNotEqual(new_url, old_url)
+        # 古いマニフェストやキャッシュから参照されている画像はまだ取得できる
+        self.assertTrue(os.path.exists(old_path))
+        images.Image.new('RGB', (400, 600), (30, 200, 30)).save(os.path.join(self.source_dir, '2025', '1.jpg'))
+        self.build()
+        self.assertFalse(os.path.exists(old_path))
+
+    def test_building_images_changes_novel_etags(self):
+        novel = Novel.objects.get(rank=1)
+        paths = ('/api/novels/?year=2025', f'/api/novels/{novel.pk}/', f'/api/async/novels/{novel.pk}/')
+        etags = {path: self.client.get(path)['ETag'] for path in paths}
+        self.build()
+        for path, etag in etags.items():
+            with self.subTest(path=path):
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                data = response.json()
+                self.assertIsNotNone((data['results'][0] if 'results' in data else data)['images'])
+
+
+class ResponseCompressionTests(TestCase):
+    """APIのJSONレスポンスが圧縮されることを確認"""
+
+    def setUp(self):
+        ranking_cache.clear()
+        create_novels(10)
+
+    def test_json_is_gzipped_when_accepted(self):
+        plain = self.client.get('/api/novels/')
+        response = self.client.get('/api/novels/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(len(response.content), len(plain.content) / 3)
+
+    def test_conditional_request_matches_compressed_etag(self):
+        response = self.client.get('/api/novels/', HTTP_ACCEPT_ENCODING='gzip')
+        cached = self.client.get('/api/novels/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+
+class PerformanceMetricsTests(TestCase):
+    """リクエストの計測ミドルウェアと /api/_metrics を確認"""
+
+    def setUp(self):
+        from backend.metrics import registry
+        self.registry = registry
+        registry.reset()
+        ranking_cache.clear()
+        create_novels(3)
+
+    def test_server_timing_reports_queries_and_phases(self):
+        response = self.client.get('/api/novels/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[0-9.]+;desc="3 queries"')
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('render;dur=', timing)
+        self.assertRegex(timing, r'total;dur=[0-9.]+$')
+
+    def test_routes_are_aggregated_by_view_name(self):
+        for pk in Novel.objects.values_list('pk', flat=True):
+            self.client.get(f'/api/novels/{pk}/')
+        self.client.get('/api/novels/')
+        routes = self.registry.snapshot()['routes']
+        self.assertEqual(routes['GET novel-detail']['count'], 3)
+        self.assertEqual(routes['GET novel-detail']['queries']['p99'], 1)
+        self.assertEqual(routes['GET novel-list']['count'], 1)
+        self.assertGreater(routes['GET novel-list']['bytes_mean'], 0)
+
+    def test_metrics_endpoint_requires_admin(self):
+        self.client.get('/api/novels/')
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        data = self.client.get('/api/_metrics').json()
+        self.assertEqual(set(data['routes']['GET novel-list']['duration_ms']), {'p50', 'p95', 'p99', 'max', 'mean'})
+        self.assertEqual(self.client.delete('/api/_metrics').status_code, 204)
+        self.assertEqual(set(self.registry.snapshot()['routes']), {'DELETE metrics'})
+
+    def test_histogram_percentiles(self):
+        from backend.metrics import Histogram
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertAlmostEqual(histogram.percentile(50), 50, delta=50 * 0.2)
+        self.assertAlmostEqual(histogram.percentile(99), 99, delta=99 * 0.2)
+        self.assertEqual(histogram.percentile(100), 100)
+
+
+class AdminChangelistTests(TestCase):
+    """管理サイトの変更リストのクエリ数が行数に依存せず、集計列で並べ替えできることを確認"""
+
+    def setUp(self):
+        self.novels = create_novels(5)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def create_carts(self, count):
+        for i in range(count):
+            user = User.objects.create_user(f'user{Cart.objects.count()}')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, novel=novel, quantity=i + 1) for novel in self.novels[:3]
+            ])
+        Cart.objects.recalculate_totals()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_cart_changelist_query_count_is_constant(self):
+        self.create_carts(2)
+        small, _ = self.count_queries('/admin/cart/cart/')
+        self.create_carts(20)
+        large, response = self.count_queries('/admin/cart/cart/')
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context['cl'].result_list), 22)
+
+    def test_cart_totals_are_sortable(self):
+        self.create_carts(3)
+        # 総金額の降順（list_displayの5列目）
+        _, response = self.count_queries('/admin/cart/cart/?o=-5')
+        carts = list(response.context['cl'].result_list)
+        self.assertEqual([cart.total_items for cart in carts], [9, 6, 3])
+        self.assertEqual(carts[0].total_amount, Decimal('94.50'))
+        empty = Cart.objects.create(session_key='empty')
+        _, response = self.count_queries('/admin/cart/cart/?o=4')
+        first = response.context['cl'].result_list[0]
+        self.assertEqual((first.pk, first.total_items, first.total_amount), (empty.pk, 0, 0))
+
+    def test_cart_item_changelist_query_count_is_constant(self):
+        self.create_carts(1)
+        small, _ = self.count_queries('/admin/cart/cartitem/')
+        self.create_carts(10)
+        large, response = self.count_queries('/admin/cart/cartitem/')
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context['cl'].result_list), 33)
+
+    def test_cart_item_input_filters(self):
+        self.create_carts(2)
+        cart = Cart.objects.order_by('id').first()
+        _, response = self.count_queries(f'/admin/cart/cartitem/?cart_id={cart.pk}')
+        self.assertEqual({item.cart_id for item in response.context['cl'].result_list}, {cart.pk})
+        self.assertContains(response, f'value="{cart.pk}"')
+        _, response = self.count_queries('/admin/cart/cartitem/?novel=小説2')
+        self.assertEqual({item.novel.name for item in response.context['cl'].result_list}, {'小説2'})
+        for value in ('abc', '²', '9' * 30):
+            _, response = self.count_queries(f'/admin/cart/cartitem/?cart_id={value}')
+            self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_change_forms_render(self):
+        self.create_carts(1)
+        cart = Cart.objects.get()
+        item = cart.items.first()
+        self.assertEqual(self.client.get(f'/admin/cart/cart/{cart.pk}/change/').status_code, 200)
+        self.assertEqual(self.client.get(f'/admin/cart/cartitem/{item.pk}/change/').status_code, 200)
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'cart', 'model_name': 'cartitem', 'field_name': 'cart', 'term': 'user',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+
+class CartTotalsTests(TestCase):
+    """カートの合計列がアイテム・価格の変更と同じトランザクションで更新されることを確認"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.novels = create_novels(3)
+
+    def cart(self):
+        return Cart.objects.get()
+
+    def assert_totals(self, total_items, total_amount):
+        cart = self.cart()
+        self.assertEqual((cart.total_items, cart.total_amount), (total_items, Decimal(total_amount)))
+        self.assertFalse(Cart.objects.inconsistent().exists())
+
+    def test_cart_mutations_update_totals(self):
+        response = self.client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk, 'quantity': 2}, format='json')
+        self.assertEqual(response.json()['total_items'], 2)
+        self.client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk}, format='json')
+        self.assert_totals(3, '31.50')
+        item = CartItem.objects.get()
+        self.client.put('/api/cart/update_item/', {'item_id': item.pk, 'quantity': -1}, format='json')
+        self.assert_totals(2, '21.00')
+        self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'novel_id': self.novels[1].pk, 'quantity': 4},
+            {'op': 'remove', 'item_id': item.pk},
+        ]}, format='json')
+        self.assert_totals(4, '42.00')
+        new_item = CartItem.objects.get()
+        self.client.delete(f'/api/cart/remove_item/?item_id={new_item.pk}')
+        self.assert_totals(0, '0')
+        self.client.post('/api/cart/add_item/', {'novel_id': self.novels[2].pk}, format='json')
+        self.client.delete('/api/cart/clear/')
+        self.assert_totals(0, '0')
+
+    def test_novel_price_change_and_delete_reconcile_totals(self):
+        self.client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk, 'quantity': 2}, format='json')
+        self.client.post('/api/cart/add_item/', {'novel_id': self.novels[1].pk}, format='json')
+        novel = Novel.objects.get(pk=self.novels[0].pk)
+        novel.price = Decimal('100.00')
+        novel.save()
+        self.assert_totals(3, '210.50')
+        novel.delete()
+        self.assert_totals(1, '10.50')
+
+    def test_import_reconciles_totals(self):
+        from .importer import import_novels
+        self.client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk, 'quantity': 2}, format='json')
+        import_novels([{'name': '小説1', 'author': '作者1', 'publisher': '出版社', 'rank': 1, 'price': '5', 'year': 2025}])
+        self.assert_totals(2, '10.00')
+
+    def test_check_command_reports_and_fixes(self):
+        self.client.post('/api/cart/add_item/', {'novel_id': self.novels[0].pk}, format='json')
+        call_command('check_cart_totals', stdout=StringIO())
+        Cart.objects.update(total_items=7)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_cart_totals', stdout=out)
+        self.assertIn('商品総数 7 -> 1', out.getvalue())
+        call_command('check_cart_totals', '--fix', stdout=StringIO())
+        self.assert_totals(1, '10.50')
+
+
+class AsyncViewTests(TestCase):
+    """非同期版のAPIが同期版と同じレスポンスを返すことを確認"""
+
+    def setUp(self):
+        ranking_cache.clear()
+        self.novels = create_novels(15)
+
+    def test_novel_list_and_detail_match_sync_views(self):
+        for query in ('', '?page=2', '?year=2025&page_size=5&count=false', '?year=abc'):
+            with self.subTest(query=query):
+                expected = self.client.get(f'/api/novels/{query}')
+                actual = self.client.get(f'/api/async/novels/{query}')
+                self.assertEqual(actual.status_code, 200)
+                # ページのリンクは非同期版のURLを指す
+                for key in ('next', 'previous'):
+                    self.assertEqual(
+                        (actual.json()[key] or '').replace('/api/async/', '/api/'), expected.json()[key] or ''
+                    )
+                self.assertEqual(actual.json()['results'], expected.json()['results'])
+                self.assertEqual(actual.json().get('count'), expected.json().get('count'))
+                if 'count=false' not in query:
+                    # 件数を数えるモードのETagは件数と最終更新日時から作るため同期版と一致する
+                    self.assertEqual(actual['ETag'], expected['ETag'])
+        self.assertEqual(self.client.get('/api/async/novels/?page=9').status_code, 404)
+        self.assertEqual(self.client.get('/api/async/novels/?page=abc').status_code, 404)
+        pk = self.novels[0].pk
+        self.assertEqual(self.client.get(f'/api/async/novels/{pk}/').content, self.client.get(f'/api/novels/{pk}/').content)
+        self.assertEqual(self.client.get('/api/async/novels/999999/').status_code, 404)
+        self.assertEqual(self.client.post('/api/async/novels/').status_code, 405)
+
+    def test_novel_list_uses_ranking_cache(self):
+        for query in ('?page=2&page_size=5', '?count=false'):
+            with self.subTest(query=query):
+                first = self.client.get(f'/api/async/novels/{query}')
+                # 2回目はキャッシュから返すためクエリを発行しない
+                with self.assertNumQueries(0):
+                    second = self.client.get(f'/api/async/novels/{query}')
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second['ETag'], first['ETag'])
+                with self.assertNumQueries(0):
+                    response = self.client.get(f'/api/async/novels/{query}', HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(response.status_code, 304)
+        # 同期版のページはリンクのURLが異なるため別のエントリになる
+        self.assertEqual(
+            self.client.get('/api/novels/?page=2&page_size=5').json()['next'],
+            'http://testserver/api/novels/?page=3&page_size=5'
+        )
+        # 小説が更新されるとキャッシュは無効化される
+        with self.captureOnCommitCallbacks(execute=True):
+            Novel.objects.get(pk=self.novels[0].pk).save()
+        with self.assertNumQueries(2):
+            self.client.get('/api/async/novels/?page=2&page_size=5')
+
+    def test_novel_list_rejects_cursor_pagination(self):
+        response = self.client.get('/api/async/novels/?pagination=cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+    def test_cart_mutations_share_the_session_cart(self):
+        client = APIClient()
+        response = client.post('/api/async/cart/add_item/', {'novel_id': self.novels[0].pk, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total_items'], 2)
+        # 同期版と非同期版は同じカートを参照する
+        client.post('/api/cart/add_item/', {'novel_id': self.novels[1].pk}, format='json')
+        self.assertEqual(client.get('/api/async/cart/').content, client.get('/api/cart/').content)
+        item = CartItem.objects.get(novel=self.novels[0])
+        response = client.put(
+            '/api/async/cart/update_item/?response=delta', {'item_id': item.pk, 'quantity': -1}, format='json'
+        )
+        self.assertEqual(response.json()['item']['quantity'], 1)
+        self.assertEqual(response.json()['total_items'], 2)
+        self.assertEqual(client.delete(f'/api/async/cart/remove_item/?item_id={item.pk}').json()['total_items'], 1)
+        response = client.post('/api/async/cart/batch/', {'operations': [
+            {'op': 'add', 'novel_id': self.novels[2].pk, 'quantity': 3},
+        ]}, format='json')
+        self.assertEqual(response.json()['total_items'], 4)
+        self.assertEqual(client.get('/api/async/cart/summary/').json(), client.get('/api/cart/summary/').json())
+        self.assertEqual(client.delete('/api/async/cart/clear/').json()['items'], [])
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_cart_validation_errors(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/async/cart/').json(), client.get('/api/cart/').json())
+        self.assertEqual(Cart.objects.count(), 0)
+        response = client.post('/api/async/cart/add_item/', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post('/api/async/cart/add_item/', {'novel_id': 999999}, format='json')
+        self.assertEqual(response.json(), {'error': '小説が存在しません'})
+        response = client.post('/api/async/cart/add_item/', 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_asgi_request_is_measured(self):
+        response = await self.async_client.get('/api/async/novels/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[0-9.]+;desc="2 queries"')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+
+class AuthHashingTests(TestCase):
+    """ログイン・登録のパスワードのハッシュ計算の制限と、登録のクエリを確認"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.lock_dir.cleanup)
+        settings = override_settings(PASSWORD_HASHING={'MAX_CONCURRENT': 1, 'MAX_WAIT': 0, 'LOCK_DIR': self.lock_dir.name})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def register(self, username='reader', email='reader@example.com'):
+        return self.client.post('/api/auth/register/', {
+            'username': username, 'email': email, 'password': 'secret123', 'confirm_password': 'secret123',
+        }, format='json')
+
+    def test_register_and_login(self):
+        self.assertEqual(self.register().status_code, 201)
+        self.assertTrue(User.objects.get(username='reader').check_password('secret123'))
+        response = self.client.post('/api/auth/login/', {'username': 'reader', 'password': 'secret123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/auth/login/', {'username': 'reader', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_register_conflicts_are_detected_by_unique_constraints(self):
+        User.objects.create_user('reader', 'reader@example.com', 'secret123')
+        for username, email, error in (
+            ('reader', 'other@example.com', 'ユーザー名は既に存在します'),
+            ('other', 'reader@example.com', 'メールアドレスは既に使用されています'),
+        ):
+            with self.subTest(username=username), CaptureQueriesContext(connection) as ctx:
+                response = self.register(username, email)
+            self.assertEqual(response.json(), {'error': error})
+            # 事前の重複確認はせず、INSERTの一意制約違反で検出する
+            self.assertTrue(ctx.captured_queries[1]['sql'].startswith('INSERT INTO "auth_user"'))
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_register_race_is_detected_by_unique_constraint(self):
+        from django.contrib.auth.models import AbstractBaseUser
+        set_password = AbstractBaseUser.set_password
+
+        for existing, registering, error in (
+            (('first', 'other@example.com'), ('first', 'first@example.com'), 'ユーザー名は既に存在します'),
+            (('other', 'second@example.com'), ('second', 'second@example.com'), 'メールアドレスは既に使用されています'),
+        ):
+            def register_concurrently(user, password, existing=existing):
+                # ハッシュの計算中に同じユーザー名・メールアドレスが登録された場合
+                User.objects.create(username=existing[0], email=existing[1])
+                set_password(user, password)
+
+            with self.subTest(error=error), mock.patch.object(User, 'set_password', register_concurrently):
+                response = self.register(*registering)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': error})
+        self.assertFalse(User.objects.filter(username='second').exists())
+
+    def test_lock_dir_is_private_and_outside_shared_tmp(self):
+        from django.conf import settings as django_settings
+        from .hashing import get_config, hashing_slots
+        with override_settings(PASSWORD_HASHING={}):
+            self.assertEqual(get_config()['LOCK_DIR'], os.path.join(django_settings.BASE_DIR, 'password_hashing_locks'))
+        lock_dir = os.path.join(self.lock_dir.name, 'locks')
+        with override_settings(PASSWORD_HASHING={'LOCK_DIR': lock_dir}), hashing_slots.slot():
+            self.assertEqual(os.stat(lock_dir).st_mode & 0o777, 0o700)
+
+    def test_saturated_hashing_returns_503(self):
+        from .hashing import hashing_slots
+        User.objects.create_user('reader', 'reader@example.com', 'secret123')
+        with hashing_slots.slot():
+            response = self.client.post('/api/auth/login/', {'username': 'reader', 'password': 'secret123'}, format='json')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(self.register('other', 'other@example.com').status_code, 503)
+            self.assertFalse(User.objects.filter(username='other').exists())
+        response = self.client.post('/api/auth/login/', {'username': 'reader', 'password': 'secret123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class CartMergeTests(TestCase):
+    """ログイン時の匿名カートの統合を確認"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.novels = create_novels(30)
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'secret123')
+        self.lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.lock_dir.cleanup)
+        settings = override_settings(PASSWORD_HASHING={'LOCK_DIR': self.lock_dir.name})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def add(self, novel, quantity):
+        response = self.client.post('/api/cart/add_item/', {'novel_id': novel.pk, 'quantity': quantity}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def login(self):
+        response = self.client.post('/api/auth/login/', {'username': 'reader', 'password': 'secret123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def make_user_cart(self, items):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, novel=novel, quantity=q) for novel, q in items])
+        Cart.objects.filter(pk=cart.pk).recalculate_totals()
+        return cart
+
+    def test_login_merges_anonymous_cart(self):
+        user_cart = self.make_user_cart([(self.novels[0], 1), (self.novels[1], 4)])
+        self.add(self.novels[0], 2)
+        self.add(self.novels[2], 3)
+        anonymous = Cart.objects.get(user__isnull=True)
+        self.login()
+        self.assertFalse(Cart.objects.filter(pk=anonymous.pk).exists())
+        self.assertEqual(
+            dict(user_cart.items.values_list('novel_id', 'quantity')),
+            {self.novels[0].pk: 3, self.novels[1].pk: 4, self.novels[2].pk: 3},
+        )
+        user_cart.refresh_from_db()
+        self.assertEqual((user_cart.total_items, user_cart.total_amount), (10, Decimal('105.00')))
+        self.assertFalse(Cart.objects.inconsistent().exists())
+        # ログイン後もカートAPIはユーザーのカートを参照し、新しいカートを作成しない
+        self.assertEqual(self.client.get('/api/cart/').json()['id'], user_cart.pk)
+        self.add(self.novels[3], 1)
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(user_cart.items.count(), 4)
+
+    def test_login_adopts_anonymous_cart_without_user_cart(self):
+        self.add(self.novels[0], 2)
+        anonymous = Cart.objects.get()
+        self.login()
+        self.assertEqual(Cart.objects.get().pk, anonymous.pk)
+        self.assertEqual(Cart.objects.get().user, self.user)
+
+    def test_register_adopts_anonymous_cart(self):
+        self.add(self.novels[0], 2)
+        response = self.client.post('/api/auth/register/', {
+            'username': 'newcomer', 'email': 'new@example.com', 'password': 'secret123', 'confirm_password': 'secret123',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Cart.objects.get().user.username, 'newcomer')
+
+    def test_login_without_anonymous_cart_reuses_user_cart(self):
+        user_cart = self.make_user_cart([(self.novels[0], 1)])
+        self.login()
+        self.assertEqual(self.client.get('/api/cart/').json()['id'], user_cart.pk)
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_login_on_another_device_keeps_existing_sessions(self):
+        user_cart = self.make_user_cart([(self.novels[0], 1)])
+        self.login()
+        other = APIClient()
+        other.post('/api/cart/add_item/', {'novel_id': self.novels[1].pk, 'quantity': 2}, format='json')
+        response = other.post('/api/auth/login/', {'username': 'reader', 'password': 'secret123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # 両方のセッションが統合後の同じカートを参照する
+        for client in (self.client, other):
+            data = client.get('/api/cart/').json()
+            self.assertEqual(data['id'], user_cart.pk)
+            self.assertEqual(len(data['items']), 2)
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_merge_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size in (1, 20):
+            with self.subTest(size=size):
+                Cart.objects.all().delete()
+                user_cart = self.make_user_cart([(novel, 1) for novel in self.novels[:size]])
+                anonymous = Cart.objects.create(session_key=f'anonymous-{size}')
+                CartItem.objects.bulk_create([CartItem(cart=anonymous, novel=novel, quantity=2) for novel in self.novels[:size + 5]])
+                with CaptureQueriesContext(connection) as ctx:
+                    user_cart.merge_from(anonymous)
+                counts.append(len(ctx.captured_queries))
+                self.assertEqual(set(user_cart.items.values_list('quantity', flat=True)), {2, 3})
+                self.assertEqual(user_cart.items.count(), size + 5)
+        self.assertEqual(counts[0], counts[1])
@@ -1,12 +1,28 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import NovelViewSet, CartViewSet, AuthViewSet
+from . import async_views
+from .views import NovelViewSet, CartViewSet, AuthViewSet, metrics
 
 router = DefaultRouter()
 router.register(r'novels', NovelViewSet, basename='novel')
 router.register(r'cart', CartViewSet, basename='cart')
 router.register(r'auth', AuthViewSet, basename='auth')
 
+# 非同期版のAPI（ASGIサーバーで実行した場合にワーカーをブロックしない）
+async_urlpatterns = [
+    path('novels/', async_views.novel_list, name='async-novel-list'),
+    path('novels/<int:pk>/', async_views.novel_detail, name='async-novel-detail'),
+    path('cart/', async_views.cart_detail, name='async-cart-list'),
+    path('cart/summary/', async_views.cart_summary, name='async-cart-summary'),
+    path('cart/add_item/', async_views.cart_add_item, name='async-cart-add-item'),
+    path('cart/update_item/', async_views.cart_update_item, name='async-cart-update-item'),
+    path('cart/remove_item/', async_views.cart_remove_item, name='async-cart-remove-item'),
+    path('cart/batch/', async_views.cart_batch, name='async-cart-batch'),
+    path('cart/clear/', async_views.cart_clear, name='async-cart-clear'),
+]
+
 urlpatterns = [
+    path('_metrics', metrics, name='metrics'),
+    path('async/', include(async_urlpatterns)),
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
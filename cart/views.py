@@ -1,39 +1,322 @@
+import os
+import secrets
+from datetime import datetime, timezone as dt_timezone
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.settings import api_settings
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework import status, viewsets
 from .models import Novel, Cart, CartItem
-from .serializers import NovelSerializer, CartSerializer, CartItemSerializer
+from .serializers import NovelSerializer, CartSerializer, CartItemSerializer, NovelRowSerializer, CartReadSerializer
+from .cache import ranking_cache
+from .pagination import MAX_PAGE_SIZE, NovelKeysetPagination, NovelPageNumberPagination, parse_positive_int, parse_year
+from . import export, search, snapshots
+from .conditional import make_etag, not_modified_response, set_validators
+from .hashing import HashingBusy, hashing_slots
+from .images import image_manifest
+from backend.metrics import phase, registry as metrics_registry
 from django.shortcuts import get_object_or_404
-from django.http import Http404
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
 from django.contrib.auth import authenticate, login, logout
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from django.contrib.auth.models import User
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import action
 
+# 読み取り専用の高速シリアライザ（フィールド情報は起動時に一度だけ構築）
+novel_row_serializer = NovelRowSerializer()
+cart_read_serializer = CartReadSerializer()
+
 class NovelViewSet(viewsets.ReadOnlyModelViewSet):
     """小説ビューセット、小説リストと詳細を取得するために使用"""
     queryset = Novel.objects.all().order_by('rank')
     serializer_class = NovelSerializer
     permission_classes = [AllowAny]
+    pagination_class = NovelPageNumberPagination
+    # ?pagination=cursor で選択できるページネーション
+    pagination_classes = {'cursor': NovelKeysetPagination}
+    # キャッシュキーに含めるクエリパラメータ（レスポンスの内容を変えるもの）
+    # カーソル方式のページはキャッシュしないため、pagination・cursorは含めない
+    CACHE_KEY_PARAMS = ('year', 'page', 'page_size', 'count')
+    # values_list()の行から (year, rank, id) を取り出すための列位置
+    CURSOR_POSITION_INDEXES = tuple(
+        NovelRowSerializer.fields.index(field) for field in NovelKeysetPagination.ordering
+    )
+    
+    @property
+    def paginator(self):
+        """クエリパラメータに応じてページネーションクラスを選択"""
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.pagination_classes.get(
+                self.request.query_params.get('pagination'), self.pagination_class
+            )
+            self._paginator = pagination_class()
+        return self._paginator
+    
+    def get_cursor_position(self, row):
+        """values_list()の行からカーソルのキー (year, rank, id) を取得"""
+        return tuple(row[index] for index in self.CURSOR_POSITION_INDEXES)
     
     def get_queryset(self):
         """年パラメータによって小説リストをフィルタリング"""
-        queryset = super().get_queryset()
-        year = self.request.query_params.get('year')
+        return self.filter_by_year(super().get_queryset(), self.request.query_params)
+    
+    # 以下のメソッドはクエリパラメータ・リクエストを引数で受け取り、非同期版の小説リストでも使用する
+    @staticmethod
+    def filter_by_year(queryset, params):
+        """年フィールドによって小説をフィルタリング（整数でない年・範囲外の年は該当なし）"""
+        year = params.get('year')
         if year:
-            # 年フィールドによって小説をフィルタリング
-            queryset = queryset.filter(year=year)
+            try:
+                queryset = queryset.filter(year=parse_year(year))
+            except ValueError:
+                return queryset.none()
         return queryset
+    
+    @staticmethod
+    def fingerprint_aggregates():
+        """ETagとLast-Modifiedの計算に使う集計式"""
+        return {'count': Count('id'), 'last_modified': Max('updated_at')}
+    
+    @staticmethod
+    def make_fingerprint(stats):
+        """件数と最終更新日時（画像のマニフェストを含む）からETagとLast-Modifiedを計算（本文をシリアライズせずに済む）"""
+        etag = make_etag('novels', stats['count'], stats['last_modified'], image_manifest.generation)
+        return etag, image_manifest.last_modified(stats['last_modified'])
+    
+    @staticmethod
+    def make_page_etag(data):
+        """件数を数えないモードのETag（ページの内容から作成）"""
+        return make_etag('novels-page', data)
+    
+    def get_cached_page(self, request):
+        """ランキングキャッシュのキーと、キャッシュ済みの (etag, last_modified, data) を返す（なければNone）
+
+        ページのリンクは絶対URLのため、ホストとパス（同期版・非同期版）ごとに別のキーにする。
+        画像のマニフェストが作り直された場合も別のキーにする（他のワーカーのキャッシュも使われなくなる）。
+        """
+        cache_key = ranking_cache.make_key(
+            request.get_host(), request.path, image_manifest.generation,
+            *(request.GET.get(name, '') for name in self.CACHE_KEY_PARAMS)
+        )
+        return cache_key, ranking_cache.get(cache_key)
+    
+    def get_fingerprint(self, queryset):
+        """絞り込み済みの小説リストのETagとLast-Modified"""
+        return self.make_fingerprint(queryset.order_by().aggregate(**self.fingerprint_aggregates()))
+    
+    def list(self, request, *args, **kwargs):
+        """年とページ番号ごとにシリアライズ済みのランキングページをキャッシュから返す"""
+        cache_key = cached = None
+        if not self.uses_cursor():
+            cache_key, cached = self.get_cached_page(request)
+        if cached is not None:
+            etag, last_modified, data = cached
+        elif self.counts_rows():
+            etag, last_modified = self.get_fingerprint(self.get_queryset())
+            data = None
+        else:
+            # 件数を数えないモードでは集計クエリを避け、ページの内容からETagを作成する
+            etag = last_modified = data = None
+        
+        # 変更がなければシリアライズする前に304を返す
+        if etag is not None:
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+        
+        if data is None:
+            # ModelSerializerを使わず、values_list()の行から直接シリアライズする
+            queryset = self.filter_queryset(self.get_queryset()).values_list(*novel_row_serializer.columns)
+            page = self.paginate_queryset(queryset)
+            with phase('serialize'):
+                if page is None:
+                    data = [novel_row_serializer.to_representation(row) for row in queryset]
+                else:
+                    data = [novel_row_serializer.to_representation(row) for row in page]
+            if page is not None:
+                data = self.get_paginated_response(data).data
+            if etag is None:
+                etag = self.make_page_etag(data)
+                not_modified = not_modified_response(request, etag)
+                if not_modified is not None:
+                    return not_modified
+            if cache_key is not None:
+                ranking_cache.set(cache_key, (etag, last_modified, data))
+        return set_validators(Response(data), etag, last_modified)
+    
+    def uses_cursor(self):
+        """カーソル方式のページネーションか
+
+        カーソル方式はカタログ全体を一度だけ辿る用途のため、ページをキャッシュすると
+        よく参照される年・ページのエントリが追い出されてしまう。
+        """
+        return isinstance(self.paginator, NovelKeysetPagination)
+    
+    def counts_rows(self):
+        """レスポンスに総件数を含めるか（カーソル方式と ?count=false では数えない）"""
+        paginator = self.paginator
+        if isinstance(paginator, NovelPageNumberPagination):
+            return paginator.wants_count(self.request)
+        return paginator is None
+    
+    def retrieve(self, request, *args, **kwargs):
+        """小説の詳細を返す（ETagが一致する場合は304）"""
+        try:
+            row = Novel.objects.filter(pk=kwargs.get('pk')).values_list(
+                *novel_row_serializer.columns, 'updated_at'
+            ).first()
+        except (TypeError, ValueError):
+            raise Http404
+        if row is None:
+            raise Http404
+        last_modified = image_manifest.last_modified(row[-1])
+        etag = make_etag('novel', kwargs.get('pk'), row[-1], image_manifest.generation)
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        return set_validators(Response(novel_row_serializer.to_representation(row)), etag, last_modified)
+    
+    @action(detail=False, methods=['get'])
+    def ranking(self, request):
+        """事前に作成した年別ランキング全体のスナップショットをそのまま返す
+
+        Accept-Encodingに応じて事前圧縮済みのファイルを選び、ETagはファイルのfstatから作成する。
+        """
+        try:
+            year = parse_year(request.query_params.get('year', ''))
+        except ValueError:
+            return Response({'error': '年を数字で指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+        # 小説が存在しない年のスナップショットは作成しない
+        if snapshots.load_manifest(year) is None and not Novel.objects.filter(year=year).exists():
+            return Response({'error': 'ランキングが見つかりません'}, status=status.HTTP_404_NOT_FOUND)
+        
+        snapshot, encoding, manifest = snapshots.open_snapshot(year, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        stat = os.fstat(snapshot.fileno())
+        etag = make_etag('ranking', year, manifest['generation'], encoding, stat.st_size, stat.st_mtime_ns)
+        last_modified = datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc)
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            snapshot.close()
+            patch_vary_headers(not_modified, ['Accept-Encoding'])
+            return not_modified
+        
+        response = FileResponse(snapshot, content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['X-Snapshot-Generation'] = str(manifest['generation'])
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return set_validators(response, etag, last_modified)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """小説名・作者・出版社の全文検索（関連度順、?year=で年を絞り込み、?page_size=で件数を指定）"""
+        params = request.query_params
+        query = params.get('q', '').strip()
+        if not query:
+            return Response({'error': '検索キーワードを入力してください'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            year = parse_year(params['year']) if 'year' in params else None
+        except ValueError:
+            return Response({'error': '年を数字で指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = parse_positive_int(params.get('page_size', api_settings.PAGE_SIZE), MAX_PAGE_SIZE)
+        except ValueError:
+            limit = api_settings.PAGE_SIZE
+        
+        rows = search.search_rows(
+            query, novel_row_serializer.columns, year=year, limit=limit
+        )
+        return Response({
+            'query': query,
+            'results': [novel_row_serializer.to_representation(row) for row in rows],
+        })
+    
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_catalog(self, request):
+        """カタログ全体をNDJSONまたはCSVでストリーミング出力する
+
+        ?type=ndjson|csv（DRFが予約している format は使わない）、?dataset=novels|cart_items、?year=YYYY
+        カートの内容（cart_items）は管理者のみ出力できる。
+        """
+        params = request.query_params
+        export_type = params.get('type', 'ndjson')
+        dataset = params.get('dataset', 'novels')
+        if export_type not in export.FORMATS:
+            return Response({'error': '出力形式は ndjson または csv を指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+        if dataset not in export.DATASETS:
+            return Response({'error': '不明なデータセットです'}, status=status.HTTP_400_BAD_REQUEST)
+        if export.DATASETS[dataset][2] and not request.user.is_staff:
+            return Response({'error': 'このデータセットは管理者のみ出力できます'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            year = parse_year(params['year']) if 'year' in params else None
+        except ValueError:
+            return Response({'error': '年を数字で指定してください'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        content_type, extension, _ = export.FORMATS[export_type]
+        response = StreamingHttpResponse(
+            export.stream(dataset, export_type, year=year), content_type=content_type
+        )
+        filename = f"{dataset}-{year}.{extension}" if year is not None else f"{dataset}.{extension}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        """ランキングキャッシュの統計情報（管理者のみ）"""
+        return Response(ranking_cache.stats())
 
 class AuthViewSet(viewsets.ViewSet):
     """ユーザー認証ビューセット、ログイン、ログアウト、登録操作を処理"""
     permission_classes = [AllowAny]
     # CSRF保護を無効にする
     authentication_classes = []
+    # パスワードの処理が混み合っている場合に再試行を促す秒数（Retry-After）
+    BUSY_RETRY_AFTER = 1
+    
+    def busy_response(self, error):
+        """ハッシュ計算の空きがない場合の503レスポンス"""
+        return Response(
+            {'error': str(error)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(self.BUSY_RETRY_AFTER)}
+        )
+    
+    def attach_session_cart(self, request, user):
+        """ログイン前の匿名カートをユーザーのカートに引き継ぐ
+
+        カートAPIは認証情報を使わずセッションのカートキーでカートを識別するため、
+        ユーザーのカートのキーをセッションに保存し、ログイン後も同じカートを参照できるようにする。
+        ユーザーのカートのキーは変更しない（同じユーザーでログイン中の他のセッションが参照しているため）。
+        匿名カートはユーザーのカートに統合（Cart.merge_from）して同じトランザクションで削除し、
+        ユーザーのカートがなければ匿名カートをそのままユーザーのカートにする。
+        """
+        cart_view = CartViewSet()
+        cart_key = cart_view.get_cart_key(request)
+        with transaction.atomic():
+            anonymous = Cart.objects.filter(session_key=cart_key, user__isnull=True).first() if cart_key else None
+            cart = Cart.objects.filter(user=user).first()
+            if cart is None:
+                if anonymous is None:
+                    return None
+                cart = anonymous
+                Cart.objects.filter(pk=cart.pk).update(user=user)
+            else:
+                if anonymous is not None:
+                    cart.merge_from(anonymous)
+                if cart.session_key is None:
+                    # キーを持たないユーザーのカートは匿名カートのキー（なければ新しいキー）を引き継ぐ
+                    cart.session_key = anonymous.session_key if anonymous is not None else secrets.token_hex(16)
+                    Cart.objects.filter(pk=cart.pk).update(session_key=cart.session_key)
+        if request.session.get(cart_view.CART_KEY_SESSION_FIELD) != cart.session_key:
+            request.session[cart_view.CART_KEY_SESSION_FIELD] = cart.session_key
+        return cart
     
     @action(detail=False, methods=['post'])
     def register(self, request):
@@ -56,23 +339,26 @@ class AuthViewSet(viewsets.ViewSet):
             if len(password) < 6:
                 return Response({'error': 'パスワードの長さは少なくとも6文字必要です'}, status=status.HTTP_400_BAD_REQUEST)
             
-            # ユーザー名が既に存在するか確認
-            if User.objects.filter(username=username).exists():
-                return Response({'error': 'ユーザー名は既に存在します'}, status=status.HTTP_400_BAD_REQUEST)
+            # パスワードのハッシュは同時実行数を制限して計算する
+            user = User(username=User.normalize_username(username), email=User.objects.normalize_email(email))
+            try:
+                hashing_slots.run(user.set_password, password)
+            except HashingBusy as e:
+                return self.busy_response(e)
             
-            # メールアドレスが既に使用されているか確認
-            if User.objects.filter(email=email).exists():
+            # 新しいユーザーを1回のINSERTで作成し、ユーザー名・メールアドレスの重複は一意制約で検出する
+            # （メールアドレスの一意制約はマイグレーション0009の部分インデックス）
+            try:
+                with transaction.atomic():
+                    user.save()
+            except IntegrityError:
+                if User.objects.filter(username=user.username).exists():
+                    return Response({'error': 'ユーザー名は既に存在します'}, status=status.HTTP_400_BAD_REQUEST)
                 return Response({'error': 'メールアドレスは既に使用されています'}, status=status.HTTP_400_BAD_REQUEST)
             
-            # 新しいユーザーを作成
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password
-            )
-            
             # 新しいユーザーをログインさせる
             login(request, user)
+            self.attach_session_cart(request, user)
             
             return Response(
                 {'success': True, 'message': '登録が成功しました', 'user_id': user.id},
@@ -98,12 +384,17 @@ class AuthViewSet(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # ユーザーの認証情報を検証
-            user = authenticate(username=username, password=password)
+            # ユーザーの認証情報を検証（パスワードのハッシュ計算は同時実行数を制限する）
+            try:
+                user = hashing_slots.run(authenticate, username=username, password=password)
+            except HashingBusy as e:
+                return self.busy_response(e)
             
             if user is not None:
                 # ユーザーをログインさせる
                 login(request, user)
+                # ログイン前のカートをユーザーのカートに統合
+                self.attach_session_cart(request, user)
                 
                 # ユーザー情報を返す
                 user_data = {
@@ -144,7 +435,7 @@ class AuthViewSet(viewsets.ViewSet):
                     # ユーザーのカートを取得
                     cart = Cart.objects.get(user=request.user)
                     # カートを空にする
-                    cart.items.all().delete()
+                    cart.clear_items()
                 except Cart.DoesNotExist:
                     # カートが存在しない場合は無視
                     pass
@@ -173,7 +464,7 @@ class AuthViewSet(viewsets.ViewSet):
                     # ユーザーのカートを取得
                     cart = Cart.objects.get(user=request.user)
                     # カートを空にする
-                    cart.items.all().delete()
+                    cart.clear_items()
                 except Cart.DoesNotExist:
                     # カートが存在しない場合は無視
                     pass
@@ -214,56 +505,135 @@ class CartViewSet(viewsets.ViewSet):
     # カート追加の問題を解決するために一時的にCSRF保護を無効にする
     authentication_classes = []
     
-    # カートの保持戦略を設定：Falseはセッション終了後にカートの内容を保持しないことを意味する
-    PERSIST_CART_AFTER_SESSION = False
+    # カートの最終アクティビティ時間（Cart.updated_at）を更新する最小間隔（秒）
+    ACTIVITY_TOUCH_INTERVAL = 60
+    
+    # 匿名カートのキーを保存するセッション内のフィールド名
+    CART_KEY_SESSION_FIELD = 'cart_key'
     
-    def get_cart(self, request):
-        """現在のユーザーのカートを取得し、存在しない場合は作成する"""
+    def get_cart(self, request, create=True):
+        """現在のユーザーのカートを取得し、存在しない場合は作成する
+
+        create=Falseの場合（読み取り専用のリクエスト）はカートもセッションも作成せず、
+        カートがなければNoneを返す。読み取りではセッションへの書き込みを行わない。
+        非アクティブな匿名カートの期限切れ処理はリクエスト内では行わず、
+        sweep_cartsコマンド（cart/sweeper.py）でまとめて削除する。
+        """
         # ユーザーがログインしているか確認
         if request.user.is_authenticated:
             # ユーザーがログインしている場合、ユーザーに関連するカートを取得または作成
+            if not create:
+                return Cart.objects.filter(user=request.user).first()
             cart, created = Cart.objects.get_or_create(user=request.user)
-        else:
-            # ユーザーがログインしていない場合、session_keyを使用してカートを取得または作成
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.save()
-                session_key = request.session.session_key
-                
-            # カートが存在するか確認
-            try:
-                cart = Cart.objects.get(session_key=session_key)
-                
-                # セッション終了後にカートの内容を保持したくない場合、最終アクティビティ時間を確認
-                if not self.PERSIST_CART_AFTER_SESSION:
-                    # 現在の時間を取得
-                    current_time = timezone.now()
-                    # セッションに最終アクティビティ時間が含まれているか確認
-                    last_activity = request.session.get('last_cart_activity')
-                    
-                    if last_activity:
-                        # datetimeオブジェクトに変換
-                        last_activity_time = timezone.datetime.fromisoformat(last_activity)
-                        # 30分間（1800秒）アクティビティがないか確認
-                        time_diff = (current_time - last_activity_time).total_seconds()
-                        if time_diff > 1800:  # 30分
-                            # カートを空にする
-                            cart.items.all().delete()
-                
-                # セッション内の最終アクティビティ時間を更新
-                request.session['last_cart_activity'] = timezone.now().isoformat()
-            except Cart.DoesNotExist:
-                # カートが存在しない場合、新しいカートを作成
-                cart = Cart.objects.create(session_key=session_key)
-                # 初期アクティビティ時間を設定
-                request.session['last_cart_activity'] = timezone.now().isoformat()
+            return cart
+        
+        # ユーザーがログインしていない場合、セッションに保存したカートキーでカートを取得または作成
+        cart_key = self.get_cart_key(request)
+        cart = Cart.objects.filter(session_key=cart_key).first() if cart_key else None
+        if cart is None:
+            if not create:
+                return None
+            # カートが存在しない場合、新しいカートキーを発行してカートを作成
+            cart = Cart.objects.create(session_key=secrets.token_hex(16))
+        
+        # セッションエンジンに依存しないよう、カートキーをセッションのデータとして保存
+        # （旧方式のセッションキーで識別されていたカートもここで移行される）
+        if create and request.session.get(self.CART_KEY_SESSION_FIELD) != cart.session_key:
+            request.session[self.CART_KEY_SESSION_FIELD] = cart.session_key
+        
+        # 変更を伴うリクエストの場合のみ、最終アクティビティ時間を更新
+        if create:
+            self.touch_activity(cart)
         return cart
     
+    def get_cart_key(self, request):
+        """匿名カートを識別するキーをセッションから取得する
+
+        以前はセッションキーそのものでカートを識別していたが、署名付きCookieのように
+        セッションキーが安定しないエンジンでも動作するよう、カートキーをセッションの
+        データとして保持する。まだ移行されていないセッションは旧方式のキーを返す。
+        """
+        cart_key = request.session.get(self.CART_KEY_SESSION_FIELD)
+        if cart_key:
+            return cart_key
+        session_key = request.session.session_key
+        # 署名付きCookieのセッションキーはカートの識別に使えない（長さで判別）
+        if session_key and len(session_key) <= Cart._meta.get_field('session_key').max_length:
+            return session_key
+        return None
+    
+    def touch_activity(self, cart):
+        """カートの最終アクティビティ時間（updated_at）を更新する
+
+        期限切れ判定はupdated_atを基準に行う。毎回書き込まないよう、
+        前回の更新からACTIVITY_TOUCH_INTERVAL秒以上経過した場合のみ書き込む。
+        """
+        now = timezone.now()
+        if (now - cart.updated_at).total_seconds() >= self.ACTIVITY_TOUCH_INTERVAL:
+            Cart.objects.filter(pk=cart.pk).update(updated_at=now)
+            cart.updated_at = now
+    
+    def wants_delta(self, request):
+        """変更系APIで差分レスポンス（?response=delta）が要求されているか"""
+        return request.query_params.get('response') == 'delta'
+    
+    def delta_response(self, cart, item=None, removed_item_id=None, cleared=False, status_code=status.HTTP_200_OK):
+        """カート全体ではなく、変更されたアイテムと新しい合計・バージョンのみを返す"""
+        data = {
+            'item': item,
+            'removed_item_id': removed_item_id,
+            'cleared': cleared,
+        }
+        data.update(cart.summary())
+        return Response(data, status=status_code)
+    
+    def empty_cart_data(self):
+        """カートがまだ存在しない場合のレスポンス"""
+        return {
+            'id': None,
+            'user': None,
+            'items': [],
+            'created_at': None,
+            'updated_at': None,
+            'version': 0,
+            'total_items': 0,
+            'total_amount': 0,
+        }
+    
+    def serialize_cart(self, cart, refresh=True):
+        """アイテムと小説をまとめて読み込んでからカートをシリアライズ
+
+        変更後はDB上で進めたバージョン番号と合計を反映するため、refresh=Trueでカート行を読み直す。
+        """
+        if refresh:
+            cart.refresh_from_db(fields=['version', 'updated_at', 'total_items', 'total_amount'])
+        with phase('serialize'):
+            return cart_read_serializer.to_representation(cart)
+    
     def list(self, request):
-        """カートの内容を表示"""
-        cart = self.get_cart(request)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        """カートの内容を表示（ETagが一致する場合は304）"""
+        cart = self.get_cart(request, create=False)
+        if cart is None:
+            etag, last_modified = make_etag('cart', None), None
+        else:
+            etag, last_modified = cart.fingerprint()
+        not_modified = not_modified_response(request, etag, last_modified, private=True)
+        if not_modified is not None:
+            return not_modified
+        data = self.serialize_cart(cart, refresh=False) if cart is not None else self.empty_cart_data()
+        return set_validators(Response(data), etag, last_modified, private=True)
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """ヘッダーのバッジ用に商品総数と総金額のみを返す（ETagが一致する場合は304）"""
+        cart = self.get_cart(request, create=False)
+        # 取得したカート行の合計列をそのまま返す（カート行を読み込み直さない）
+        data = cart.loaded_summary() if cart is not None else dict(Cart.EMPTY_SUMMARY)
+        etag = make_etag('cart-summary', cart.pk if cart is not None else None, *data.values())
+        not_modified = not_modified_response(request, etag, private=True)
+        if not_modified is not None:
+            return not_modified
+        return set_validators(Response(data), etag, private=True)
     
     from django.views.decorators.csrf import csrf_exempt
     from django.utils.decorators import method_decorator
@@ -295,21 +665,14 @@ class CartViewSet(viewsets.ViewSet):
             except Novel.DoesNotExist:
                 return Response({'error': '小説が存在しません'}, status=status.HTTP_404_NOT_FOUND)
             
-            # カートにすでにその商品が存在するか確認
-            cart_item, created = CartItem.objects.get_or_create(cart=cart, novel=novel)
-            
-            # 商品が既に存在する場合は数量を増やす
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
-            else:
-                # 新しい商品の場合は数量を設定
-                cart_item.quantity = quantity
-                cart_item.save()
+            # 商品を追加（既存の場合は数量を原子的に加算）
+            cart.add_novel(novel, quantity)
             
-            # 更新されたカートを返す
-            serializer = CartSerializer(cart)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # 更新されたカート（または差分）を返す
+            if self.wants_delta(request):
+                item = cart_read_serializer.item(CartItem.objects.filter(cart=cart, novel=novel))
+                return self.delta_response(cart, item=item, status_code=status.HTTP_201_CREATED)
+            return Response(self.serialize_cart(cart), status=status.HTTP_201_CREATED)
             
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -335,28 +698,15 @@ class CartViewSet(viewsets.ViewSet):
             # カートを取得
             cart = self.get_cart(request)
             
-            # カートアイテムを取得
-            try:
-                cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            except CartItem.DoesNotExist:
+            # 数量を更新（正数の場合は増やし、負数の場合は減らす。0以下になった場合は削除）
+            if not cart.change_item_quantity(item_id, quantity):
                 return Response({'error': 'カートアイテムが存在しません'}, status=status.HTTP_404_NOT_FOUND)
             
-            # 数量を更新
-            # 正数の場合は数量を増やし、負数の場合は数量を減らす
-            new_quantity = cart_item.quantity + quantity
-            
-            # 数量が1以上であることを確認
-            if new_quantity <= 0:
-                # 数量が0以下の場合は商品を削除
-                cart_item.delete()
-            else:
-                # それ以外の場合は数量を更新
-                cart_item.quantity = new_quantity
-                cart_item.save()
-            
-            # 更新されたカートを返す
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
+            # 更新されたカート（または差分）を返す
+            if self.wants_delta(request):
+                item = cart_read_serializer.item(CartItem.objects.filter(cart=cart, id=item_id))
+                return self.delta_response(cart, item=item, removed_item_id=None if item else int(item_id))
+            return Response(self.serialize_cart(cart))
             
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -373,16 +723,70 @@ class CartViewSet(viewsets.ViewSet):
             # カートを取得
             cart = self.get_cart(request)
             
-            # カートアイテムを取得して削除
-            try:
-                cart_item = CartItem.objects.get(id=item_id, cart=cart)
-                cart_item.delete()
-            except CartItem.DoesNotExist:
+            # カートアイテムを削除
+            if not cart.remove_item(item_id):
                 return Response({'error': 'カートアイテムが存在しません'}, status=status.HTTP_404_NOT_FOUND)
             
-            # 更新されたカートを返す
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
+            # 更新されたカート（または差分）を返す
+            if self.wants_delta(request):
+                return self.delta_response(cart, removed_item_id=int(item_id))
+            return Response(self.serialize_cart(cart))
+            
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    # 一括操作で受け付ける最大操作数
+    MAX_BATCH_OPERATIONS = 100
+    
+    def parse_operation(self, index, operation):
+        """一括操作の1件を検証して (操作, 対象ID, 数量) に変換する。不正な場合はValueErrorを送出"""
+        if not isinstance(operation, dict):
+            raise ValueError(f'operations[{index}]: 操作はオブジェクトでなければなりません')
+        op = operation.get('op')
+        target_field = {'add': 'novel_id', 'update': 'item_id', 'remove': 'item_id'}.get(op)
+        if target_field is None:
+            raise ValueError(f'operations[{index}]: opはadd、update、removeのいずれかでなければなりません')
+        try:
+            target = int(operation.get(target_field))
+            quantity = int(operation.get('quantity', 1 if op == 'add' else 0))
+        except (TypeError, ValueError):
+            raise ValueError(f'operations[{index}]: {target_field}と数量は整数でなければなりません')
+        if op == 'add' and quantity <= 0:
+            raise ValueError(f'operations[{index}]: 数量は0より大きくなければなりません')
+        if op == 'update' and quantity == 0:
+            raise ValueError(f'operations[{index}]: 数量は0にすることができません')
+        return op, target, quantity
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """複数の追加・数量変更・削除をまとめて1つのトランザクションで適用"""
+        try:
+            # 本文がJSONのオブジェクトでない場合（リストなど）もoperationsの不正として扱う
+            operations = request.data.get('operations') if isinstance(request.data, dict) else None
+            if not isinstance(operations, list) or not operations:
+                return Response({'error': 'operationsは空でないリストでなければなりません'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(operations) > self.MAX_BATCH_OPERATIONS:
+                return Response(
+                    {'error': f'一度に送信できる操作は{self.MAX_BATCH_OPERATIONS}件までです'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            try:
+                parsed = [self.parse_operation(index, operation) for index, operation in enumerate(operations)]
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            
+            # カートを取得
+            cart = self.get_cart(request)
+            
+            # すべての操作を適用（失敗した場合は何も変更されない）
+            try:
+                cart.apply_operations(parsed)
+            except (Novel.DoesNotExist, CartItem.DoesNotExist) as e:
+                return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+            
+            # 最終的なカートを1回だけ返す
+            return Response(self.serialize_cart(cart))
             
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -395,11 +799,27 @@ class CartViewSet(viewsets.ViewSet):
             cart = self.get_cart(request)
             
             # カート内のすべての商品を削除
-            cart.items.all().delete()
+            cart.clear_items()
             
-            # 更新されたカートを返す
-            serializer = CartSerializer(cart)
-            return Response(serializer.data)
+            # 更新されたカート（または差分）を返す
+            if self.wants_delta(request):
+                return self.delta_response(cart, cleared=True)
+            return Response(self.serialize_cart(cart))
             
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """ルートごとの処理時間・クエリ数のパーセンタイル（管理者のみ、DELETEで集計をリセット）
+
+    集計はワーカープロセスごとに保持されるため、応答したプロセスの値のみが含まれる。
+    """
+    if request.method == 'DELETE':
+        metrics_registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    data = metrics_registry.snapshot()
+    data['pid'] = os.getpid()
+    return Response(data)
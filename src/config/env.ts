@@ -25,10 +25,12 @@ export const env = {
   
   // 购物车相关API路径
   CART_URL: '/cart/',
+  CART_SUMMARY_URL: '/cart/summary/',
   CART_ADD_ITEM_URL: '/cart/add_item/',
   CART_UPDATE_ITEM_URL: '/cart/update_item/',
   CART_REMOVE_ITEM_URL: '/cart/remove_item/',
   CART_CLEAR_URL: '/cart/clear/',
+  CART_BATCH_URL: '/cart/batch/',
 };
 
 // 拼接完整的API URL
@@ -1,6 +1,15 @@
 import { defineStore } from 'pinia'
 import { getApiUrl, env } from '../config/env'
 
+// 縮小画像の情報（manage.py build_images で作成、未作成の場合は null）
+export interface NovelImages {
+  src: string
+  width: number
+  height: number
+  avif?: string
+  webp?: string
+}
+
 // 小説データの型を定義
 interface Novel {
   id: number
@@ -9,6 +18,7 @@ interface Novel {
   publisher: string
   rank: number
   price: number
+  images?: NovelImages | null
 }
 
 // 年間小説データの型を定義
@@ -76,7 +86,7 @@ export const useNovelsStore = defineStore('novels', {
       this.yearlyNovels[targetYear].error = null
       
       try {
-        const novelsUrl = getApiUrl(`${env.NOVELS_URL}?year=${targetYear}`)
+        const novelsUrl = getApiUrl(`${env.NOVELS_URL}?year=${targetYear}&page_size=10&count=false`)
         const response = await fetch(novelsUrl)
         if (!response.ok) {
           throw new Error('小説の取得に失敗しました')